@@ -0,0 +1,18 @@
+import os
+import logging
+from captain.config import Config
+
+# Only errors, captain's INFO logging would swamp the numbers
+logging.basicConfig(level=logging.ERROR)
+
+
+def benchmark_config(**overrides):
+    """
+    A Config built from the environment as captain would, with overrides applied on top.
+    """
+    os.environ.setdefault("SLUG_RUNNER_COMMAND", "start web")
+    os.environ.setdefault("SLUG_RUNNER_IMAGE", "flynn/slugrunner")
+    config = Config()
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    return config
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+"""
+End-to-end load test: captain_web:app under gunicorn with gevent workers, against a fake Docker cluster.
+
+    $ python benchmarks/loadtest.py --nodes 10 --containers 50 --workers 2 --concurrency 20 --duration 30
+
+Reports throughput and p50/p95/p99 latency per endpoint. Run from the repository root.
+"""
+import os
+import sys
+import time
+import socket
+import random
+import argparse
+import threading
+import subprocess
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from captain.tests.util_fake_docker import FakeDockerCluster
+
+
+def free_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def start_captain(docker_nodes, port, worker_class, workers, extra_env):
+    env = dict(os.environ,
+               DOCKER_NODES=",".join(docker_nodes),
+               SLUG_RUNNER_COMMAND="start web",
+               SLUG_RUNNER_IMAGE="flynn/slugrunner",
+               SLOTS_PER_NODE="100000")
+    env.update(extra_env)
+    command = [sys.executable, "-c", "from gunicorn.app.wsgiapp import run; run()",
+               "captain_web:app", "-k", worker_class, "-w", str(workers), "-b", "127.0.0.1:{}".format(port),
+               "--log-config", "logging.conf"]
+    with open(os.devnull, "w") as devnull:
+        process = subprocess.Popen(command, env=env, stdout=devnull, stderr=devnull)
+    base_url = "http://127.0.0.1:{}".format(port)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if requests.get(base_url + "/ping/ping", timeout=1).status_code == 204:
+                return process, base_url
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.2)
+    process.terminate()
+    raise Exception("captain did not start on {}".format(base_url))
+
+
+class Endpoints(object):
+    """
+    The request mix: (name, weight, function(session, base_url) -> response).
+    """
+    def __init__(self, base_url, instances, nodes):
+        self.base_url = base_url
+        self.instances = instances
+        self.nodes = nodes
+        self.mix = [
+            ("GET /instances/", 30, self.get_instances),
+            ("GET /instances/<id>", 20, self.get_instance),
+            ("GET /instances_summary/", 15, self.get_summary),
+            ("GET /nodes/", 10, self.get_nodes),
+            ("GET /nodes/<id>", 10, self.get_node),
+            ("GET /instances/<id>/logs", 10, self.get_logs),
+            ("POST+DELETE /instances/", 5, self.start_and_stop),
+        ]
+        self.total_weight = sum(weight for _, weight, _ in self.mix)
+
+    def choose(self):
+        pick = random.uniform(0, self.total_weight)
+        for name, weight, fn in self.mix:
+            pick -= weight
+            if pick <= 0:
+                return name, fn
+        return self.mix[-1][0], self.mix[-1][2]
+
+    def get_instances(self, session):
+        return session.get(self.base_url + "/instances/")
+
+    def get_instance(self, session):
+        return session.get(self.base_url + "/instances/" + random.choice(self.instances))
+
+    def get_summary(self, session):
+        return session.get(self.base_url + "/instances_summary/")
+
+    def get_nodes(self, session):
+        return session.get(self.base_url + "/nodes/")
+
+    def get_node(self, session):
+        return session.get(self.base_url + "/nodes/" + random.choice(self.nodes))
+
+    def get_logs(self, session):
+        return session.get(self.base_url + "/instances/{}/logs".format(random.choice(self.instances)))
+
+    def start_and_stop(self, session):
+        started = session.post(self.base_url + "/instances/", data=(
+            '{"app": "loadtest", "slug_uri": "http://slugs/loadtest.tgz", "node": "%s", "environment": {}, "slots": 1}'
+            % random.choice(self.nodes)), headers={"Content-Type": "application/json"})
+        if started.status_code != 201:
+            return started
+        return session.delete(self.base_url + "/instances/" + started.json()["id"])
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def run_load(endpoints, concurrency, duration):
+    deadline = time.time() + duration
+    results = {}
+    lock = threading.Lock()
+
+    def worker():
+        session = requests.Session()
+        while time.time() < deadline:
+            name, fn = endpoints.choose()
+            start = time.time()
+            try:
+                ok = fn(session).status_code < 400
+            except requests.exceptions.RequestException:
+                ok = False
+            elapsed = time.time() - start
+            with lock:
+                latencies, errors = results.setdefault(name, ([], [0]))
+                latencies.append(elapsed)
+                if not ok:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker) for _ in xrange(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def report(results, duration):
+    print "{:<28} {:>7} {:>7} {:>8} {:>8} {:>8} {:>8}".format("endpoint", "count", "errors", "req/s", "p50 ms", "p95 ms", "p99 ms")
+    for name, (latencies, errors) in sorted(results.items()):
+        latencies = sorted(latencies)
+        print "{:<28} {:>7} {:>7} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f}".format(
+            name, len(latencies), errors[0], len(latencies) / duration,
+            percentile(latencies, 0.5) * 1000, percentile(latencies, 0.95) * 1000, percentile(latencies, 0.99) * 1000)
+    total = sum(len(latencies) for latencies, _ in results.values())
+    print "total {:.1f} req/s".format(total / duration)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=5)
+    parser.add_argument("--containers", type=int, default=20, help="containers per node")
+    parser.add_argument("--latency", type=float, default=0.002, help="mean seconds added to every Docker call")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--worker-class", default="gevent", help="gunicorn worker class, as in the Procfile by default")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--concurrency", type=int, default=10, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--env", action="append", default=[], help="extra NAME=value for captain, repeatable")
+    args = parser.parse_args()
+
+    cluster = FakeDockerCluster(nodes=args.nodes, containers_per_node=args.containers, exited_ratio=0,
+                                latency=args.latency, failure_rate=args.failure_rate).start()
+    process = None
+    try:
+        process, base_url = start_captain(cluster.docker_nodes(), free_port(), args.worker_class, args.workers,
+                                          dict(item.split("=", 1) for item in args.env))
+        instances = [i["id"] for i in requests.get(base_url + "/instances/").json()]
+        nodes = [node.host for node in cluster.nodes]
+        print "captain on {} with {} {} workers, {} nodes, {} instances".format(
+            base_url, args.workers, args.worker_class, len(nodes), len(instances))
+        report(run_load(Endpoints(base_url, instances, nodes), args.concurrency, args.duration), args.duration)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        cluster.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""
+Throughput of an instance's logs through captain's log pipeline, unfiltered and with each kind of filter.
+
+    $ python benchmarks/log_filter.py --lines 200000 --error-ratio 0.01
+
+Lines are JSON formatted application logs, a fraction of them at ERROR. Each is filtered, wrapped and
+encoded as RestInstanceLogs does, so the numbers include the JSON encoding that filtering saves.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from captain.log_filter import LogFilter
+
+
+def log_lines(count, error_ratio, seed=0):
+    rng = random.Random(seed)
+    lines = []
+    for i in xrange(count):
+        level = "ERROR" if rng.random() < error_ratio else "INFO"
+        lines.append(json.dumps({"@timestamp": "2014-06-01T12:00:{:02d}.000Z".format(i % 60), "level": level,
+                                 "logger": "application", "thread": "play-akka.actor.default-dispatcher-{}".format(i % 16),
+                                 "message": "GET /paye/individuals/{} took {}ms".format(rng.randrange(10 ** 6), rng.randrange(500))}))
+    return lines
+
+
+def serve(lines, line_filter):
+    start = time.time()
+    served = sum(len("{}\n".format(json.dumps({"msg": "{}\n".format(line)})))
+                 for line in line_filter.apply(lines))
+    return time.time() - start, served
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lines", type=int, default=200000)
+    parser.add_argument("--error-ratio", type=float, default=0.01, help="fraction of lines logged at ERROR")
+    args = parser.parse_args()
+
+    lines = log_lines(args.lines, args.error_ratio)
+    print "{} lines, {:.1f} MB".format(len(lines), sum(len(line) for line in lines) / 1e6)
+    print "{:<28} {:>14} {:>12}".format("filter", "lines/s in", "MB out")
+    for name, line_filter in [("none", LogFilter()),
+                              ("grep=ERROR", LogFilter(grep="ERROR")),
+                              ("invert=INFO", LogFilter(invert="INFO")),
+                              ("field=level:ERROR", LogFilter(fields={"level": "ERROR"})),
+                              ("grep=took [0-9]{3}ms", LogFilter(grep="took [0-9]{3}ms"))]:
+        elapsed, served = serve(lines, line_filter)
+        print "{:<28} {:>14.0f} {:>12.2f}".format(name, len(lines) / elapsed, served / 1e6)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""
+Cost of logging on a full scan of a synthetic cluster, with the connection logger at INFO or DEBUG.
+
+    $ python benchmarks/logging_cost.py --nodes 20 --containers 100 --repeat 5
+
+Records are formatted by the logstash formatter from logging.conf and written to /dev/null, so DEBUG
+numbers include building and encoding every record.
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+from mock import patch
+from logstash_formatter import LogstashFormatter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from captain.connection import Connection
+from captain.tests.util_cluster import SyntheticCluster
+from benchmarks import benchmark_config
+
+
+def scan_ms(args, level, sample_rate):
+    connection_logger = logging.getLogger('connection')
+    connection_logger.setLevel(level)
+    timings = []
+    for _ in xrange(args.repeat):
+        cluster = SyntheticCluster(nodes=args.nodes, containers_per_node=args.containers, exited_ratio=0,
+                                   env_size=args.env_size)
+        config = benchmark_config(docker_nodes=cluster.docker_nodes(), log_sample_rate=sample_rate)
+        with patch('docker.Client', side_effect=cluster.client):
+            connection = Connection(config)
+            connection._get_lru_instance_details.cache_clear()
+            start = time.time()
+            connection.scan_instances()
+            timings.append((time.time() - start) * 1000)
+    return sorted(timings)[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=20)
+    parser.add_argument("--containers", type=int, default=100, help="containers per node")
+    parser.add_argument("--env-size", type=int, default=10, help="environment variables per container")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    handler = logging.StreamHandler(open(os.devnull, "w"))
+    handler.setFormatter(LogstashFormatter('{"extra":{"app": "captain"}}'))
+    connection_logger = logging.getLogger('connection')
+    connection_logger.addHandler(handler)
+    connection_logger.propagate = False
+
+    containers = args.nodes * args.containers
+    print "Scanning {} nodes x {} containers".format(args.nodes, args.containers)
+    print "{:<28} {:>10} {:>14}".format("connection logger", "scan ms", "us/container")
+    for name, level, sample_rate in [("INFO", logging.INFO, 1.0),
+                                     ("DEBUG", logging.DEBUG, 1.0),
+                                     ("DEBUG, LOG_SAMPLE_RATE=0.01", logging.DEBUG, 0.01)]:
+        elapsed = scan_ms(args, level, sample_rate)
+        print "{:<28} {:>10.1f} {:>14.1f}".format(name, elapsed, elapsed * 1000 / containers)
+
+
+if __name__ == '__main__':
+    main()
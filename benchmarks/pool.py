@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Throughput of concurrent Docker calls against one node as concurrency rises, for a given pool size.
+
+    $ python benchmarks/pool.py --pool-size 10 --latency 0.005 [--pool-block]
+
+Runs against a local fake Docker node, so it measures captain's client side (connection pooling and reuse) only.
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from captain.connection import Connection
+from benchmarks import benchmark_config
+from captain.tests.util_fake_docker import FakeDockerCluster
+
+
+def run(connection, node, concurrency, duration):
+    node_conn = connection.node_connections[node]
+    deadline = time.time() + duration
+    counts = [0] * concurrency
+
+    def worker(index):
+        while time.time() < deadline:
+            node_conn.ping()
+            counts[index] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in xrange(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / float(duration)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--pool-block", action="store_true", help="wait for a pooled connection instead of opening a new one")
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds added to every fake Docker call")
+    parser.add_argument("--duration", type=float, default=2.0)
+    parser.add_argument("--concurrency", default="1,2,4,8,16,32")
+    args = parser.parse_args()
+
+    cluster = FakeDockerCluster(nodes=1, containers_per_node=0, latency=args.latency).start()
+    node = cluster.nodes[0]
+    try:
+        print "{:>11} {:>10} {:>10} {:>11} {:>10}".format("concurrency", "calls/s", "peak", "saturated", "opened")
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            connection = Connection(benchmark_config(docker_nodes=[node.url], docker_pool_size=args.pool_size,
+                                                     docker_pool_block=args.pool_block))
+            throughput = run(connection, node.host, concurrency, args.duration)
+            stats = connection.get_pool_stats()[node.host]
+            print "{:>11} {:>10.0f} {:>10} {:>11} {:>10}".format(
+                concurrency, throughput, stats["peak_in_flight"], stats["saturated_requests"], stats["connections_opened"])
+            connection.close()
+    finally:
+        cluster.stop()
+
+
+if __name__ == '__main__':
+    main()
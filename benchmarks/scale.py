@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+"""
+Latency, Docker call counts and memory of each Connection entry point against a synthetic cluster.
+
+    $ python benchmarks/scale.py --nodes 100 --containers 200 --latency 0.002
+    $ python benchmarks/scale.py --check          # compare against benchmarks/baseline.json
+    $ python benchmarks/scale.py --save-baseline  # record the current numbers as the baseline
+
+Call counts are deterministic for a given cluster shape, so any increase is reported as a regression;
+median latencies regress when they exceed the baseline by more than --tolerance and --slack-ms.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+from mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from captain.connection import Connection
+from captain.tests.util_cluster import SyntheticCluster
+from benchmarks import benchmark_config
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def first_instance(connection):
+    return sorted(connection.get_instances(), key=lambda i: i["id"])[0]
+
+
+def scenarios():
+    """
+    (name, setup, run) where setup prepares a fresh connection and returns the argument passed to run.
+    """
+    def nothing(connection):
+        return None
+
+    def warm_cache(connection):
+        connection.get_instances()
+
+    return [
+        ("get_instances (cold)", nothing, lambda connection, _: connection.get_instances()),
+        ("get_instances (warm)", warm_cache, lambda connection, _: connection.get_instances()),
+        ("get_nodes", warm_cache, lambda connection, _: connection.get_nodes()),
+        ("get_instance_summary", warm_cache, lambda connection, _: connection.get_instance_summary()),
+        ("start_instance", warm_cache, lambda connection, _: connection.start_instance(
+            "bench", "http://slugs/bench-1.tgz", "node-0", environment={"A": "b"}, slots=1)),
+        ("stop_instance", first_instance, lambda connection, instance: connection.stop_instance(instance["id"])),
+        ("get_logs", first_instance, lambda connection, instance: list(connection.get_logs(instance["id"]))),
+    ]
+
+
+def measure(args, setup, run):
+    runs = [measure_once(args, setup, run) for _ in xrange(args.repeat)]
+    result = sorted(runs, key=lambda r: r["latency_ms"])[len(runs) // 2]
+    result["maxrss_mb"] = max(r["maxrss_mb"] for r in runs)
+    return result
+
+
+def measure_once(args, setup, run):
+    cluster = SyntheticCluster(nodes=args.nodes, containers_per_node=args.containers, exited_ratio=args.exited_ratio,
+                               env_size=args.env_size, latency=args.latency, failure_rate=args.failure_rate)
+    config = benchmark_config(docker_nodes=cluster.docker_nodes(), slots_per_node=args.containers * 4)
+    with patch('docker.Client', side_effect=cluster.client):
+        connection = Connection(config)
+        # lru_cache is shared by all Connections, start every scenario from the same place
+        connection._get_lru_instance_details.cache_clear()
+        argument = setup(connection)
+        cluster.reset_calls()
+        start = time.time()
+        run(connection, argument)
+        elapsed = time.time() - start
+    return dict(latency_ms=round(elapsed * 1000, 1),
+                calls=cluster.calls(),
+                maxrss_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1))
+
+
+def shape(args):
+    return "{}x{} exited={} env={} latency={} failures={}".format(
+        args.nodes, args.containers, args.exited_ratio, args.env_size, args.latency, args.failure_rate)
+
+
+def compare(name, result, baseline, tolerance, slack_ms):
+    problems = []
+    for operation, count in sorted(result["calls"].items()):
+        if count > baseline["calls"].get(operation, 0):
+            problems.append("{} {} calls, baseline {}".format(operation, count, baseline["calls"].get(operation, 0)))
+    if result["latency_ms"] > baseline["latency_ms"] * tolerance + slack_ms:
+        problems.append("{} ms, baseline {} ms".format(result["latency_ms"], baseline["latency_ms"]))
+    return ["{}: {}".format(name, problem) for problem in problems]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=20)
+    parser.add_argument("--containers", type=int, default=50, help="containers per node")
+    parser.add_argument("--exited-ratio", type=float, default=0.1)
+    parser.add_argument("--env-size", type=int, default=10, help="environment variables per container")
+    parser.add_argument("--latency", type=float, default=0.001, help="mean seconds added to every Docker call")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--check", action="store_true", help="fail if worse than the stored baseline")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=1.5)
+    parser.add_argument("--slack-ms", type=float, default=50, help="latency noise allowed on top of --tolerance")
+    args = parser.parse_args()
+
+    results = {}
+    print "Cluster {}".format(shape(args))
+    print "{:<24} {:>10} {:>9}  {}".format("entry point", "ms", "rss MB", "docker calls")
+    for name, setup, run in scenarios():
+        result = results[name] = measure(args, setup, run)
+        calls = ", ".join("{}={}".format(k, v) for k, v in sorted(result["calls"].items()))
+        print "{:<24} {:>10} {:>9}  {}".format(name, result["latency_ms"], result["maxrss_mb"], calls)
+
+    baselines = {}
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as f:
+            baselines = json.load(f)
+
+    if args.save_baseline:
+        baselines[shape(args)] = results
+        with open(BASELINE, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print "Saved baseline for {}".format(shape(args))
+
+    if args.check:
+        if shape(args) not in baselines:
+            print "No baseline for {}".format(shape(args))
+            sys.exit(1)
+        problems = []
+        for name, result in sorted(results.items()):
+            if name in baselines[shape(args)]:
+                problems.extend(compare(name, result, baselines[shape(args)][name], args.tolerance, args.slack_ms))
+        for problem in problems:
+            print "REGRESSION {}".format(problem)
+        sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""
+Measures how long a captain worker takes to become ready.
+
+    $ python benchmarks/startup.py --nodes 50
+
+Run from the repository root (captain_web reads logging.conf from the working directory).
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from captain.connection import Connection
+from benchmarks import benchmark_config
+
+
+def time_import(repeat):
+    env = dict(os.environ, SLUG_RUNNER_COMMAND="start web", SLUG_RUNNER_IMAGE="flynn/slugrunner")
+    timings = []
+    for _ in xrange(repeat):
+        start = time.time()
+        subprocess.check_call([sys.executable, "-c", "import captain_web"], env=env)
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def time_connection(nodes, repeat, touch_all):
+    timings = []
+    for _ in xrange(repeat):
+        start = time.time()
+        connection = Connection(benchmark_config(docker_nodes=["http://node-{}:5000".format(i) for i in xrange(nodes)]))
+        if touch_all:
+            for node in connection.node_connections:
+                connection.node_connections[node]
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print "import captain_web (fresh interpreter): {:8.1f} ms".format(time_import(args.repeat) * 1000)
+    print "Connection() with {} nodes:            {:8.3f} ms".format(args.nodes, time_connection(args.nodes, args.repeat, False) * 1000)
+    print "Connection() creating every client:     {:8.3f} ms".format(time_connection(args.nodes, args.repeat, True) * 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+import time
+import heapq
+import functools
+import itertools
+import threading
+from contextlib import contextmanager
+
+# Lower goes first: deploys jump ahead of scans waiting for the same node
+DEPLOY = 0
+READ = 1
+PRIORITY_NAMES = {DEPLOY: "deploy", READ: "read"}
+
+# Per thread, or per greenlet once gevent has patched threading
+_local = threading.local()
+
+
+def current_priority():
+    return getattr(_local, "priority", READ)
+
+
+@contextmanager
+def priority(value):
+    """
+    Docker calls made in the block, including those handed to fan out workers, are admitted at this priority.
+    """
+    previous = current_priority()
+    _local.priority = value
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+def deploy_operation(fn):
+    """
+    Runs fn at DEPLOY priority.
+    """
+    @functools.wraps(fn)
+    def deploying(*args, **kwargs):
+        with priority(DEPLOY):
+            return fn(*args, **kwargs)
+    return deploying
+
+
+def bind(fn):
+    """
+    Wraps fn so that it runs at the priority current at the time of wrapping.
+    """
+    value = current_priority()
+    if value == READ:
+        return fn
+
+    def prioritised(*args, **kwargs):
+        with priority(value):
+            return fn(*args, **kwargs)
+    return prioritised
+
+
+class NodeAdmission(object):
+    """
+    Admits calls to one Docker daemon: at most max_concurrent at a time and, when rate is set, no more than rate
+    per second with bursts of up to burst. Waiting calls are admitted in priority order, then in arrival order.
+    """
+    def __init__(self, max_concurrent, rate=0, burst=1):
+        self.max_concurrent = max_concurrent
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._condition = threading.Condition()
+        self._waiting = []
+        self._arrivals = itertools.count()
+        self._active = 0
+        self._tokens = float(self.burst)
+        self._refilled = time.time()
+
+    def __token_wait(self):
+        """
+        Takes a token and returns 0, or returns how long until one is available.
+        """
+        if not self.rate:
+            return 0
+        now = time.time()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def acquire(self, priority=READ):
+        ticket = (priority, next(self._arrivals))
+        with self._condition:
+            heapq.heappush(self._waiting, ticket)
+            while True:
+                if self._waiting[0] == ticket and (not self.max_concurrent or self._active < self.max_concurrent):
+                    wait = self.__token_wait()
+                    if not wait:
+                        heapq.heappop(self._waiting)
+                        self._active += 1
+                        # The next in line may be admitted too
+                        self._condition.notify_all()
+                        return
+                    self._condition.wait(wait)
+                else:
+                    self._condition.wait()
+
+    def release(self):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify_all()
+
+    @contextmanager
+    def admit(self, priority=READ):
+        self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        return dict(active=self._active, waiting=len(self._waiting), max_concurrent=self.max_concurrent, rate=self.rate)
@@ -0,0 +1,81 @@
+import zlib
+
+# Set in the WSGI environ by a view whose response should reach the client as each chunk is produced
+FLUSH_EACH_CHUNK = 'captain.flush_each_chunk'
+
+# Responses smaller than this are not worth compressing
+MIN_SIZE = 512
+
+COMPRESSIBLE_TYPES = ("application/json", "application/jsonstream", "text/")
+
+
+def accepts_gzip(accept_encoding):
+    """
+    Whether an Accept-Encoding header accepts gzip, by name or through *, with a q-value above 0.
+    """
+    qualities = {}
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+    return qualities.get('gzip', qualities.get('*', 0.0)) > 0
+
+
+class GzipMiddleware(object):
+    """
+    Gzips responses for clients that accept it, as they are streamed. Output is only flushed at the end of the
+    response, or after every chunk when the view has set FLUSH_EACH_CHUNK, so that a followed log stream still
+    arrives line by line. A level of 0 turns compression off.
+    """
+    def __init__(self, app, level=6):
+        self.app = app
+        self.level = level
+
+    def __call__(self, environ, start_response):
+        if not self.level or not accepts_gzip(environ.get('HTTP_ACCEPT_ENCODING', '')) or environ['REQUEST_METHOD'] == 'HEAD':
+            return self.app(environ, start_response)
+        compress = []
+
+        def gzip_start_response(status, headers, exc_info=None):
+            if self.__compressible(status, headers):
+                compress.append(True)
+                headers = [(name, value) for name, value in headers if name.lower() != 'content-length']
+                headers.append(('Content-Encoding', 'gzip'))
+                headers.append(('Vary', 'Accept-Encoding'))
+            return start_response(status, headers, exc_info)
+
+        body = self.app(environ, gzip_start_response)
+        if not compress:
+            return body
+        return self.__gzip(body, self.level, environ.get(FLUSH_EACH_CHUNK, False))
+
+    def __compressible(self, status, headers):
+        if not status.startswith('200'):
+            return False
+        headers = dict((name.lower(), value) for name, value in headers)
+        if 'content-encoding' in headers:
+            return False
+        if 'content-length' in headers and int(headers['content-length']) < MIN_SIZE:
+            return False
+        return headers.get('content-type', '').startswith(COMPRESSIBLE_TYPES)
+
+    def __gzip(self, body, level, flush_each_chunk):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        try:
+            for chunk in body:
+                compressed = compressor.compress(chunk)
+                if flush_each_chunk:
+                    compressed += compressor.flush(zlib.Z_SYNC_FLUSH)
+                if compressed:
+                    yield compressed
+            yield compressor.flush()
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
@@ -1,17 +1,87 @@
 import os
 
 
+def gzip_level():
+    # Compression level of gzipped responses, for clients that accept them, 0 to never compress. Read on its
+    # own as well, the compression middleware is set up when captain_web is imported
+    return int(os.getenv("GZIP_LEVEL", "6"))
+
+
 class Config(object):
     def __init__(self):
         self.docker_nodes = os.getenv("DOCKER_NODES", "http://localhost:5000").split(",")
         self.docker_gc_grace_period = int(os.getenv("DOCKER_GC_GRACE_PERIOD", "86400"))
         self.docker_timeout = int(os.getenv("DOCKER_TIMEOUT", "15"))
+        self.gzip_level = gzip_level()
+        # Lines a log follower may fall behind the instance's shared log stream before it is disconnected
+        self.log_follow_buffer = int(os.getenv("LOG_FOLLOW_BUFFER", "1000"))
+        # Latest lines of an instance's logs every new follower gets before the lines logged after it connects
+        self.log_follow_backlog = int(os.getenv("LOG_FOLLOW_BACKLOG", "100"))
+        # Seconds an instance is given to exit when stopped before Docker kills it
+        self.docker_stop_timeout = int(os.getenv("DOCKER_STOP_TIMEOUT", "10"))
+        # Connections kept alive to each node. Concurrent calls beyond this either open throwaway connections
+        # or, with DOCKER_POOL_BLOCK, wait for a kept alive one to be free.
+        self.docker_pool_size = int(os.getenv("DOCKER_POOL_SIZE", "10"))
+        self.docker_pool_block = os.getenv("DOCKER_POOL_BLOCK", "false").lower() == "true"
+        # How cluster wide calls fan out to nodes: "threads", or "gevent" greenlets when running the gevent worker
+        self.docker_backend = os.getenv("DOCKER_BACKEND", "threads")
+        self.docker_concurrency = int(os.getenv("DOCKER_CONCURRENCY", "8"))
+        # Admission to each node, shared by every request: concurrent calls (0 for no limit), and calls per second
+        # (0 for no limit) with bursts of up to DOCKER_NODE_BURST. Deploys are admitted ahead of scans.
+        self.docker_node_concurrency = int(os.getenv("DOCKER_NODE_CONCURRENCY", "10"))
+        self.docker_node_rate = float(os.getenv("DOCKER_NODE_RATE", "0"))
+        self.docker_node_burst = int(os.getenv("DOCKER_NODE_BURST", "20"))
+        # Reads (list, inspect, ping) that fail to connect are retried with jittered backoff, and with
+        # DOCKER_HEDGE_READS sent a second time when slower than the node's recent p95
+        self.docker_read_retries = int(os.getenv("DOCKER_READ_RETRIES", "1"))
+        self.docker_retry_backoff_ms = int(os.getenv("DOCKER_RETRY_BACKOFF_MS", "100"))
+        self.docker_hedge_reads = os.getenv("DOCKER_HEDGE_READS", "false").lower() == "true"
+
+        # Requests slower than this are logged with a breakdown of their Docker calls
+        self.slow_request_ms = int(os.getenv("SLOW_REQUEST_MS", "5000"))
+        # Fraction of high volume debug events, such as one per container per scan, that are logged
+        self.log_sample_rate = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+        # Bearer token for the /debug endpoints, which are disabled when unset
+        self.debug_token = os.getenv("DEBUG_TOKEN")
 
         # Assumed 16GB RAM, 128MB per container with 2-3GB reserved for OS
         self.slots_per_node = int(os.getenv("SLOTS_PER_NODE", "110"))
         self.slot_memory_mb = int(os.getenv("SLOT_MEMORY_MB", "128"))
         self.default_slots_per_instance = int(os.getenv("DEFAULT_SLOTS_PER_INSTANCE", "2"))
 
+        # Share one inventory between all gunicorn workers through a snapshot file, disabled when unset
+        self.shared_inventory_path = os.getenv("SHARED_INVENTORY_PATH")
+        self.shared_inventory_interval = int(os.getenv("SHARED_INVENTORY_INTERVAL", "10"))
+        self.shared_inventory_max_age = int(os.getenv("SHARED_INVENTORY_MAX_AGE", "60"))
+
+        # Checkpoint the cluster state to a local SQLite file to warm start after a restart, disabled when unset
+        self.state_cache_path = os.getenv("STATE_CACHE_PATH")
+        self.state_cache_interval = int(os.getenv("STATE_CACHE_INTERVAL", "60"))
+        self.state_cache_max_age = int(os.getenv("STATE_CACHE_MAX_AGE", "3600"))
+
+        # /instances_summary/ is served from counts kept by every scan, rescanning once they are older than this
+        self.summary_max_age = int(os.getenv("SUMMARY_MAX_AGE", "5"))
+
+        # Background jobs, kept in this SQLite file when set so every worker can report them, otherwise in memory
+        self.jobs_path = os.getenv("JOBS_PATH")
+        self.job_retention = int(os.getenv("JOB_RETENTION", "1000"))
+        # An instance is ready once its public port accepts connections or, given READINESS_PATH, answers HTTP
+        self.readiness_timeout = int(os.getenv("READINESS_TIMEOUT", "300"))
+        self.readiness_interval = float(os.getenv("READINESS_INTERVAL", "1"))
+        self.readiness_path = os.getenv("READINESS_PATH")
+        # Every instance is probed the same way every HEALTH_INTERVAL seconds (0 disables), HEALTH_CONCURRENCY at once
+        self.health_interval = int(os.getenv("HEALTH_INTERVAL", "15"))
+        self.health_concurrency = int(os.getenv("HEALTH_CONCURRENCY", "20"))
+        self.health_timeout = float(os.getenv("HEALTH_TIMEOUT", "2"))
+        self.health_path = os.getenv("HEALTH_PATH")
+
+        # Desired instance counts per app, kept in this SQLite file when set so every worker shares them
+        self.desired_state_path = os.getenv("DESIRED_STATE_PATH")
+        # Seconds between reconcile passes, 0 disables the reconciler, and how many starts and stops each may make
+        self.reconcile_interval = int(os.getenv("RECONCILE_INTERVAL", "30"))
+        self.reconcile_max_starts = int(os.getenv("RECONCILE_MAX_STARTS", "10"))
+        self.reconcile_max_stops = int(os.getenv("RECONCILE_MAX_STOPS", "10"))
+
         self.slug_runner_command = os.getenv("SLUG_RUNNER_COMMAND")
         if self.slug_runner_command is None:
             raise Exception("SLUG_RUNNER_COMMAND should be specified")
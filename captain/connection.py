@@ -1,58 +1,262 @@
+import os
 import uuid
+import socket
+import hashlib
+import tempfile
 import docker
+import threading
+from concurrent import futures
 from urlparse import urlparse
 from captain import exceptions
+from captain.shared_inventory import SharedInventory
+from captain.state_cache import StateCache
+from captain.jobs import JobRegistry, MemoryJobStore, SqliteJobStore
+from captain.reconciler import Reconciler, MemoryDesiredState, SqliteDesiredState
+from captain.log_broadcast import LogBroadcaster, open_log_stream
+from captain.health import HealthCache
+from captain.summary import InventorySummary
+from captain.pool import PooledAdapter
+from captain.fanout import get_fan_out
+from captain.metrics import Registry, gc_gauges
+from captain.node_client import NodeClient
+from captain.hedging import HedgeExecutor
+from captain.admission import NodeAdmission, deploy_operation
+from captain.locks import locked
 # futures and datetime together do weird things
 #  https://mail.python.org/pipermail/python-list/2012-December/650103.html
 import datetime, _strptime
 from requests.exceptions import ConnectionError, Timeout
 import struct
 import logging
-import logging.config
-from concurrent import futures
+from captain.logs import StructuredLogger
 from backports.functools_lru_cache import lru_cache as lru_cache
-from collections import Counter
+from collections import Mapping
+from contextlib import contextmanager
 
 lru_cache_size = 1024
 
-logging.config.fileConfig("logging.conf")
-logger = logging.getLogger('connection')
+# Environment variable holding the idempotency key a container was created for
+REQUEST_KEY_VARIABLE = "CAPTAIN_REQUEST_KEY"
+
+logger = StructuredLogger(logging.getLogger('connection'))
+
+
+class _LogResponseStream(object):
+    """
+    The chunks of a followed log response. Closing it shuts the connection down, waking up a thread waiting
+    on it for the next chunk, which closing the response alone does not do.
+    """
+    def __init__(self, response, chunks):
+        self.response = response
+        self.chunks = chunks
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return next(self.chunks)
+
+    def close(self):
+        try:
+            self.response.raw._fp.fp._sock.shutdown(socket.SHUT_RDWR)
+        except (AttributeError, socket.error):
+            pass
+        self.response.close()
+
+
+class NodeConnections(Mapping):
+    """
+    Docker clients keyed by node hostname. Clients are only created when a node is first used, and are
+    recreated in a forked child (e.g. a gunicorn worker when running with --preload) so that connection
+    pools are never shared between processes.
+    """
+    def __init__(self, addresses, client_factory):
+        self.addresses = addresses
+        self.__client_factory = client_factory
+        self.__clients = {}
+        self.__pid = os.getpid()
+        self.__lock = threading.Lock()
+
+    def __getitem__(self, node):
+        address = self.addresses[node]
+        if self.__pid != os.getpid():
+            logger.debug("Process forked, dropping docker clients inherited from {}", self.__pid)
+            self.__clients = {}
+            self.__pid = os.getpid()
+        client = self.__clients.get(node)
+        if client is None:
+            with self.__lock:
+                client = self.__clients.get(node)
+                if client is None:
+                    client = self.__clients[node] = self.__client_factory(address)
+        return client
+
+    def __contains__(self, node):
+        return node in self.addresses
+
+    def __iter__(self):
+        return iter(self.addresses)
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def __repr__(self):
+        return "NodeConnections({})".format(sorted(self.addresses.keys()))
+
+    def created(self):
+        if self.__pid != os.getpid():
+            return {}
+        return dict(self.__clients)
 
 
 class Connection(object):
     def __init__(self, config, verify=False):
         self.config = config
-
-        self.node_connections = {}
-        logger.debug(dict(message="Setting up docker clients for {} configured nodes".format(len(config.docker_nodes))))
-        for node in config.docker_nodes:
-            address = urlparse(node)
-            docker_conn = self.__get_connection(address)
-            docker_conn.verify = verify
-            docker_conn.auth = (address.username, address.password)
-            self.node_connections[address.hostname] = docker_conn
-        logger.debug(dict(message='Nodes configured: {}'.format(self.node_connections)))
+        self.verify = verify
+        logger.sample_rate = config.log_sample_rate
+        self.metrics = Registry()
+        self.docker_call_seconds = self.metrics.histogram(
+            "captain_docker_call_duration_seconds", "Docker API calls by node and operation", ("node", "operation"))
+        self.docker_call_errors = self.metrics.counter(
+            "captain_docker_call_errors_total", "Docker API calls that raised, by node, operation and error",
+            ("node", "operation", "error"))
+        self.docker_admission_seconds = self.metrics.histogram(
+            "captain_docker_admission_wait_seconds", "Time Docker API calls waited to be admitted to a node, by priority",
+            ("node", "priority"))
+        self.docker_retries = self.metrics.counter(
+            "captain_docker_retries_total", "Docker API reads retried after a connection error",
+            ("node", "operation"))
+        self.docker_hedges = self.metrics.counter(
+            "captain_docker_hedges_total", "Docker API reads sent a second time for being slower than the node's p95",
+            ("node", "operation"))
+        self.instances_served = self.metrics.counter(
+            "captain_instances_served_total", "Instance listings by where they were served from", ("source",))
+        self.log_followers_dropped = self.metrics.counter(
+            "captain_log_followers_dropped_total", "Log followers disconnected for falling too far behind")
+        self.log_broadcaster = LogBroadcaster(config.log_follow_buffer, backlog=config.log_follow_backlog,
+                                              on_drop=self.log_followers_dropped.inc)
+        self.health = HealthCache()
+
+        addresses = dict((address.hostname, address) for address in (urlparse(node) for node in config.docker_nodes))
+        self.node_connections = NodeConnections(addresses, self.__get_connection)
+        logger.debug("Nodes configured: {}", self.node_connections)
+        self.fan_out = get_fan_out(config.docker_backend, config.docker_concurrency)
+        self.hedge_executor = None
+        if config.docker_hedge_reads:
+            # Hedged reads wait on both attempts from the calling worker, so allow two per fan out worker
+            self.hedge_executor = HedgeExecutor(config.docker_concurrency * 2)
+        self.__register_gauges()
+
+        self.shared_inventory = None
+        if config.shared_inventory_path:
+            logger.debug("Using shared inventory at {}", config.shared_inventory_path)
+            self.shared_inventory = SharedInventory(config.shared_inventory_path)
+
+        if config.jobs_path:
+            self.jobs = JobRegistry(SqliteJobStore(config.jobs_path, config.job_retention))
+        else:
+            self.jobs = JobRegistry(MemoryJobStore(config.job_retention))
+        if config.desired_state_path:
+            self.desired_state = SqliteDesiredState(config.desired_state_path)
+        else:
+            self.desired_state = MemoryDesiredState()
+        pass_lock_path = config.desired_state_path + '.pass.lock' if config.desired_state_path else None
+        self.reconciler = Reconciler(self, self.desired_state, config.reconcile_max_starts, config.reconcile_max_stops,
+                                     pass_lock_path=pass_lock_path)
+
+        # Results of the latest scan of each node, kept so they can be checkpointed
+        self._scanned_instances = {}
+        self._scanned_inspections = {}
+        self._warm_instances = None
+        self._warm_inspections = {}
+        # Counts of what the latest scans found, and of the shared inventory snapshot or checkpoint being served
+        self.summary = InventorySummary()
+        self._shared_summary = None
+        self._shared_health = None
+        self._warm_summary = None
+        self.state_cache = None
+        if config.state_cache_path:
+            self.state_cache = StateCache(config.state_cache_path)
+            self.__warm_start()
+
+    def __warm_start(self):
+        checkpoint = self.state_cache.load(max_age=self.config.state_cache_max_age)
+        if checkpoint is None:
+            return
+        saved_at, instances, inspections = checkpoint
+        logger.info("Warm started from checkpoint taken at {}", datetime.datetime.fromtimestamp(saved_at))
+        self._warm_instances = instances
+        self._warm_inspections = inspections
+        self._warm_summary = InventorySummary.of(instances)
+
+    def __register_gauges(self):
+        self.metrics.gauge("captain_fan_out_calls", "Node calls of cluster wide operations by state", ("state",),
+                           lambda: dict(((state,), count) for state, count in self.fan_out.depth().items()))
+
+        def cache_info():
+            info = self._get_lru_instance_details.cache_info()
+            lookups = info.hits + info.misses
+            return dict(hits=info.hits, misses=info.misses, size=info.currsize,
+                        hit_ratio=float(info.hits) / lookups if lookups else 0.0)
+        self.metrics.gauge("captain_instance_details_cache", "Container inspection cache, shared by all connections",
+                           ("value",), lambda: dict(((name,), value) for name, value in cache_info().items()))
+
+        def pool_stats():
+            return dict(((node, name), value) for node, stats in self.get_pool_stats().items()
+                        for name, value in stats.items())
+        self.metrics.gauge("captain_docker_pool", "Docker connection pool usage by node", ("node", "value"), pool_stats)
+
+        def admission_stats():
+            return dict(((node, name), value) for node, node_conn in self.node_connections.created().items()
+                        for name, value in node_conn.admission.stats().items())
+        self.metrics.gauge("captain_docker_admission", "Docker API calls admitted and waiting by node", ("node", "value"),
+                           admission_stats)
+        self.metrics.gauge("captain_log_streams", "Upstream log streams and the followers sharing them", ("value",),
+                           lambda: dict(((name,), value) for name, value in self.log_broadcaster.stats().items()))
+        gc_gauges(self.metrics)
+
+    @property
+    def serving_stale_state(self):
+        return self._warm_instances is not None
+
+    def get_scanned_state(self):
+        instances = []
+        inspections = {}
+        for node in self._scanned_instances.keys():
+            instances.extend(self._scanned_instances.get(node, []))
+            inspections.update(self._scanned_inspections.get(node, {}))
+        return instances, inspections
 
     def close(self):
-        for node in self.node_connections:
-            logger.debug(dict(message="Closing connection to {}".format(node)))
+        if self.hedge_executor is not None:
+            self.hedge_executor.shutdown(wait=False)
+        for node, node_conn in self.node_connections.created().items():
+            logger.debug("Closing connection to {}", node)
             if node is not None:
-                self.node_connections[node].close()
+                node_conn.close()
 
     @lru_cache(maxsize=lru_cache_size)
     def _get_lru_instance_details(self, node, container_id, container_status, public_port):
-        logger.debug(dict(message="Cache miss on node {} container {}".format(node, container_id)))
+        logger.debug("Cache miss on node {} container {}", node, container_id, sampled=True)
+        node_container = self._warm_inspections.pop((node, container_id, container_status, public_port), None)
+        if node_container is not None:
+            logger.debug("Using checkpointed inspection of {} on {}", container_id, node)
+            return node_container
         node_conn = self.node_connections[node]
         node_container = node_conn.inspect_container(container_id)
         return node_container
 
+    def get_pool_stats(self):
+        return dict((node, node_conn.pool_adapter.stats()) for node, node_conn in self.node_connections.created().items())
+
     def get_node_instances(self, node):
         node_conn = self.node_connections[node]
         node_instances = []
+        node_inspections = {}
         node_containers = node_conn.containers(
             quiet=False, all=True, trunc=False, latest=False,
             since=None, before=None, limit=-1)
-        logger.debug(dict(message="{} has {} containers".format(node, len(node_containers))))
+        logger.debug("{} has {} containers", node, len(node_containers))
         exited_container_count = 0
         deleted_container_count = 0
         for container in node_containers:
@@ -62,7 +266,7 @@ class Connection(object):
 
             if not container["Status"].startswith("Up "):
                 exited_container_count += 1
-                logger.debug(dict(message="Found exited container on {}".format(node)))
+                logger.debug("Found exited container on {}", node, sampled=True)
                 node_container = self._get_lru_instance_details(node, container["Id"], container_status, 0)
 
                 formatted_create_time = node_container["Created"]
@@ -71,15 +275,15 @@ class Connection(object):
                 exit_time = datetime.datetime.strptime(formatted_exit_time.rstrip("Z").split('.')[0], '%Y-%m-%dT%H:%M:%S')
                 if (datetime.datetime.now() - created_time).total_seconds() < self.config.docker_gc_grace_period or \
                    (datetime.datetime.now() - exit_time).total_seconds() < self.config.docker_gc_grace_period:
-                    logger.debug(dict(message="Exited container {} on {} not older than gc period, ignoring".format(container["Id"], node)))
+                    logger.debug("Exited container {} on {} not older than gc period, ignoring", container["Id"], node)
                 else:
                     try:
                         node_conn.remove_container(container["Id"])
                         deleted_container_count += 1
-                        logger.warn(dict(message="Exited container {} on {} with exit time at {} older than gc period, removed".format(container["Id"], node, formatted_exit_time)))
+                        logger.warn("Exited container {} on {} with exit time at {} older than gc period, removed", container["Id"], node, formatted_exit_time)
                     except docker.errors.APIError as e:
                         if '404 Client Error' in e.message:
-                            logger.info(dict(message='Container already removed: {}'.format(container["Id"])))
+                            logger.info("Container already removed: {}", container["Id"])
                         else:
                             raise
             elif "Ports" in container and len(container["Ports"]) == 1 and container["Ports"][0]["PrivatePort"] == 8080:
@@ -87,94 +291,233 @@ class Connection(object):
                 try:
                     node_container = self._get_lru_instance_details(node, container["Id"], container_status, public_port)
                     node_instances.append(self.__get_instance(node, node_container))
+                    node_inspections[(node, container["Id"], container_status, public_port)] = node_container
                 except docker.errors.APIError as e:
                     if '404 Client Error' in e.message:
-                        logger.info(dict(message='Container was deleted before being inspected: {}'.format(container["Id"])))
+                        logger.info("Container was deleted before being inspected: {}", container["Id"])
                     else:
                         raise
-        logger.debug('Found {} exited containers, {} were deleted'.format(exited_container_count, deleted_container_count))
+        logger.debug("Found {} exited containers, {} were deleted", exited_container_count, deleted_container_count)
+        self._scanned_instances[node] = node_instances
+        self._scanned_inspections[node] = node_inspections
+        self.summary.update_node(node, node_instances)
         return node_instances
 
+    def __shared_instances(self):
+        # The instances of a recent enough shared inventory snapshot, None without one
+        if self.shared_inventory is None:
+            return None
+        snapshot = self.shared_inventory.read(max_age=self.config.shared_inventory_max_age)
+        if snapshot is None:
+            return None
+        logger.debug("Serving instances from shared inventory version {}", snapshot.version)
+        return snapshot.instances
+
     def get_instances(self, node_filter=None):
+        shared_instances = self.__shared_instances()
+        if shared_instances is not None:
+            self.instances_served.inc(("shared_inventory",))
+            return [instance for instance in shared_instances if not node_filter or instance["node"] == node_filter]
+        warm_instances = self._warm_instances
+        if warm_instances is not None:
+            logger.debug("Serving checkpointed instances until the cluster has been rescanned")
+            self.instances_served.inc(("checkpoint",))
+            return [instance for instance in warm_instances if not node_filter or instance["node"] == node_filter]
+        self.instances_served.inc(("scan",))
+        return self.scan_instances(node_filter=node_filter)
+
+    def known_instances(self):
+        """
+        The instances this process already knows of, without calling Docker: those of the shared inventory,
+        else of the latest scan of each node, else of the checkpoint it warm started from.
+        """
+        shared_instances = self.__shared_instances()
+        if shared_instances is not None:
+            return shared_instances
+        if self._scanned_instances:
+            return self.get_scanned_state()[0]
+        return self._warm_instances or []
+
+    def scan_instances(self, node_filter=None):
         instances = []
-        filtered_nodes = {}
-        for node, node_conn in self.node_connections.items():
+        filtered_nodes = []
+        for node in self.node_connections:
             if node_filter and node != node_filter:
-                logger.debug(dict(message="Filtering node {}".format(node)))
+                logger.debug("Filtering node {}", node)
                 continue
-            filtered_nodes[node] = node_conn
-        with futures.ThreadPoolExecutor(max_workers=8) as executor:
-            future_to_instances = dict((executor.submit(self.get_node_instances, node), node) for node, node_conn in filtered_nodes.items())
-            for future in futures.as_completed(future_to_instances):
-                node = future_to_instances[future]
-                try:
-                    instances = instances + future.result()
-                    logger.debug(dict(message="Get instances for {} found {}".format(node, len(future.result()))))
-                except Exception as e:
-                    logger.error(dict(message="Getting instances from {} generated an exception: {}".format(node, e)))
+            filtered_nodes.append(node)
+        for node, node_instances, exception in self.fan_out.map(self.get_node_instances, filtered_nodes):
+            if exception is not None:
+                logger.error("Getting instances from {} generated an exception: {}", node, exception)
+                self.summary.node_unreachable(node)
+            else:
+                instances = instances + node_instances
+                logger.debug("Get instances for {} found {}", node, len(node_instances))
+        if not node_filter:
+            self._warm_instances = None
         return instances
 
     def get_node(self, name):
         if name not in self.node_connections:
-            logger.error(dict(message="Node {} not configured".format(name)))
+            logger.error("Node {} not configured", name)
             raise exceptions.NoSuchNodeException()
         try:
             self.node_connections[name].ping()
             countainer_count = reduce(lambda x, y: x + y["slots"], self.get_instances(node_filter=name), 0)
-            logger.debug(dict(message="{} has {} containers".format(name, countainer_count)))
+            logger.debug("{} has {} containers", name, countainer_count)
             return {"id": name,
                     "slots": {
                         "total": self.config.slots_per_node,
                         "used": countainer_count,
                         "free": self.config.slots_per_node - countainer_count},
-                    "state": "healthy"}
+                    "state": "healthy",
+                    "schedulable": name not in self.desired_state.unschedulable()}
         except (ConnectionError, Timeout) as e:
-            logger.error(dict(message="Error communication with {}: {}".format(name, e)))
+            logger.error("Error communication with {}: {}", name, e)
             return {"id": name,
                     "slots": {
                         "total": 0,
                         "used": 0,
                         "free": 0},
-                    "state": repr(e)}
+                    "state": repr(e),
+                    "schedulable": name not in self.desired_state.unschedulable()}
 
     def get_nodes(self):
         nodes = []
-        with futures.ThreadPoolExecutor(max_workers=8) as executor:
-            future_to_nodes = dict((executor.submit(self.get_node, node), node) for node in self.node_connections.keys())
-            for future in futures.as_completed(future_to_nodes):
-                node = future_to_nodes[future]
-                if future.exception() is not None:
-                    logger.error(dict(message="Getting details for {} generated an exception: {}".format(node, type(future.exception()))))
-                else:
-                    nodes = nodes + [future.result()]
-                    logger.debug(dict(message="Got details for {}".format(node)))
+        for node, node_details, exception in self.fan_out.map(self.get_node, self.node_connections.keys()):
+            if exception is not None:
+                logger.error("Getting details for {} generated an exception: {}", node, type(exception))
+            else:
+                nodes = nodes + [node_details]
+                logger.debug("Got details for {}", node)
         return nodes
 
+    def __current_summary(self):
+        # Counted from the same source get_instances() would serve
+        if self.shared_inventory is not None:
+            snapshot = self.shared_inventory.read(max_age=self.config.shared_inventory_max_age)
+            if snapshot is not None:
+                shared_summary = self._shared_summary
+                if shared_summary is None or shared_summary[0] != snapshot.version:
+                    shared_summary = self._shared_summary = (snapshot.version, InventorySummary.of(snapshot.instances))
+                return shared_summary[1]
+        warm_summary = self._warm_summary
+        if self._warm_instances is not None and warm_summary is not None:
+            return warm_summary
+        if not self.summary.fresh(self.node_connections, self.config.summary_max_age):
+            logger.debug("Summary older than {}s, rescanning", self.config.summary_max_age)
+            self.scan_instances()
+        return self.summary
+
+    def get_routes(self):
+        """
+        The routing table, kept up to date by every scan like the instance summary and served from the same source.
+        """
+        return self.__current_summary().routes()
+
+    def current_health(self):
+        """
+        The health cache to report from: the one the shared inventory writer published with the snapshot being
+        served, or this process's own.
+        """
+        if self.shared_inventory is not None:
+            snapshot = self.shared_inventory.read(max_age=self.config.shared_inventory_max_age)
+            if snapshot is not None:
+                shared_health = self._shared_health
+                if shared_health is None or shared_health[0] != snapshot.version:
+                    shared_health = self._shared_health = (snapshot.version, HealthCache.of(snapshot.health))
+                return shared_health[1]
+        return self.health
+
     def get_instance_summary(self):
-        summary = {"total_instances": 0}
-        apps = Counter()
-        logger.debug(dict(message="Getting instances to generate summary"))
-        instances = self.get_instances()
-        for instance in instances:
-            summary["total_instances"] += 1
-            apps[instance["app"]] += 1
-            logger.debug(dict(message="Incrementing {} to {}".format(instance["app"], apps[instance["app"]])))
-        summary.update({"apps": dict(apps)})
-        logger.debug(dict(message="Returning summary {}".format(summary)))
+        summary = self.__current_summary().render()
+        summary["health"] = self.current_health().counts(summary["total_instances"])
+        logger.debug("Returning summary of {} instances", summary["total_instances"])
         return summary
 
-    def start_instance(self, app, slug_uri, node, allocated_port=None, environment={}, slots=None, hostname=None):
-        environment["PORT"] = "8080"
-        environment["SLUG_URL"] = slug_uri
-
+    @contextmanager
+    def __claim_request_key(self, request_key):
+        # An flock in the temp directory, shared by every gunicorn worker, so that a retry reaching another
+        # worker waits for the start in progress there
+        if request_key is None:
+            yield
+            return
+        if isinstance(request_key, unicode):
+            request_key = request_key.encode("utf-8")
+        digest = hashlib.sha1(request_key).hexdigest()
+        with locked(os.path.join(tempfile.gettempdir(), "captain-request-{}.lock".format(digest))):
+            yield
+
+    def __unstarted_container(self, node, request_key):
+        # A container created for request_key that is not running, as a start cut short before it could start
+        # the container leaves behind
+        node_conn = self.node_connections[node]
+        key_variable = u"{}={}".format(REQUEST_KEY_VARIABLE, request_key)
+        for container in node_conn.containers(quiet=False, all=True, trunc=False, latest=False,
+                                              since=None, before=None, limit=-1):
+            if container["Status"].startswith("Up "):
+                continue
+            container_status = container["Status"].split()[0] if container["Status"] else container["Status"]
+            try:
+                node_container = self._get_lru_instance_details(node, container["Id"], container_status, 0)
+            except docker.errors.APIError as e:
+                if '404 Client Error' in e.message:
+                    continue
+                raise
+            if key_variable in node_container["Config"]["Env"]:
+                return container["Id"]
+        return None
+
+    @deploy_operation
+    def start_instance(self, app, slug_uri, node, allocated_port=None, environment={}, slots=None, hostname=None,
+                       progress=None, request_key=None):
+        """
+        Creates and starts a container for app on node. progress, when given, is called with the name of each
+        step as it completes, and details of it.
+
+        Given a request_key, a running instance on node already started with that key is returned instead, so
+        that a client can safely retry a start that timed out. A container created with that key but not
+        running is started rather than creating another. Starts with the same key wait for each other, in
+        every gunicorn worker.
+        """
+        if node in self.desired_state.unschedulable():
+            raise exceptions.NodeUnschedulableException()
         if not slots:
-            logger.info(dict(message="Setting default slots for {}".format(app)))
+            logger.info("Setting default slots for {}", app)
             slots = self.config.default_slots_per_instance
-        current_slot_count = sum([
-            instance["slots"] for instance in self.get_instances()
-            if instance['node'] == node])
-        if current_slot_count + slots > self.config.slots_per_node:
-            raise exceptions.NodeOutOfCapacityException()
+        with self.__claim_request_key(request_key):
+            # Always count slots from a live scan of the node, a shared inventory may lag behind recent starts
+            node_instances = self.scan_instances(node_filter=node)
+            if request_key is not None:
+                for instance in node_instances:
+                    if instance["request_key"] == request_key:
+                        logger.info("Instance {} was already started for request {}", instance["id"], request_key)
+                        return instance
+            current_slot_count = sum([instance["slots"] for instance in node_instances])
+            if current_slot_count + slots > self.config.slots_per_node:
+                raise exceptions.NodeOutOfCapacityException()
+            if request_key is not None:
+                container_id = self.__unstarted_container(node, request_key)
+                if container_id is not None:
+                    logger.info("Starting container {} created earlier for request {}", container_id, request_key)
+                    return self.__start_container(app, node, container_id, progress or (lambda step, **details: None))
+            return self.launch_instance(app, slug_uri, node, environment=environment, slots=slots, hostname=hostname,
+                                        progress=progress, request_key=request_key)
+
+    @deploy_operation
+    def launch_instance(self, app, slug_uri, node, environment={}, slots=None, hostname=None, progress=None,
+                        request_key=None):
+        """
+        Creates and starts a container for app on node without checking the node's capacity, for callers that
+        have already placed it.
+        """
+        progress = progress or (lambda step, **details: None)
+        environment = dict(environment)
+        if request_key is not None:
+            environment[REQUEST_KEY_VARIABLE] = request_key
+        environment["PORT"] = "8080"
+        environment["SLUG_URL"] = slug_uri
+        slots = slots or self.config.default_slots_per_instance
 
         node_connection = self.node_connections[node]
 
@@ -188,41 +531,105 @@ class Connection(object):
                                                      name=app + "_" + str(uuid.uuid4()),
                                                      cpu_shares=slots,
                                                      mem_limit=self.config.slot_memory_mb * slots * 1024 * 1024)
-        logger.debug(dict(message="Created container for {} on {}".format(app, node)))
+        logger.debug("Created container for {} on {}", app, node)
+        progress("created", container_id=container["Id"])
+        return self.__start_container(app, node, container["Id"], progress)
+
+    def __start_container(self, app, node, container_id, progress):
+        node_connection = self.node_connections[node]
 
         # start the container
-        node_connection.start(container["Id"], port_bindings={8080: None})
-        logger.debug(dict(message="Started container for {} on {}".format(app, node)))
+        node_connection.start(container_id, port_bindings={8080: None})
+        logger.debug("Started container for {} on {}", app, node)
+        progress("started", container_id=container_id)
 
         # inspect the container
         # it is important to inspect it *after* starting as before that it doesn't have port info in it)
-        container_inspected = node_connection.inspect_container(container["Id"])
-        logger.info(dict(message="Finished starting container for app {} on {}".format(app, node)))
+        container_inspected = node_connection.inspect_container(container_id)
+        logger.info("Finished starting container for app {} on {}", app, node)
 
         # and return the container converted to an Instance
         return self.__get_instance(node, container_inspected)
 
+    @deploy_operation
     def stop_instance(self, instance_id):
-        instances = self.get_instances()
-
-        for instance in instances:
+        instance = self.find_instance(instance_id)
+        if instance is None:
+            return False
+        self.remove_instance(instance)
+        return True
+
+    def find_instance(self, instance_id):
+        """
+        The instance with instance_id as it is running now, or None. Instances to act on are always looked up
+        with a live scan, as a shared inventory or checkpoint may not have caught up with recent starts and
+        stops yet. Only the node they place the instance on is scanned, or every node when they do not know of it.
+        """
+        listed = self.__shared_instances()
+        if listed is None:
+            listed = self._warm_instances or []
+        known = [instance["node"] for instance in listed if instance["id"] == instance_id]
+        for instance in self.scan_instances(node_filter=known[0] if known else None):
             if instance["id"] == instance_id:
-                docker_hostname = instance["node"]
-                docker_container_id = instance_id
-                logger.debug(dict(message="Stopping container {} on {}".format(docker_container_id, docker_hostname)))
-                self.node_connections[docker_hostname].stop(docker_container_id)
-                logger.info(dict(message="Stopped container {} on {}".format(docker_container_id, docker_hostname)))
-
-                try:
-                    self.node_connections[docker_hostname].remove_container(docker_container_id, force=True)
-                    logger.info(dict(message="Removed container {} on {}".format(docker_container_id, docker_hostname)))
-                except:
-                    logger.warn(dict(message="Failed to remove container {} on {}".format(docker_container_id, docker_hostname)))
-                    pass  # we do not care if removing the container failed
+                return instance
+        return None
+
+    def find_instances(self, app=None, node=None, ids=None):
+        """
+        The instances matching all of the given app, node and ids, from one live scan.
+        """
+        return [instance for instance in self.scan_instances(node_filter=node)
+                if (app is None or instance["app"] == app) and (ids is None or instance["id"] in ids)]
+
+    @deploy_operation
+    def stop_instances(self, app=None, node=None, ids=None, timeout=None):
+        """
+        Stops every instance matching all of the given app, node and ids, resolved from one listing, in
+        parallel. Returns the outcome for each instance, and for each id that matched no instance.
+
+        The container this captain runs in, whose hostname is its short id, is left running: stopping it would
+        lose the other stops and the outcomes. Another captain has to be asked to stop it.
+        """
+        instances = self.find_instances(app=app, node=node, ids=ids)
+        outcomes = []
+        hostname = socket.gethostname()
+        for instance in [i for i in instances if i["id"].startswith(hostname)]:
+            logger.warn("Not stopping {} on {}, captain runs in it", instance["id"], instance["node"])
+            instances.remove(instance)
+            outcomes.append(dict(id=instance["id"], app=instance["app"], node=instance["node"], stopped=False,
+                                 error="Captain runs in this instance, ask another captain to stop it"))
+        for instance, _, exception in self.fan_out.map(lambda i: self.remove_instance(i, timeout=timeout), instances):
+            outcome = dict(id=instance["id"], app=instance["app"], node=instance["node"], stopped=exception is None)
+            if exception is not None:
+                logger.error("Stopping {} on {} failed: {}", instance["id"], instance["node"], exception)
+                outcome["error"] = "{}: {}".format(type(exception).__name__, exception)
+            outcomes.append(outcome)
+        found = set(instance["id"] for instance in instances)
+        for instance_id in ids or []:
+            if instance_id not in found:
+                outcomes.append(dict(id=instance_id, stopped=False, error="No such instance"))
+        return outcomes
+
+    @deploy_operation
+    def remove_instance(self, instance, timeout=None):
+        """
+        Stops and removes an instance already looked up by the caller, giving it timeout seconds to exit
+        (DOCKER_STOP_TIMEOUT by default).
+        """
+        if timeout is None:
+            timeout = self.config.docker_stop_timeout
+        docker_hostname = instance["node"]
+        docker_container_id = instance["id"]
+        logger.debug("Stopping container {} on {}", docker_container_id, docker_hostname)
+        self.node_connections[docker_hostname].stop(docker_container_id, timeout=timeout)
+        logger.info("Stopped container {} on {}", docker_container_id, docker_hostname)
 
-                return True
-
-        return False
+        try:
+            self.node_connections[docker_hostname].remove_container(docker_container_id, force=True)
+            logger.info("Removed container {} on {}", docker_container_id, docker_hostname)
+        except:
+            logger.warn("Failed to remove container {} on {}", docker_container_id, docker_hostname)
+            pass  # we do not care if removing the container failed
 
     def __get_connection(self, address):
         if address.port:
@@ -231,12 +638,21 @@ class Connection(object):
             base_url = "{}://{}".format(address.scheme, address.hostname)
 
         c = docker.Client(base_url=base_url, version="1.12", timeout=self.config.docker_timeout)
-        logger.debug(dict(message="Docker client created for {}".format(address.hostname)))
+        c.verify = self.verify
+        c.auth = (address.username, address.password)
+        adapter = PooledAdapter(self.config.docker_pool_size, pool_block=self.config.docker_pool_block)
+        c.mount("http://", adapter)
+        c.mount("https://", adapter)
+        c.pool_adapter = adapter
+        logger.debug("Docker client created for {}", address.hostname)
 
         # This is a hack to allow logs to work thru nginx.
         # It will break bidirectional traffic on .attach but fortunately we don't (yet) use it.
         def __hacked_multiplexed_socket_stream_helper(response):
             c._raise_for_status(response)
+            return _LogResponseStream(response, __frames(response))
+
+        def __frames(response):
             data_buffer = ""
             length = None
             i = response.iter_content(10)
@@ -255,21 +671,27 @@ class Connection(object):
                     length = None
                     continue
         c._multiplexed_socket_stream_helper = __hacked_multiplexed_socket_stream_helper
-        return c
+        node_admission = NodeAdmission(self.config.docker_node_concurrency, rate=self.config.docker_node_rate,
+                                       burst=self.config.docker_node_burst)
+        return NodeClient(address.hostname, c, node_admission, self, retries=self.config.docker_read_retries,
+                          backoff=self.config.docker_retry_backoff_ms / 1000.0, hedge_executor=self.hedge_executor)
 
     def __get_instance(self, node, container):
         app = container["Name"][1:].split("_")[0]
-        logger.debug(dict(message="getting instance details", microservice="App name is {}".format(app)))
+        logger.debug("getting instance details, app name is {}", app, sampled=True)
         environment = {}
         slug_uri = None
+        request_key = None
         for env_item in container["Config"]["Env"]:
             env_item_key, env_item_value = env_item.split("=", 1)
-            if env_item_key not in ['HOME', 'PATH', 'SLUG_URL', 'PORT']:
+            if env_item_key not in ['HOME', 'PATH', 'SLUG_URL', 'PORT', REQUEST_KEY_VARIABLE]:
                 environment[env_item_key] = env_item_value
             else:
-                logger.debug(dict(message="Skipping {} from environment".format(env_item_key)))
+                logger.debug("Skipping {} from environment", env_item_key, sampled=True)
             if env_item_key == 'SLUG_URL':
                 slug_uri = env_item_value
+            if env_item_key == REQUEST_KEY_VARIABLE:
+                request_key = env_item_value
 
         # Docker breaks stuff, when talking to > 1.1.1 this might be the place to find the port on stopped containers.
         # self.port = int(inspection_details["NetworkSettings"]["Ports"]["8080/tcp"][0]["HostPort"])
@@ -281,17 +703,22 @@ class Connection(object):
                     port=int(container["NetworkSettings"]["Ports"]["8080/tcp"][0]["HostPort"]),
                     environment=environment,
                     slots=container["Config"]["CpuShares"],
-                    hostname=container["Config"]["Hostname"])
-
-    def get_logs(self, instance_id, follow=False):
-        try:
-            instance_details = [i for i in self.get_instances() if i["id"] == instance_id][0]
-        except IndexError:
+                    hostname=container["Config"]["Hostname"],
+                    request_key=request_key)
+
+    def get_logs(self, instance_id, follow=False, line_filter=None):
+        """
+        The log lines of an instance, only those matching line_filter when one is given.
+        """
+        instance_details = self.find_instance(instance_id)
+        if instance_details is None:
             raise exceptions.NoSuchInstanceException()
         node = instance_details["node"]
         node_connection = self.node_connections[node]
+        select = line_filter.apply if line_filter is not None else iter
         if follow:
-            instance_logs = ({"msg": l} for l in node_connection.logs(instance_id, stream=True))
+            lines = self.log_broadcaster.follow(instance_id, lambda: open_log_stream(node_connection, instance_id))
+            instance_logs = ({"msg": l} for l in select(lines))
         else:
-            instance_logs = ({"msg": "{}\n".format(l)} for l in node_connection.logs(instance_id).split("\n"))
+            instance_logs = ({"msg": "{}\n".format(l)} for l in select(node_connection.logs(instance_id).split("\n")))
         return instance_logs
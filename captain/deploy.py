@@ -0,0 +1,187 @@
+import logging
+from collections import Counter
+from captain import readiness
+from captain import exceptions
+from captain.admission import deploy_operation
+from captain.logs import StructuredLogger
+
+logger = StructuredLogger(logging.getLogger('connection'))
+
+
+class InstanceNotReadyException(Exception):
+    pass
+
+
+class BatchFailedException(Exception):
+    pass
+
+
+def start_instance_job(connection, instance_request):
+    """
+    A job that starts an instance, then waits for it to be ready to serve.
+    """
+    def run(job):
+        instance = connection.start_instance(progress=job.step, **instance_request)
+        job.result = instance
+        job.step("waiting_for_readiness", node=instance["node"], port=instance["port"])
+        if not readiness.instance_ready(instance, connection.config):
+            raise InstanceNotReadyException("{} not ready on {}:{} after {}s".format(
+                instance["id"], instance["node"], instance["port"], connection.config.readiness_timeout))
+        job.step("ready")
+        return instance
+    return run
+
+
+def free_slots(connection, instances):
+    """
+    Free slots per schedulable node, counted from one scan of the cluster.
+    """
+    used = Counter()
+    for instance in instances:
+        used[instance["node"]] += instance["slots"]
+    unschedulable = connection.desired_state.unschedulable()
+    return dict((node, connection.config.slots_per_node - used[node])
+                for node in connection.node_connections if node not in unschedulable)
+
+
+def place(free, slots, preferred=None):
+    """
+    Picks a node with slots free, preferring the given node and then the emptiest, and books the slots on it.
+    """
+    if free.get(preferred, 0) >= slots:
+        node = preferred
+    else:
+        candidates = [node for node, available in free.items() if available >= slots]
+        if not candidates:
+            raise exceptions.NodeOutOfCapacityException()
+        node = max(candidates, key=lambda n: (free[n], n))
+    free[node] -= slots
+    return node
+
+
+def launch_ready(connection, launch):
+    """
+    Launches an already placed instance and waits for it to be ready, removing it again if it never is.
+    """
+    instance = connection.launch_instance(**launch)
+    if not readiness.instance_ready(instance, connection.config):
+        connection.remove_instance(instance)
+        raise InstanceNotReadyException("{} not ready on {}:{} after {}s".format(
+            instance["id"], instance["node"], instance["port"], connection.config.readiness_timeout))
+    return instance
+
+
+def launch_batch(connection, launches):
+    """
+    Launches a batch of placed instances in parallel and waits for all of them to be ready. If any fails, the
+    others are removed again and the batch fails as a whole.
+    """
+    started = []
+    failures = []
+    for launch, instance, exception in connection.fan_out.map(lambda launch: launch_ready(connection, launch), launches):
+        if exception is not None:
+            logger.error("Launching {} on {} failed: {}", launch["app"], launch["node"], exception)
+            failures.append("{}: {}".format(launch["node"], exception))
+        else:
+            started.append(instance)
+    if failures:
+        remove_batch(connection, started)
+        raise BatchFailedException("; ".join(failures))
+    return started
+
+
+def remove_batch(connection, instances):
+    """
+    Stops and removes instances in parallel, returning the ids of those removed.
+    """
+    removed = []
+    for instance, _, exception in connection.fan_out.map(connection.remove_instance, instances):
+        if exception is not None:
+            logger.error("Stopping {} on {} failed: {}", instance["id"], instance["node"], exception)
+        else:
+            removed.append(instance["id"])
+    return removed
+
+
+def rollout_job(connection, app, slug_uri, environment=None, slots=None, batch_size=1):
+    """
+    A job that replaces every instance of app with one running slug_uri, batch_size at a time. Each batch of
+    replacements is started in parallel and must be ready before the instances it replaces are stopped.
+    Replacements keep the environment and slots of the instance they replace unless new ones are given.
+    """
+    @deploy_operation
+    def run(job):
+        instances = connection.scan_instances()
+        free = free_slots(connection, instances)
+        old = sorted([instance for instance in instances if instance["app"] == app], key=lambda i: i["id"])
+        batches = [old[i:i + batch_size] for i in xrange(0, len(old), batch_size)]
+        job.update_progress(total=len(old), replaced=0, batches=len(batches), batch=0)
+        started = []
+        stopped = []
+        for number, batch in enumerate(batches, 1):
+            launches = []
+            for instance in batch:
+                instance_slots = slots or instance["slots"]
+                launches.append(dict(app=app, slug_uri=slug_uri, slots=instance_slots,
+                                     environment=dict(environment if environment is not None else instance["environment"]),
+                                     node=place(free, instance_slots, preferred=instance["node"])))
+            job.step("starting_batch", batch=number, nodes=[launch["node"] for launch in launches])
+            replacements = launch_batch(connection, launches)
+            started.extend(replacements)
+            job.step("batch_ready", batch=number, instances=[instance["id"] for instance in replacements])
+            removed = remove_batch(connection, batch)
+            stopped.extend(removed)
+            for instance in batch:
+                # Unschedulable nodes have no free slots to give back to
+                if instance["id"] in removed and instance["node"] in free:
+                    free[instance["node"]] += instance["slots"]
+            job.update_progress(replaced=len(stopped), batch=number)
+            job.result = dict(started=started, stopped=stopped)
+        return dict(started=started, stopped=stopped)
+    return run
+
+
+def drain_job(connection, node):
+    """
+    A job that moves every instance off a node already marked unschedulable. Replacements are placed on the
+    other nodes up front, failing the drain before anything starts if they do not fit, then each instance is
+    migrated in parallel: its replacement is started and once ready the original is stopped.
+    """
+    def migrate(move):
+        instance, launch = move
+        replacement = launch_ready(connection, launch)
+        connection.remove_instance(instance)
+        return replacement
+
+    @deploy_operation
+    def run(job):
+        instances = connection.scan_instances()
+        free = free_slots(connection, instances)
+        draining = sorted([instance for instance in instances if instance["node"] == node], key=lambda i: i["id"])
+        moves = []
+        for instance in draining:
+            try:
+                target = place(free, instance["slots"])
+            except exceptions.NodeOutOfCapacityException:
+                raise exceptions.NodeOutOfCapacityException(
+                    "Not enough free slots on other nodes to move the {} instances on {}".format(len(draining), node))
+            moves.append((instance, dict(app=instance["app"], slug_uri=instance["slug_uri"],
+                                         environment=dict(instance["environment"]), slots=instance["slots"],
+                                         node=target)))
+        job.update_progress(total=len(moves), moved=0, failed=0)
+        job.step("migrating", instances=len(moves), nodes=sorted(set(launch["node"] for _, launch in moves)))
+        moved = []
+        failures = []
+        for (instance, launch), replacement, exception in connection.fan_out.map(migrate, moves):
+            if exception is not None:
+                logger.error("Moving {} off {} failed: {}", instance["id"], node, exception)
+                failures.append("{}: {}".format(instance["id"], exception))
+            else:
+                moved.append(dict(original=instance["id"], replacement=replacement))
+            job.result = dict(moved=moved)
+            job.update_progress(moved=len(moved), failed=len(failures))
+        if failures:
+            raise BatchFailedException("; ".join(failures))
+        job.step("drained")
+        return dict(moved=moved)
+    return run
@@ -9,5 +9,15 @@ class NodeOutOfCapacityException(Exception):
     pass
 
 
+class NodeUnschedulableException(Exception):
+    pass
+
+
 class NoSuchInstanceException(Exception):
     pass
+
+
+class JobInProgressException(Exception):
+    def __init__(self, job):
+        super(JobInProgressException, self).__init__("Job {} is already {}".format(job["id"], job["state"]))
+        self.job = job
@@ -0,0 +1,102 @@
+import logging
+import threading
+from concurrent import futures
+from captain import tracing
+from captain import admission
+from captain.logs import StructuredLogger
+
+logger = StructuredLogger(logging.getLogger('connection'))
+
+
+class _FanOut(object):
+    """
+    Counts calls waiting for a worker and calls running, across every map in progress. Calls run under the
+    trace and admission priority of the thread that fanned them out.
+    """
+    def __init__(self):
+        self._depth_lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+
+    def _track(self, fn):
+        with self._depth_lock:
+            self._queued += 1
+        fn = admission.bind(tracing.bind(fn))
+
+        def tracked(item):
+            with self._depth_lock:
+                self._queued -= 1
+                self._active += 1
+            try:
+                return fn(item)
+            finally:
+                with self._depth_lock:
+                    self._active -= 1
+        return tracked
+
+    def depth(self):
+        return dict(queued=self._queued, active=self._active)
+
+
+class ThreadFanOut(_FanOut):
+    """
+    Runs blocking calls concurrently on a pool of threads, one pool per fan out.
+    """
+    def __init__(self, max_workers):
+        super(ThreadFanOut, self).__init__()
+        self.max_workers = max_workers
+
+    def map(self, fn, items):
+        """
+        Calls fn once per item concurrently, yielding (item, result, exception) as each call completes.
+        """
+        with futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            future_to_item = dict((executor.submit(self._track(fn), item), item) for item in items)
+            for future in futures.as_completed(future_to_item):
+                exception = future.exception()
+                yield future_to_item[future], None if exception is not None else future.result(), exception
+
+
+class GeventFanOut(_FanOut):
+    """
+    Runs calls concurrently as greenlets on the current gevent hub, so fanning out to hundreds of nodes
+    costs greenlets rather than threads. Docker calls only yield to each other when sockets are patched by
+    gevent, as they are under gunicorn's gevent worker.
+    """
+    def __init__(self, size):
+        super(GeventFanOut, self).__init__()
+        import gevent.pool
+        import gevent.queue
+        import gevent.monkey
+        if 'socket' not in gevent.monkey.saved:
+            logger.warn("gevent fan out configured but sockets are not patched, Docker calls will block the hub")
+        self.size = size
+        self._pool = gevent.pool.Pool
+        self._queue = gevent.queue.Queue
+
+    def map(self, fn, items):
+        """
+        Calls fn once per item concurrently, yielding (item, result, exception) as each call completes.
+        """
+        items = list(items)
+        pool = self._pool(self.size)
+        completed = self._queue()
+
+        def call(item):
+            try:
+                completed.put((item, fn(item), None))
+            except Exception as e:
+                completed.put((item, None, e))
+
+        for item in items:
+            pool.spawn(self._track(call), item)
+        for _ in items:
+            yield completed.get()
+
+
+def get_fan_out(backend, concurrency):
+    if backend == "gevent":
+        return GeventFanOut(concurrency)
+    if backend == "threads":
+        return ThreadFanOut(concurrency)
+    raise ValueError("Unknown docker backend {}, expected threads or gevent".format(backend))
@@ -0,0 +1,112 @@
+import time
+import logging
+import threading
+from collections import Counter
+from captain import readiness
+from captain.fanout import get_fan_out
+from captain.logs import StructuredLogger
+
+logger = StructuredLogger(logging.getLogger('connection'))
+
+
+class HealthCache(object):
+    """
+    The latest probe result of each instance, when it was taken and since when the instance has been in that
+    state. Read requests only ever look results up here, they never wait for a probe.
+    """
+    def __init__(self):
+        self._health = {}
+        # Instances last probed healthy and unhealthy, kept as results change
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, instance_id, healthy, at):
+        with self._lock:
+            previous = self._health.get(instance_id)
+            since = previous["since"] if previous is not None and previous["healthy"] == healthy else at
+            self._health[instance_id] = dict(healthy=healthy, checked_at=at, since=since)
+            if previous is not None:
+                self._counts[previous["healthy"]] -= 1
+            self._counts[healthy] += 1
+        return previous is None or previous["healthy"] != healthy
+
+    def retain(self, instance_ids):
+        with self._lock:
+            for instance_id in set(self._health) - set(instance_ids):
+                self._counts[self._health.pop(instance_id)["healthy"]] -= 1
+
+    @classmethod
+    def of(cls, health):
+        """
+        A cache of the results snapshot() returned, as another process published them.
+        """
+        cache = cls()
+        for instance_id, result in health.items():
+            cache._health[instance_id] = result
+            cache._counts[result["healthy"]] += 1
+        return cache
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._health)
+
+    def get(self, instance_id):
+        return self._health.get(instance_id)
+
+    def annotate(self, instances):
+        """
+        Copies of instances with their health, None until they have been probed.
+        """
+        return [dict(instance, health=self._health.get(instance["id"])) for instance in instances]
+
+    def counts(self, total_instances):
+        """
+        How many of total_instances were last probed healthy or unhealthy, and how many not yet.
+        """
+        healthy, unhealthy = self._counts[True], self._counts[False]
+        return dict(healthy=healthy, unhealthy=unhealthy, unknown=max(total_instances - healthy - unhealthy, 0))
+
+
+class HealthProber(threading.Thread):
+    """
+    Probes the public port of every instance every interval seconds, concurrency of them at a time, and records
+    the results in the connection's health cache. Instances to probe are those the connection already knows of,
+    the prober never scans Docker itself.
+
+    With a shared inventory only its writer probes, and publishes the results for every worker to serve, so
+    that each instance is probed once per interval and every worker reports the same health.
+    """
+    def __init__(self, connection, interval, concurrency, timeout, path=None):
+        super(HealthProber, self).__init__(name='health-prober')
+        self.daemon = True
+        self.connection = connection
+        self.interval = interval
+        self.timeout = timeout
+        self.path = path
+        self.fan_out = get_fan_out(connection.config.docker_backend, concurrency)
+
+    def run(self):
+        while True:
+            self.probe_all()
+            time.sleep(self.interval)
+
+    def probe(self, instance):
+        return readiness.probe(instance["node"], instance["port"], path=self.path, timeout=self.timeout)
+
+    def probe_all(self):
+        inventory = self.connection.shared_inventory
+        if inventory is not None and not inventory.acquire_writer():
+            return False
+        try:
+            instances = self.connection.known_instances()
+        except Exception as e:
+            logger.error("Listing instances to probe generated an exception: {}", e)
+            return False
+        cache = self.connection.health
+        for instance, healthy, exception in self.fan_out.map(self.probe, instances):
+            healthy = exception is None and healthy
+            if cache.record(instance["id"], healthy, time.time()) and not healthy:
+                logger.warn("Instance {} of {} on {}:{} is not healthy",
+                            instance["id"], instance["app"], instance["node"], instance["port"])
+        cache.retain([instance["id"] for instance in instances])
+        return True
@@ -0,0 +1,103 @@
+import threading
+from collections import deque
+from concurrent import futures
+
+# Calls timed per node and operation to pick hedge delays from, and how many are needed before hedging
+WINDOW = 200
+MIN_SAMPLES = 20
+
+
+class LatencyTracker(object):
+    """
+    Recent latencies of one node's calls per operation, for choosing when to hedge.
+    """
+    def __init__(self, percentile=95, window=WINDOW, min_samples=MIN_SAMPLES):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self._window = window
+        # Thresholds are recomputed every tenth of the window rather than on every call
+        self._recompute_every = max(window // 10, 1)
+        self._latencies = {}
+        self._counts = {}
+        self._thresholds = {}
+        self._lock = threading.Lock()
+
+    def observe(self, operation, seconds):
+        latencies = self._latencies.get(operation)
+        if latencies is None:
+            with self._lock:
+                latencies = self._latencies.setdefault(operation, deque(maxlen=self._window))
+        latencies.append(seconds)
+        # A racing update loses a count, which only delays the next recompute
+        count = self._counts[operation] = self._counts.get(operation, 0) + 1
+        if len(latencies) >= self.min_samples and \
+           (operation not in self._thresholds or count % self._recompute_every == 0):
+            self._thresholds[operation] = self.__percentile(latencies)
+
+    def __percentile(self, latencies):
+        ordered = sorted(latencies)
+        return ordered[min(len(ordered) - 1, len(ordered) * self.percentile // 100)]
+
+    def threshold(self, operation):
+        """
+        Seconds after which a call is slower than percentile of recent calls, or None until enough are known.
+        """
+        return self._thresholds.get(operation)
+
+
+class HedgeExecutor(object):
+    """
+    A thread pool that only takes calls it has an idle worker for, so that hedged calls never queue: a call
+    waiting for a worker would overrun a delay that was measured on calls that did not wait.
+    """
+    def __init__(self, max_workers):
+        self._executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._idle = threading.Semaphore(max_workers)
+
+    def submit_if_idle(self, fn):
+        """
+        A future of fn run on an idle worker, or None when every worker is busy.
+        """
+        if not self._idle.acquire(False):
+            return None
+        try:
+            future = self._executor.submit(fn)
+        except:
+            self._idle.release()
+            raise
+        future.add_done_callback(lambda _: self._idle.release())
+        return future
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+def hedged(fn, delay, executor, on_hedge=None):
+    """
+    Calls fn, and again if the first call has not returned within delay seconds. Returns the result of whichever
+    call succeeds first, raising only if both fail. The slower call is left to finish on its own.
+
+    Calls only run on idle workers of executor, a HedgeExecutor. Without one, fn is simply called on the calling
+    thread, and a slow first call is only hedged when there is one by then, so a busy captain stops hedging
+    rather than doubling its load.
+    """
+    first = executor.submit_if_idle(fn)
+    if first is None:
+        return fn()
+    done, _ = futures.wait([first], timeout=delay)
+    if done:
+        return first.result()
+    hedge = executor.submit_if_idle(fn)
+    if hedge is None:
+        return first.result()
+    if on_hedge is not None:
+        on_hedge()
+    pending = set([first, hedge])
+    failed = None
+    while pending:
+        done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            failed = future
+    return failed.result()
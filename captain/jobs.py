@@ -0,0 +1,251 @@
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from contextlib import closing
+from collections import OrderedDict
+from captain import exceptions
+from captain.logs import StructuredLogger
+
+logger = StructuredLogger(logging.getLogger('connection'))
+
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# Running jobs are saved at least this often, so that one whose worker has died can be told apart
+HEARTBEAT_INTERVAL = 10
+ABANDONED_AFTER = 6 * HEARTBEAT_INTERVAL
+
+
+def _abandoned(job, now):
+    return job.get("state") in (PENDING, RUNNING) and job.get("updated_at", now) < now - ABANDONED_AFTER
+
+
+def _reported(job):
+    """
+    The job as it should be reported: one still pending or running that has not been saved for
+    ABANDONED_AFTER seconds lost its worker, to a crash or a restart, and is failed.
+    """
+    if job is None or not _abandoned(job, time.time()):
+        return job
+    return dict(job, state=FAILED, error="Abandoned: its worker stopped saving it at {}".format(job["updated_at"]))
+
+
+def _same_active(job, other):
+    return other["kind"] == job["kind"] and other["request"] == job["request"] and other["state"] in (PENDING, RUNNING)
+
+
+class Job(object):
+    """
+    A long running operation carried out in the background. Steps record how far it has got, and every change
+    is saved to the registry's store so the job can be polled while it runs.
+    """
+    def __init__(self, kind, store, request=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.request = request
+        self.state = PENDING
+        self.steps = []
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.__store = store
+        self.__lock = threading.Lock()
+
+    def step(self, name, **details):
+        self.steps.append(dict(details, name=name, at=time.time()))
+        self.save()
+
+    def update_progress(self, **progress):
+        self.progress.update(progress)
+        self.save()
+
+    def save(self):
+        # The heartbeat saves from another thread, an older copy must not be saved over a newer one
+        with self.__lock:
+            self.updated_at = time.time()
+            self.__store.save(self.to_dict())
+
+    def to_dict(self):
+        return dict(id=self.id, kind=self.kind, request=self.request, state=self.state, steps=list(self.steps),
+                    progress=dict(self.progress), result=self.result, error=self.error,
+                    created_at=self.created_at, updated_at=self.updated_at)
+
+
+class MemoryJobStore(object):
+    """
+    Jobs of this process only, the most recent retention of them.
+    """
+    def __init__(self, retention):
+        self.retention = retention
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def save(self, job):
+        with self._lock:
+            self.__save(job)
+
+    def __save(self, job):
+        self._jobs.pop(job["id"], None)
+        self._jobs[job["id"]] = job
+        while len(self._jobs) > self.retention:
+            self._jobs.popitem(last=False)
+
+    def add_unless_active(self, job):
+        """
+        Saves job unless one of the same kind and request is pending or running, which is returned instead.
+        """
+        with self._lock:
+            for other in self._jobs.values():
+                other = _reported(other)
+                if _same_active(job, other):
+                    return other
+            self.__save(job)
+        return None
+
+    def load(self, job_id):
+        return _reported(self._jobs.get(job_id))
+
+    def recent(self, kind=None):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [_reported(job) for job in reversed(jobs) if kind is None or job["kind"] == kind]
+
+
+class SqliteJobStore(object):
+    """
+    Jobs kept in a SQLite file, so that every gunicorn worker can report jobs started by any of them.
+    """
+    def __init__(self, path, retention):
+        self.path = path
+        self.retention = retention
+        with closing(self.__connect()) as db:
+            with db:
+                db.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, kind TEXT, updated_at REAL, job TEXT)")
+
+    def __connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def save(self, job):
+        with closing(self.__connect()) as db:
+            with db:
+                self.__save(db, job)
+
+    def __save(self, db, job):
+        db.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?)",
+                   (job["id"], job["kind"], job["updated_at"], json.dumps(job)))
+        db.execute("DELETE FROM jobs WHERE id NOT IN (SELECT id FROM jobs ORDER BY updated_at DESC LIMIT ?)",
+                   (self.retention,))
+
+    def add_unless_active(self, job):
+        """
+        Saves job unless one of the same kind and request is pending or running, which is returned instead.
+        The check and the save are one transaction, so only one of two workers adding the same job at once
+        saves it. Abandoned jobs are saved as failed on the way.
+        """
+        with closing(self.__connect()) as db:
+            db.isolation_level = None
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                for row in db.execute("SELECT job FROM jobs WHERE kind = ?", (job["kind"],)).fetchall():
+                    stored = json.loads(row[0])
+                    other = _reported(stored)
+                    if other is not stored:
+                        logger.warn("Job {} {} was abandoned, failing it", other["kind"], other["id"])
+                        self.__save(db, dict(other, updated_at=time.time()))
+                    if _same_active(job, other):
+                        db.execute("ROLLBACK")
+                        return other
+                self.__save(db, job)
+                db.execute("COMMIT")
+            except:
+                db.execute("ROLLBACK")
+                raise
+        return None
+
+    def load(self, job_id):
+        with closing(self.__connect()) as db:
+            row = db.execute("SELECT job FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _reported(json.loads(row[0])) if row else None
+
+    def recent(self, kind=None):
+        with closing(self.__connect()) as db:
+            if kind is None:
+                rows = db.execute("SELECT job FROM jobs ORDER BY updated_at DESC").fetchall()
+            else:
+                rows = db.execute("SELECT job FROM jobs WHERE kind = ? ORDER BY updated_at DESC", (kind,)).fetchall()
+        return [_reported(json.loads(row[0])) for row in rows]
+
+
+class JobRegistry(object):
+    """
+    Runs jobs on their own background threads and keeps track of them. Running jobs are saved every
+    HEARTBEAT_INTERVAL seconds, those that stop being saved are reported as failed.
+    """
+    def __init__(self, store):
+        self.store = store
+        self._running = set()
+        self._lock = threading.Lock()
+        heartbeat = threading.Thread(target=self.__heartbeat, name="job-heartbeat")
+        heartbeat.daemon = True
+        heartbeat.start()
+
+    def submit(self, kind, fn, request=None, exclusive=False):
+        """
+        Starts fn(job) in the background and returns the job straight away. Whatever fn returns becomes the
+        result of the job, an exception fails it.
+
+        An exclusive job is not started while a job of the same kind and request is pending or running,
+        JobInProgressException is raised with that job instead.
+        """
+        job = Job(kind, self.store, request=request)
+        if exclusive:
+            active = self.store.add_unless_active(job.to_dict())
+            if active is not None:
+                raise exceptions.JobInProgressException(active)
+        else:
+            job.save()
+        thread = threading.Thread(target=self.__run, args=(job, fn), name="job-{}".format(job.id))
+        thread.daemon = True
+        thread.start()
+        return job
+
+    def __heartbeat(self):
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            with self._lock:
+                running = list(self._running)
+            for job in running:
+                try:
+                    job.save()
+                except Exception as e:
+                    logger.error("Saving job {} {} generated an exception: {}", job.kind, job.id, e)
+
+    def __run(self, job, fn):
+        with self._lock:
+            self._running.add(job)
+        job.state = RUNNING
+        job.save()
+        try:
+            job.result = fn(job)
+            job.state = SUCCEEDED
+            logger.info("Job {} {} succeeded", job.kind, job.id)
+        except Exception as e:
+            job.error = "{}: {}".format(type(e).__name__, e)
+            job.state = FAILED
+            logger.error("Job {} {} failed: {}", job.kind, job.id, job.error)
+        with self._lock:
+            self._running.discard(job)
+        job.save()
+
+    def get(self, job_id):
+        return self.store.load(job_id)
+
+    def recent(self, kind=None):
+        return self.store.recent(kind)
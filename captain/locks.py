@@ -0,0 +1,47 @@
+import os
+import time
+import fcntl
+from contextlib import contextmanager
+
+
+def try_lock(path):
+    """
+    Takes an exclusive flock on path without waiting. Returns the open file holding it, closing it releases the
+    lock, or None when another process, or another open file in this one, already holds it.
+    """
+    lock_file = open(path, 'a')
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+@contextmanager
+def locked(path, poll=0.05):
+    """
+    Holds an exclusive flock on path, polling every poll seconds until it is free rather than blocking, so
+    that a gevent worker keeps serving meanwhile. The file is removed again when done.
+    """
+    while True:
+        lock_file = try_lock(path)
+        if lock_file is not None:
+            # Whoever held the lock before may have removed the file we locked, only a lock on the file still
+            # at path excludes others
+            try:
+                if os.fstat(lock_file.fileno()).st_ino == os.stat(path).st_ino:
+                    break
+            except OSError:
+                pass
+            lock_file.close()
+        else:
+            time.sleep(poll)
+    try:
+        yield
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        lock_file.close()
@@ -0,0 +1,52 @@
+import time
+import tarfile
+import logging
+from cStringIO import StringIO
+from captain.logs import StructuredLogger
+
+logger = StructuredLogger(logging.getLogger('connection'))
+
+
+class _Chunks(object):
+    """
+    A write-only file that hands back what has been written to it since the last drain.
+    """
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(data)
+
+    def drain(self):
+        data = "".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def log_archive(connection, instances):
+    """
+    A gzipped tar of the logs of instances, fetched in parallel, yielded in chunks as each instance's logs
+    arrive. Each instance is app/node_id.log in the archive, or app/node_id.error when its logs could not
+    be fetched.
+    """
+    def fetch(instance):
+        return connection.node_connections[instance["node"]].logs(instance["id"])
+
+    output = _Chunks()
+    archive = tarfile.open(fileobj=output, mode="w|gz")
+    for instance, logs, exception in connection.fan_out.map(fetch, instances):
+        name = "{}/{}_{}".format(instance["app"], instance["node"], instance["id"])
+        if exception is not None:
+            logger.error("Fetching logs of {} on {} failed: {}", instance["id"], instance["node"], exception)
+            name, logs = name + ".error", "{}: {}\n".format(type(exception).__name__, exception)
+        else:
+            name += ".log"
+        if isinstance(logs, unicode):
+            logs = logs.encode("utf-8")
+        member = tarfile.TarInfo(name)
+        member.size = len(logs)
+        member.mtime = time.time()
+        archive.addfile(member, StringIO(logs))
+        yield output.drain()
+    archive.close()
+    yield output.drain()
@@ -0,0 +1,169 @@
+import Queue
+import logging
+import threading
+from collections import deque
+from captain.logs import StructuredLogger
+
+logger = StructuredLogger(logging.getLogger('connection'))
+
+# Put on a follower's queue when its stream has ended
+_END = object()
+
+
+class _Stream(object):
+    def __init__(self, instance_id, recent, upstream):
+        self.instance_id = instance_id
+        self.followers = set()
+        # The latest lines, replayed to every new follower
+        self.recent = recent
+        self.upstream = upstream
+        self.closed = False
+
+
+def open_log_stream(node_connection, instance_id):
+    """
+    The lines instance_id has logged so far, and an iterator of what it logs after them. Docker's log stream
+    starts by replaying everything already logged, so that many bytes are skipped from it.
+    """
+    history = node_connection.logs(instance_id)
+    return history.splitlines(True), _Skip(node_connection.logs(instance_id, stream=True), len(history))
+
+
+class _Skip(object):
+    """
+    The chunks, less their first count bytes. Closing it closes the chunks, which may be done from another
+    thread than the one iterating, unlike closing a generator.
+    """
+    def __init__(self, chunks, count):
+        self.chunks = iter(chunks)
+        self.count = count
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        while True:
+            chunk = next(self.chunks)
+            if self.count >= len(chunk):
+                self.count -= len(chunk)
+                continue
+            chunk, self.count = chunk[self.count:], 0
+            return chunk
+
+    def close(self):
+        close = getattr(self.chunks, "close", None)
+        if close is not None:
+            close()
+
+
+class LogBroadcaster(object):
+    """
+    Shares one upstream log stream per instance between everyone following its logs. Every follower, first or
+    not, starts with the latest backlog lines the instance logged and then gets each line as it is logged. Each
+    follower gets a queue of at most buffer_size lines on top of its backlog; a follower that falls that far
+    behind is disconnected rather than buffered for, and on_drop is called.
+
+    An upstream stream is closed as soon as its last follower leaves. Upstreams have to be closeable from
+    another thread than the one reading them, waking it up.
+    """
+    def __init__(self, buffer_size, backlog=0, on_drop=None):
+        self.buffer_size = buffer_size
+        self.backlog = backlog
+        self.on_drop = on_drop or (lambda: None)
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def follow(self, instance_id, open_upstream):
+        """
+        The latest backlog lines logged by instance_id, then lines as they are logged. The first follower of an
+        instance opens its upstream by calling open_upstream(), which returns the lines logged so far and an
+        iterator of the lines logged after them, and raises straight away if that fails.
+        """
+        # One more than the backlog and buffer, so there is always room to end the stream
+        queue = Queue.Queue(self.backlog + self.buffer_size + 1)
+        with self._lock:
+            stream = self._streams.get(instance_id)
+            if stream is not None:
+                self.__subscribe(stream, queue)
+        if stream is None:
+            history, upstream = open_upstream()
+            stream = _Stream(instance_id, deque(history, maxlen=self.backlog), upstream)
+            with self._lock:
+                # Another first follower may have opened one meanwhile, share whichever got there first
+                if instance_id in self._streams:
+                    stream = self._streams[instance_id]
+                    self.__subscribe(stream, queue)
+                    self.__close(upstream)
+                else:
+                    self.__subscribe(stream, queue)
+                    self._streams[instance_id] = stream
+                    thread = threading.Thread(target=self.__pump, args=(stream, upstream),
+                                              name="logs-{}".format(instance_id[:12]))
+                    thread.daemon = True
+                    thread.start()
+        return self.__lines(stream, queue)
+
+    def __subscribe(self, stream, queue):
+        # Called holding the lock, so that each line reaches the follower once, either replayed or live
+        for line in stream.recent:
+            queue.put_nowait(line)
+        stream.followers.add(queue)
+
+    def __lines(self, stream, queue):
+        try:
+            while True:
+                line = queue.get()
+                if line is _END:
+                    return
+                yield line
+        finally:
+            with self._lock:
+                stream.followers.discard(queue)
+                last = not stream.followers and self._streams.get(stream.instance_id) is stream
+                if last:
+                    del self._streams[stream.instance_id]
+                    stream.closed = True
+            if last:
+                # Wakes the pump up, Docker log streams wait for the next line without a timeout
+                self.__close(stream.upstream)
+
+    def __pump(self, stream, upstream):
+        try:
+            for line in upstream:
+                with self._lock:
+                    followers = list(stream.followers)
+                    stream.recent.append(line)
+                if not followers:
+                    break
+                for queue in followers:
+                    # This thread is the only one adding lines, so the queue cannot fill up in between
+                    if queue.qsize() < self.backlog + self.buffer_size:
+                        queue.put_nowait(line)
+                    else:
+                        logger.warn("Disconnecting a follower of {} that fell {} lines behind",
+                                    stream.instance_id, self.buffer_size)
+                        with self._lock:
+                            stream.followers.discard(queue)
+                        self.on_drop()
+                        queue.put_nowait(_END)
+        except Exception as e:
+            # Closing the upstream under the pump can make its read fail
+            if not stream.closed:
+                logger.error("Following logs of {} generated an exception: {}", stream.instance_id, e)
+        finally:
+            with self._lock:
+                if self._streams.get(stream.instance_id) is stream:
+                    del self._streams[stream.instance_id]
+                followers = list(stream.followers)
+            for queue in followers:
+                queue.put_nowait(_END)
+            self.__close(upstream)
+
+    def __close(self, upstream):
+        close = getattr(upstream, "close", None)
+        if close is not None:
+            close()
+
+    def stats(self):
+        with self._lock:
+            return dict(streams=len(self._streams), followers=sum(len(s.followers) for s in self._streams.values()))
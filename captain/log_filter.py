@@ -0,0 +1,64 @@
+import re
+import json
+
+
+class LogFilter(object):
+    """
+    Selects the log lines of an instance that match grep, do not match invert and, for JSON formatted lines,
+    have every one of fields set to the given value. Patterns are compiled once per filter, and lines are only
+    decoded as JSON once they contain every wanted value.
+    """
+    def __init__(self, grep=None, invert=None, fields=None):
+        self.grep = re.compile(grep) if grep else None
+        self.invert = re.compile(invert) if invert else None
+        self.fields = [(name.split("."), value.decode("utf-8") if isinstance(value, str) else unicode(value))
+                       for name, value in sorted((fields or {}).items())]
+        # Values that appear verbatim in any line holding them, unless JSON had to escape them
+        self.needles = [str(value) for _, value in self.fields if json.dumps(value)[1:-1] == value]
+
+    @classmethod
+    def parse_fields(cls, predicates):
+        """
+        Fields to match from name:value predicates, raising ValueError for any without a name.
+        """
+        fields = {}
+        for predicate in predicates or []:
+            name, separator, value = predicate.partition(":")
+            if not name or not separator:
+                raise ValueError("field predicates look like name:value, not {}".format(predicate))
+            fields[name] = value
+        return fields
+
+    def __nonzero__(self):
+        return bool(self.grep or self.invert or self.fields)
+
+    def matches(self, line):
+        if self.grep is not None and self.grep.search(line) is None:
+            return False
+        if self.invert is not None and self.invert.search(line) is not None:
+            return False
+        if self.fields:
+            for needle in self.needles:
+                if needle not in line:
+                    return False
+            try:
+                document = json.loads(line)
+            except ValueError:
+                return False
+            for path, value in self.fields:
+                if self.__field(document, path) != value:
+                    return False
+        return True
+
+    @staticmethod
+    def __field(document, path):
+        for name in path:
+            if not isinstance(document, dict) or name not in document:
+                return None
+            document = document[name]
+        return document if isinstance(document, basestring) else json.dumps(document)
+
+    def apply(self, lines):
+        if not self:
+            return lines
+        return (line for line in lines if self.matches(line))
@@ -0,0 +1,64 @@
+import random
+import logging
+import logging.config
+import threading
+from captain.tracing import RequestIdFilter
+
+_lock = threading.Lock()
+_configured = False
+
+
+def setup_logging(config_file="logging.conf"):
+    """
+    Configures logging from config_file the first time it is called, later calls do nothing.
+    """
+    global _configured
+    with _lock:
+        if not _configured:
+            # Keep loggers created by modules imported before this point (e.g. captain.connection)
+            logging.config.fileConfig(config_file, disable_existing_loggers=False)
+            for name in ("captain_web", "connection"):
+                logging.getLogger(name).addFilter(RequestIdFilter())
+            _configured = True
+
+
+class StructuredLogger(object):
+    """
+    Logs dict messages like logger.debug(dict(message="...".format(...))), but only formats the message and
+    builds the dict for records the logger will emit:
+
+        logger = StructuredLogger(logging.getLogger('connection'))
+        logger.debug("Cache miss on node {} container {}", node, container_id)
+
+    Events logged with sampled=True, such as one per container per scan, are only kept for a sample_rate
+    fraction of calls.
+    """
+    def __init__(self, logger, sample_rate=1.0):
+        self.logger = logger
+        self.sample_rate = sample_rate
+
+    def isEnabledFor(self, level):
+        return self.logger.isEnabledFor(level)
+
+    def log(self, level, message, *args, **fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        if fields.pop("sampled", False) and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        exc_info = fields.pop("exc_info", None)
+        fields["message"] = message.format(*args) if args else message
+        self.logger.log(level, fields, exc_info=exc_info)
+
+    def debug(self, message, *args, **fields):
+        self.log(logging.DEBUG, message, *args, **fields)
+
+    def info(self, message, *args, **fields):
+        self.log(logging.INFO, message, *args, **fields)
+
+    def warn(self, message, *args, **fields):
+        self.log(logging.WARNING, message, *args, **fields)
+
+    warning = warn
+
+    def error(self, message, *args, **fields):
+        self.log(logging.ERROR, message, *args, **fields)
@@ -0,0 +1,186 @@
+import gc
+import bisect
+import threading
+from collections import deque
+
+# Seconds, from a cached ping to a scan of a busy node
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Fold pending observations into the totals once this many pile up between scrapes
+FOLD_THRESHOLD = 10000
+
+
+def _escape(value):
+    return unicode(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labelnames, labels, extra=()):
+    pairs = zip(labelnames, labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(u'{}="{}"'.format(name, _escape(value)) for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(object):
+    """
+    Observations are appended to a deque, which is atomic, so recording never takes a lock. They are folded
+    into the totals when the metric is read, or by the recording thread that finds FOLD_THRESHOLD of them
+    pending and the fold lock free.
+    """
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._pending = deque()
+        self._fold_lock = threading.Lock()
+
+    def _record(self, labels, value):
+        self._pending.append((labels, value))
+        if len(self._pending) > FOLD_THRESHOLD and self._fold_lock.acquire(False):
+            try:
+                self._fold()
+            finally:
+                self._fold_lock.release()
+
+    def _fold(self):
+        while True:
+            try:
+                labels, value = self._pending.popleft()
+            except IndexError:
+                return
+            self._add(labels, value)
+
+    def _add(self, labels, value):
+        raise NotImplementedError()
+
+    def collect(self):
+        """
+        Returns the lines of this metric in the Prometheus text format.
+        """
+        with self._fold_lock:
+            self._fold()
+            lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} {}".format(self.name, self.type)]
+            lines.extend(self._lines())
+        return lines
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super(Counter, self).__init__(name, help, labelnames)
+        self._values = {}
+
+    def inc(self, labels=(), amount=1):
+        self._record(labels, amount)
+
+    def _add(self, labels, value):
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def values(self):
+        with self._fold_lock:
+            self._fold()
+            return dict(self._values)
+
+    def _lines(self):
+        return [u"{}{} {}".format(self.name, _format_labels(self.labelnames, labels), _format_value(value))
+                for labels, value in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+
+    def observe(self, labels, value):
+        self._record(labels, value)
+
+    def _add(self, labels, value):
+        counts, total = self._values.get(labels, (None, 0.0))
+        if counts is None:
+            counts = [0] * (len(self.buckets) + 1)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._values[labels] = (counts, total + value)
+
+    def values(self):
+        """
+        Returns (count, sum) keyed by labels.
+        """
+        with self._fold_lock:
+            self._fold()
+            return dict((labels, (sum(counts), total)) for labels, (counts, total) in self._values.items())
+
+    def _lines(self):
+        lines = []
+        for labels, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(u"{}_bucket{} {}".format(
+                    self.name, _format_labels(self.labelnames, labels, [("le", _format_value(float(bound)))]), cumulative))
+            lines.append(u"{}_sum{} {}".format(self.name, _format_labels(self.labelnames, labels), repr(total)))
+            lines.append(u"{}_count{} {}".format(self.name, _format_labels(self.labelnames, labels), cumulative))
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    A value read when the metric is collected, from a function returning values keyed by labels.
+    """
+    type = "gauge"
+
+    def __init__(self, name, help, labelnames, read):
+        super(Gauge, self).__init__(name, help, labelnames)
+        self.read = read
+
+    def _add(self, labels, value):
+        pass
+
+    def _lines(self):
+        return [u"{}{} {}".format(self.name, _format_labels(self.labelnames, labels), _format_value(value))
+                for labels, value in sorted(self.read().items())]
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, labelnames, read):
+        return self.register(Gauge(name, help, labelnames, read))
+
+    def render(self):
+        """
+        Returns every registered metric in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.collect())
+        return u"\n".join(lines) + u"\n"
+
+
+def gc_gauges(registry):
+    registry.gauge("python_gc_count", "Allocations less deallocations since the last collection of each generation",
+                   ("generation",), lambda: dict(((str(generation),), count) for generation, count in enumerate(gc.get_count())))
+    registry.gauge("python_gc_uncollectable_objects", "Objects the collector found unreachable but could not free",
+                   (), lambda: {(): len(gc.garbage)})
@@ -0,0 +1,86 @@
+import time
+import random
+import functools
+from requests.exceptions import ConnectionError
+from captain import tracing
+from captain import admission
+from captain.hedging import LatencyTracker, hedged
+
+# The Docker API calls captain makes, each is measured per node
+DOCKER_OPERATIONS = frozenset(["ping", "containers", "inspect_container", "create_container", "start", "stop",
+                               "remove_container", "logs"])
+
+# Reads that can safely be retried or sent twice
+IDEMPOTENT_OPERATIONS = frozenset(["ping", "containers", "inspect_container"])
+
+
+class NodeClient(object):
+    """
+    The docker client of one node. Every Docker API call goes through call(), which waits to be admitted to
+    the node, records its latency and errors and traces it as part of the current request. Anything else is
+    passed straight to the docker client.
+
+    Idempotent reads that fail to connect are retried up to retries times with jittered exponential backoff.
+    Reads that time out are not, as a hung daemon would only take another timeout to fail again. Given a
+    hedge_executor, a read still running after the node's recent p95 latency for that operation is sent again
+    while the executor has an idle worker for it, and whichever answer comes first is used.
+    """
+    def __init__(self, node, client, node_admission, metrics, retries=0, backoff=0.1, hedge_executor=None):
+        self.node = node
+        self.client = client
+        self.admission = node_admission
+        self.latencies = LatencyTracker()
+        self.__metrics = metrics
+        self.__retries = retries
+        self.__backoff = backoff
+        self.__hedge_executor = hedge_executor
+
+    def __getattr__(self, name):
+        if name in DOCKER_OPERATIONS:
+            return functools.partial(self.call, name)
+        return getattr(self.client, name)
+
+    def call(self, operation, *args, **kwargs):
+        if operation not in IDEMPOTENT_OPERATIONS:
+            return self.__attempt(operation, args, kwargs)
+        attempt = 0
+        while True:
+            try:
+                return self.__read(operation, args, kwargs)
+            except ConnectionError:
+                if attempt >= self.__retries:
+                    raise
+                delay = self.__backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+                attempt += 1
+                self.__metrics.docker_retries.inc((self.node, operation))
+                time.sleep(delay)
+
+    def __read(self, operation, args, kwargs):
+        delay = self.latencies.threshold(operation)
+        if self.__hedge_executor is None or delay is None:
+            return self.__attempt(operation, args, kwargs)
+        attempt = admission.bind(tracing.bind(lambda: self.__attempt(operation, args, kwargs)))
+        return hedged(attempt, delay, self.__hedge_executor,
+                      on_hedge=lambda: self.__metrics.docker_hedges.inc((self.node, operation)))
+
+    def __attempt(self, operation, args, kwargs):
+        priority = admission.current_priority()
+        queued = time.time()
+        with tracing.span("admission", node=self.node, operation=operation):
+            self.admission.acquire(priority)
+        start = time.time()
+        self.__metrics.docker_admission_seconds.observe((self.node, admission.PRIORITY_NAMES[priority]), start - queued)
+        try:
+            with tracing.span("docker", node=self.node, operation=operation):
+                result = getattr(self.client, operation)(*args, **kwargs)
+            self.latencies.observe(operation, time.time() - start)
+            return result
+        except Exception as e:
+            self.__metrics.docker_call_errors.inc((self.node, operation, type(e).__name__))
+            raise
+        finally:
+            self.admission.release()
+            self.__metrics.docker_call_seconds.observe((self.node, operation), time.time() - start)
+
+    def __repr__(self):
+        return "NodeClient({})".format(self.node)
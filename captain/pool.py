@@ -0,0 +1,41 @@
+import threading
+from requests.adapters import HTTPAdapter
+
+
+class PooledAdapter(HTTPAdapter):
+    """
+    HTTPAdapter with a configurable connection pool that keeps track of how busy the pool is.
+
+    Requests made while every pooled connection is in use either wait for one (pool_block) or go ahead on a
+    connection that is thrown away afterwards; either way they are counted as saturated requests.
+    """
+    def __init__(self, pool_size, pool_block=False):
+        self.pool_size = pool_size
+        self._stats_lock = threading.Lock()
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._requests = 0
+        self._saturated_requests = 0
+        super(PooledAdapter, self).__init__(pool_connections=1, pool_maxsize=pool_size, pool_block=pool_block)
+
+    def send(self, request, **kwargs):
+        with self._stats_lock:
+            self._in_flight += 1
+            self._requests += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+            if self._in_flight > self.pool_size:
+                self._saturated_requests += 1
+        try:
+            return super(PooledAdapter, self).send(request, **kwargs)
+        finally:
+            with self._stats_lock:
+                self._in_flight -= 1
+
+    def stats(self):
+        pools = [self.poolmanager.pools[key] for key in self.poolmanager.pools.keys()]
+        return dict(pool_size=self.pool_size,
+                    in_flight=self._in_flight,
+                    peak_in_flight=self._peak_in_flight,
+                    requests=self._requests,
+                    saturated_requests=self._saturated_requests,
+                    connections_opened=sum(pool.num_connections for pool in pools))
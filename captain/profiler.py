@@ -0,0 +1,104 @@
+import os
+import sys
+import time
+import signal
+import thread
+import threading
+from collections import Counter
+
+MAX_SECONDS = 60
+
+
+class ProfilerBusyException(Exception):
+    pass
+
+
+def _walk(frame):
+    while frame is not None:
+        yield frame
+        frame = frame.f_back
+
+
+def collapse(frame):
+    """
+    The stack of frame root first, in the folded format read by flamegraph.pl.
+    """
+    return ";".join("{} ({}:{})".format(f.f_code.co_name, os.path.basename(f.f_code.co_filename), f.f_code.co_firstlineno)
+                    for f in reversed(list(_walk(frame))))
+
+
+class SamplingProfiler(object):
+    """
+    Samples the stacks of every thread for a number of seconds and counts them. Nothing is installed until
+    profile() is called, and everything is removed when it returns.
+
+    Called from the main thread, as under gunicorn's gevent worker where every greenlet runs on it, samples are
+    taken from a SIGPROF timer so whichever greenlet holds the CPU is caught, along with any other threads.
+    Elsewhere a sampling thread reads the stacks of all threads at the same interval.
+    """
+    _lock = threading.Lock()
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = Counter()
+        self._own_frame = None
+
+    def profile(self, seconds):
+        if not SamplingProfiler._lock.acquire(False):
+            raise ProfilerBusyException()
+        try:
+            seconds = min(seconds, MAX_SECONDS)
+            self._own_frame = sys._getframe()
+            try:
+                self.__profile_with_timer(seconds)
+            except ValueError:
+                # signal handlers can only be set from the main thread
+                self.__profile_with_thread(seconds)
+            return self.samples
+        finally:
+            self._own_frame = None
+            SamplingProfiler._lock.release()
+
+    def __is_own(self, frame):
+        return any(f is self._own_frame for f in _walk(frame))
+
+    def __sample(self, frames):
+        for f in frames:
+            if not self.__is_own(f):
+                self.samples[collapse(f)] += 1
+
+    def __profile_with_timer(self, seconds):
+        def on_sigprof(signum, interrupted):
+            others = [f for f in sys._current_frames().values() if not any(g is interrupted for g in _walk(f))]
+            self.__sample([interrupted] + others)
+
+        previous = signal.signal(signal.SIGPROF, on_sigprof)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        try:
+            deadline = time.time() + seconds
+            # Signals cut sleeps short, and handling one can take us past the deadline before sleeping again
+            while time.time() < deadline:
+                time.sleep(max(0, deadline - time.time()))
+        finally:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, previous)
+
+    def __profile_with_thread(self, seconds):
+        def sample():
+            own = thread.get_ident()
+            deadline = time.time() + seconds
+            while time.time() < deadline:
+                self.__sample([f for ident, f in sys._current_frames().items() if ident != own])
+                time.sleep(self.interval)
+
+        sampler = threading.Thread(target=sample, name="profiler")
+        sampler.daemon = True
+        sampler.start()
+        sampler.join()
+
+
+def folded(samples):
+    """
+    Sample counts as collapsed stack lines, most frequent first.
+    """
+    return "".join("{} {}\n".format(stack, count) for stack, count in samples.most_common())
@@ -0,0 +1,43 @@
+import time
+import socket
+import logging
+import requests
+from captain.logs import StructuredLogger
+
+logger = StructuredLogger(logging.getLogger('connection'))
+
+
+def probe(host, port, path=None, timeout=2):
+    """
+    True when host accepts TCP connections on port or, given a path, answers an HTTP GET of it without a server
+    error.
+    """
+    try:
+        if path is None:
+            socket.create_connection((host, port), timeout=timeout).close()
+            return True
+        return requests.get("http://{}:{}{}".format(host, port, path), timeout=timeout).status_code < 500
+    except (socket.error, requests.exceptions.RequestException):
+        return False
+
+
+def wait_until_ready(host, port, timeout, interval=1, path=None):
+    """
+    Probes host:port every interval seconds until it is ready, returning False if it is not within timeout.
+    """
+    deadline = time.time() + timeout
+    while True:
+        if probe(host, port, path=path, timeout=min(interval * 2, max(deadline - time.time(), 0.1))):
+            return True
+        if time.time() + interval > deadline:
+            logger.warn("{}:{} not ready after {}s", host, port, timeout)
+            return False
+        time.sleep(interval)
+
+
+def instance_ready(instance, config):
+    """
+    Waits for a started instance to bind its public port, as configured by READINESS_*.
+    """
+    return wait_until_ready(instance["node"], instance["port"], config.readiness_timeout,
+                            interval=config.readiness_interval, path=config.readiness_path)
@@ -0,0 +1,294 @@
+import json
+import time
+import sqlite3
+import logging
+import threading
+from contextlib import closing
+from collections import Counter
+from captain import deploy
+from captain import exceptions
+from captain.admission import deploy_operation
+from captain.locks import try_lock
+from captain.logs import StructuredLogger
+
+logger = StructuredLogger(logging.getLogger('connection'))
+
+
+class MemoryDesiredState(object):
+    """
+    The desired state of this process only.
+    """
+    def __init__(self):
+        self._specs = {}
+        self._unschedulable = set()
+        self._lock = threading.Lock()
+
+    def set(self, app, spec):
+        with self._lock:
+            self._specs[app] = spec
+
+    def remove(self, app):
+        with self._lock:
+            return self._specs.pop(app, None) is not None
+
+    def get(self, app):
+        return self._specs.get(app)
+
+    def all(self):
+        with self._lock:
+            return dict(self._specs)
+
+    def set_schedulable(self, node, schedulable):
+        with self._lock:
+            if schedulable:
+                self._unschedulable.discard(node)
+            else:
+                self._unschedulable.add(node)
+
+    def unschedulable(self):
+        with self._lock:
+            return set(self._unschedulable)
+
+
+class SqliteDesiredState(object):
+    """
+    The desired state kept in a SQLite file, shared by every gunicorn worker and kept across restarts.
+    """
+    def __init__(self, path):
+        self.path = path
+        with closing(self.__connect()) as db:
+            with db:
+                db.execute("CREATE TABLE IF NOT EXISTS desired (app TEXT PRIMARY KEY, spec TEXT)")
+                db.execute("CREATE TABLE IF NOT EXISTS unschedulable (node TEXT PRIMARY KEY)")
+
+    def __connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def set(self, app, spec):
+        with closing(self.__connect()) as db:
+            with db:
+                db.execute("INSERT OR REPLACE INTO desired VALUES (?, ?)", (app, json.dumps(spec)))
+
+    def remove(self, app):
+        with closing(self.__connect()) as db:
+            with db:
+                return db.execute("DELETE FROM desired WHERE app = ?", (app,)).rowcount > 0
+
+    def get(self, app):
+        with closing(self.__connect()) as db:
+            row = db.execute("SELECT spec FROM desired WHERE app = ?", (app,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def all(self):
+        with closing(self.__connect()) as db:
+            rows = db.execute("SELECT app, spec FROM desired").fetchall()
+        return dict((app, json.loads(spec)) for app, spec in rows)
+
+    def set_schedulable(self, node, schedulable):
+        with closing(self.__connect()) as db:
+            with db:
+                if schedulable:
+                    db.execute("DELETE FROM unschedulable WHERE node = ?", (node,))
+                else:
+                    db.execute("INSERT OR REPLACE INTO unschedulable VALUES (?)", (node,))
+
+    def unschedulable(self):
+        with closing(self.__connect()) as db:
+            return set(row[0] for row in db.execute("SELECT node FROM unschedulable").fetchall())
+
+
+def _text(value):
+    # Environments compare equal to those of instances, which Docker hands back as unicode
+    return value if isinstance(value, unicode) else str(value).decode("utf-8")
+
+
+def make_spec(spec, default_slots):
+    """
+    Validates a desired state spec for an app, raising ValueError if it is not one, and fills in its defaults.
+    """
+    if not isinstance(spec, dict) or not spec.get("slug_uri"):
+        raise ValueError("slug_uri is required")
+    count = spec.get("count")
+    if not isinstance(count, int) or isinstance(count, bool) or count < 0:
+        raise ValueError("count should be a whole number of instances")
+    environment = spec.get("environment") or {}
+    if not isinstance(environment, dict):
+        raise ValueError("environment should be an object")
+    slots = spec.get("slots")
+    if slots is None:
+        slots = default_slots
+    if not isinstance(slots, int) or slots < 1:
+        raise ValueError("slots should be at least 1")
+    try:
+        environment = dict((_text(k), _text(v)) for k, v in environment.items())
+    except UnicodeDecodeError:
+        raise ValueError("environment should be UTF-8 text")
+    return dict(slug_uri=spec["slug_uri"], environment=environment, slots=slots, count=count)
+
+
+def matches(instance, spec):
+    """
+    Whether instance runs spec. Only the variables the spec sets are compared, others may come from the
+    slug runner image or have been added to the instance some other way.
+    """
+    return instance["slug_uri"] == spec["slug_uri"] and instance["slots"] == spec["slots"] and \
+        all(instance["environment"].get(name) == value for name, value in spec["environment"].items())
+
+
+def drift(spec, instances):
+    """
+    How the running instances of an app differ from its spec. Stale instances run anything other than the spec.
+    """
+    current = [instance for instance in instances if matches(instance, spec)]
+    stale = [instance for instance in instances if not matches(instance, spec)]
+    return dict(desired=spec["count"], running=len(current), stale=len(stale),
+                missing=max(spec["count"] - len(current), 0), surplus=max(len(current) - spec["count"], 0),
+                converged=len(current) == spec["count"] and not stale)
+
+
+def plan_stops(spec, current, stale):
+    """
+    The instances of an app to stop once current holds its instances matching the spec. Surplus instances are
+    taken from the nodes running most of the app, and stale ones only as far as current can replace them.
+    """
+    stops = []
+    by_node = Counter(instance["node"] for instance in current)
+    for _ in xrange(max(len(current) - spec["count"], 0)):
+        node = max(by_node, key=lambda n: (by_node[n], n))
+        instance = [i for i in current if i["node"] == node and i not in stops][0]
+        stops.append(instance)
+        by_node[node] -= 1
+    keep = max(spec["count"] - len(current), 0)
+    return stops + sorted(stale, key=lambda i: i["id"])[:max(len(stale) - keep, 0)]
+
+
+class Reconciler(object):
+    """
+    Converges the cluster on the desired state: starts instances of an app until count of them run its spec,
+    then stops whatever else of the app is running. Apps without a spec are left alone.
+
+    Every pass works from a single scan and starts and stops in parallel, at most max_starts and max_stops
+    instances at a time, so that a large drift is worked off over several passes. Passes are claimed one at a
+    time with claim_pass(), across every worker sharing pass_lock_path.
+    """
+    def __init__(self, connection, desired, max_starts, max_stops, pass_lock_path=None):
+        self.connection = connection
+        self.desired = desired
+        self.max_starts = max_starts
+        self.max_stops = max_stops
+        self.pass_lock_path = pass_lock_path
+        self.last_pass = None
+        self._pass_lock = threading.Lock()
+
+    def claim_pass(self):
+        """
+        Claims the right to make a pass, so that two passes never plan from the same scan and start the same
+        instances twice. Returns a function that gives the claim up, or None while another pass holds it.
+        """
+        if self.pass_lock_path is None:
+            return self._pass_lock.release if self._pass_lock.acquire(False) else None
+        lock_file = try_lock(self.pass_lock_path)
+        return lock_file.close if lock_file is not None else None
+
+    def status(self):
+        """
+        The spec and drift of every app, from the current inventory.
+        """
+        specs = self.desired.all()
+        instances = self.connection.get_instances() if specs else []
+        apps = {}
+        for app, spec in specs.items():
+            apps[app] = dict(spec=spec, drift=drift(spec, [i for i in instances if i["app"] == app]))
+        return dict(apps=apps, last_pass=self.last_pass)
+
+    @deploy_operation
+    def reconcile(self):
+        """
+        Makes one pass at converging, returning what was started, stopped and failed.
+        """
+        specs = self.desired.all()
+        result = dict(started=[], stopped=[], failed=[], at=time.time())
+        if not specs:
+            return result
+        instances = self.connection.scan_instances()
+        free = deploy.free_slots(self.connection, instances)
+
+        launches = []
+        for app in sorted(specs):
+            spec = specs[app]
+            current = [i for i in instances if i["app"] == app and matches(i, spec)]
+            for _ in xrange(max(spec["count"] - len(current), 0)):
+                if len(launches) >= self.max_starts:
+                    break
+                try:
+                    node = deploy.place(free, spec["slots"])
+                except exceptions.NodeOutOfCapacityException:
+                    result["failed"].append(dict(app=app, error="No node has {} slots free".format(spec["slots"])))
+                    break
+                launches.append(dict(app=app, slug_uri=spec["slug_uri"], environment=dict(spec["environment"]),
+                                     slots=spec["slots"], node=node))
+        for launch, instance, exception in self.connection.fan_out.map(
+                lambda launch: deploy.launch_ready(self.connection, launch), launches):
+            if exception is not None:
+                logger.error("Reconciling {} failed to start on {}: {}", launch["app"], launch["node"], exception)
+                result["failed"].append(dict(app=launch["app"], node=launch["node"], error=str(exception)))
+            else:
+                result["started"].append(instance)
+
+        stops = []
+        for app in sorted(specs):
+            spec = specs[app]
+            app_instances = [i for i in instances if i["app"] == app] + \
+                [i for i in result["started"] if i["app"] == app]
+            current = [i for i in app_instances if matches(i, spec)]
+            stale = [i for i in app_instances if not matches(i, spec)]
+            stops.extend(plan_stops(spec, current, stale))
+        result["stopped"] = deploy.remove_batch(self.connection, stops[:self.max_stops])
+
+        if result["started"] or result["stopped"] or result["failed"]:
+            logger.info("Reconciled {} apps: started {}, stopped {}, {} failed",
+                        len(specs), len(result["started"]), len(result["stopped"]), len(result["failed"]))
+        self.last_pass = dict(at=result["at"], started=len(result["started"]), stopped=len(result["stopped"]),
+                              failed=result["failed"])
+        return result
+
+
+class ReconcileLoop(threading.Thread):
+    """
+    Reconciles every interval seconds. Given a lock_path, only the process holding the lock on it reconciles,
+    so that the workers of one captain do not start the same instances twice.
+    """
+    def __init__(self, reconciler, interval, lock_path=None):
+        super(ReconcileLoop, self).__init__(name='reconciler')
+        self.daemon = True
+        self.reconciler = reconciler
+        self.interval = interval
+        self.lock_path = lock_path
+        self._lock_file = None
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.tick()
+
+    def acquire(self):
+        if self.lock_path is None or self._lock_file is not None:
+            return True
+        self._lock_file = try_lock(self.lock_path)
+        return self._lock_file is not None
+
+    def tick(self):
+        if not self.acquire():
+            return False
+        release = self.reconciler.claim_pass()
+        if release is None:
+            logger.debug("Skipping a reconcile pass, another one is running")
+            return False
+        try:
+            self.reconciler.reconcile()
+            return True
+        except Exception as e:
+            logger.error("Reconciling generated an exception: {}", e)
+            return False
+        finally:
+            release()
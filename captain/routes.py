@@ -0,0 +1,46 @@
+import json
+import hashlib
+from collections import defaultdict
+
+
+def routing_table(instances):
+    """
+    Where each app can be reached: its instances' node and public port, in a stable order.
+    """
+    routes = defaultdict(list)
+    for instance in instances:
+        routes[instance["app"]].append(dict(node=instance["node"], port=instance["port"]))
+    return dict((app, sorted(servers, key=lambda s: (s["node"], s["port"]))) for app, servers in routes.items())
+
+
+def render_json(routes):
+    return json.dumps(routes, sort_keys=True, separators=(',', ':'))
+
+
+def render_nginx(routes):
+    lines = []
+    for app in sorted(routes):
+        lines.append("upstream {} {{".format(app))
+        lines.extend("    server {}:{};".format(server["node"], server["port"]) for server in routes[app])
+        lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def render_haproxy(routes):
+    lines = []
+    for app in sorted(routes):
+        lines.append("backend {}".format(app))
+        lines.extend("    server {node}_{port} {node}:{port} check".format(**server) for server in routes[app])
+    return "\n".join(lines) + "\n"
+
+
+# Formats the routing table can be rendered in, with their mimetype
+FORMATS = {
+    "json": (render_json, "application/json"),
+    "nginx": (render_nginx, "text/plain"),
+    "haproxy": (render_haproxy, "text/plain"),
+}
+
+
+def etag(body):
+    return hashlib.sha1(body).hexdigest()
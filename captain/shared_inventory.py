@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import fcntl
+import struct
+import tempfile
+import threading
+import logging
+from collections import namedtuple
+from captain.logs import StructuredLogger
+
+logger = StructuredLogger(logging.getLogger('connection'))
+
+# Snapshot file layout: fixed header followed by a JSON encoded object of the instances and their health.
+#   magic, version (monotonic across writers), written at (epoch seconds), payload length
+_HEADER = struct.Struct('>4sQdI')
+_MAGIC = 'CAP2'
+
+Snapshot = namedtuple('Snapshot', ['version', 'written_at', 'instances', 'health'])
+
+
+class SharedInventory(object):
+    """
+    Cluster inventory shared between the worker processes of one captain through a snapshot file.
+
+    A single writer (whichever process holds the writer lock) publishes snapshots by writing a new file and
+    renaming it over the old one, so readers never see a partially written snapshot. Readers only read and
+    decode the file again when a new one has been published, and keep serving the last snapshot they could
+    decode when it is not a valid inventory.
+
+    The writer also runs the health prober, and publishes its results with the instances.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self._lock_file = None
+        self._read_lock = threading.Lock()
+        self._read_inode = None
+        self._snapshot = None
+        self._written_version = 0
+
+    def acquire_writer(self):
+        if self._lock_file is not None:
+            return True
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            lock_file.close()
+            return False
+        logger.info("Process {} is now the inventory writer for {}", os.getpid(), self.path)
+        self._lock_file = lock_file
+        return True
+
+    def release_writer(self):
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+    def write(self, instances, health=None):
+        # Carry on from the version in the file when its header can be read, so that versions keep increasing
+        # when another process takes over writing, but never depend on the rest of it being valid
+        version = max(self.__file_version(), self._written_version) + 1
+        payload = json.dumps(dict(instances=instances, health=health or {}), separators=(',', ':'))
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), prefix='.captain-inventory')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                tmp_file.write(_HEADER.pack(_MAGIC, version, time.time(), len(payload)))
+                tmp_file.write(payload)
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+            os.rename(tmp_path, self.path)
+        except:
+            os.unlink(tmp_path)
+            raise
+        self._written_version = version
+        logger.debug("Wrote inventory version {} with {} instances", version, len(instances))
+        return version
+
+    def read(self, max_age=None):
+        with self._read_lock:
+            try:
+                inode = os.stat(self.path).st_ino
+            except OSError:
+                return None
+            if inode != self._read_inode:
+                self.__reload(inode)
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        if max_age is not None and time.time() - snapshot.written_at > max_age:
+            logger.debug("Inventory version {} is older than {}s, ignoring", snapshot.version, max_age)
+            return None
+        return snapshot
+
+    def __file_version(self):
+        try:
+            with open(self.path, 'rb') as snapshot_file:
+                magic, version, _, _ = _HEADER.unpack(snapshot_file.read(_HEADER.size))
+        except (IOError, OSError, struct.error):
+            return 0
+        return version if magic == _MAGIC else 0
+
+    def __reload(self, inode):
+        try:
+            with open(self.path, 'rb') as snapshot_file:
+                data = snapshot_file.read()
+            magic, version, written_at, length = _HEADER.unpack_from(data)
+            if magic != _MAGIC:
+                raise ValueError("not a captain inventory")
+            payload = data[_HEADER.size:]
+            if len(payload) != length:
+                raise ValueError("expected {} bytes of instances, found {}".format(length, len(payload)))
+            decoded = json.loads(payload)
+            instances, health = decoded["instances"], decoded["health"]
+        except (IOError, OSError, ValueError, KeyError, TypeError, struct.error) as e:
+            # Not tried again until a new file is published, the last good snapshot is served until it expires
+            logger.warn("Unable to read inventory {}, ignoring: {}", self.path, e)
+            self._read_inode = inode
+            return
+        self._read_inode = inode
+        self._snapshot = Snapshot(version, written_at, instances, health)
+
+
+class InventoryPoller(threading.Thread):
+    """
+    Keeps a SharedInventory up to date, with the health of the instances as this process last probed them.
+    Every worker runs one, but only the process holding the writer lock scans Docker; the others keep trying
+    to take over in case the writer dies.
+    """
+    def __init__(self, connection, inventory, interval):
+        super(InventoryPoller, self).__init__(name='inventory-poller')
+        self.daemon = True
+        self.connection = connection
+        self.inventory = inventory
+        self.interval = interval
+
+    def run(self):
+        while True:
+            self.poll()
+            time.sleep(self.interval)
+
+    def poll(self):
+        if not self.inventory.acquire_writer():
+            return False
+        try:
+            self.inventory.write(self.connection.scan_instances(), health=self.connection.health.snapshot())
+            return True
+        except Exception as e:
+            logger.error("Publishing inventory generated an exception: {}", e)
+            return False
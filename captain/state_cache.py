@@ -0,0 +1,87 @@
+import json
+import time
+import sqlite3
+import threading
+import logging
+from contextlib import closing
+from captain.logs import StructuredLogger
+
+logger = StructuredLogger(logging.getLogger('connection'))
+
+
+class StateCache(object):
+    """
+    Checkpoints the instances captain last saw, and the container inspections they were built from, to a local
+    SQLite database so a restarted captain can answer straight away instead of inspecting the whole cluster.
+    """
+    def __init__(self, path):
+        self.path = path
+        with closing(self.__connect()) as db:
+            with db:
+                db.execute("CREATE TABLE IF NOT EXISTS checkpoint "
+                           "(id INTEGER PRIMARY KEY CHECK (id = 0), saved_at REAL, instances TEXT)")
+                db.execute("CREATE TABLE IF NOT EXISTS inspections "
+                           "(node TEXT, container_id TEXT, status TEXT, public_port INTEGER, container TEXT, "
+                           "PRIMARY KEY (node, container_id, status, public_port))")
+
+    def __connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def save(self, instances, inspections):
+        with closing(self.__connect()) as db:
+            with db:
+                db.execute("DELETE FROM inspections")
+                db.executemany("INSERT INTO inspections VALUES (?, ?, ?, ?, ?)",
+                               ((node, container_id, status, public_port, json.dumps(container))
+                                for (node, container_id, status, public_port), container in inspections.items()))
+                db.execute("INSERT OR REPLACE INTO checkpoint VALUES (0, ?, ?)", (time.time(), json.dumps(instances)))
+        logger.debug("Checkpointed {} instances and {} inspections to {}", len(instances), len(inspections), self.path)
+
+    def load(self, max_age=None):
+        with closing(self.__connect()) as db:
+            checkpoint = db.execute("SELECT saved_at, instances FROM checkpoint").fetchone()
+            if checkpoint is None:
+                return None
+            saved_at, instances = checkpoint[0], json.loads(checkpoint[1])
+            if max_age is not None and time.time() - saved_at > max_age:
+                logger.info("Checkpoint in {} is older than {}s, ignoring", self.path, max_age)
+                return None
+            inspections = dict(((node, container_id, status, public_port), json.loads(container))
+                               for node, container_id, status, public_port, container
+                               in db.execute("SELECT * FROM inspections"))
+        logger.info("Loaded {} instances and {} inspections from {}", len(instances), len(inspections), self.path)
+        return saved_at, instances, inspections
+
+
+class StateCheckpointer(threading.Thread):
+    """
+    Revalidates warm-started state with a full scan, then periodically checkpoints the latest scan results.
+    """
+    def __init__(self, connection, cache, interval):
+        super(StateCheckpointer, self).__init__(name='state-checkpointer')
+        self.daemon = True
+        self.connection = connection
+        self.cache = cache
+        self.interval = interval
+
+    def run(self):
+        self.revalidate()
+        while True:
+            time.sleep(self.interval)
+            self.checkpoint()
+
+    def revalidate(self):
+        try:
+            self.connection.scan_instances()
+        except Exception as e:
+            logger.error("Revalidating warm-started state generated an exception: {}", e)
+
+    def checkpoint(self):
+        instances, inspections = self.connection.get_scanned_state()
+        if not instances and not inspections:
+            logger.debug("Nothing scanned yet, skipping checkpoint")
+            return
+        try:
+            self.cache.save(instances, inspections)
+        except sqlite3.Error as e:
+            logger.error("Checkpointing to {} generated an exception: {}", self.cache.path, e)
@@ -0,0 +1,108 @@
+import time
+import threading
+from collections import Counter
+from captain.routes import routing_table
+
+
+class InventorySummary(object):
+    """
+    Instance and slot counts per app and per node, and instances per app and slug, kept up to date one node
+    scan at a time. Replacing a node's instances only recounts that node, and rendering the summary costs as
+    much as there are apps, nodes and slugs, however many instances there are.
+
+    The routing table is kept alongside, from the same scans, and only rebuilt after one of them has changed it.
+    """
+    def __init__(self):
+        self._nodes = {}
+        self._servers = {}
+        self._routes = None
+        self._updated_at = {}
+        self._unreachable = set()
+        self._totals = dict(apps=Counter(), app_slots=Counter(), nodes=Counter(), node_slots=Counter(),
+                            versions=Counter())
+        self._lock = threading.Lock()
+
+    @classmethod
+    def of(cls, instances):
+        summary = cls()
+        by_node = {}
+        for instance in instances:
+            by_node.setdefault(instance["node"], []).append(instance)
+        for node, node_instances in by_node.items():
+            summary.update_node(node, node_instances)
+        return summary
+
+    @staticmethod
+    def __count(node, instances):
+        counts = dict(apps=Counter(), app_slots=Counter(), nodes=Counter(), node_slots=Counter(), versions=Counter())
+        for instance in instances:
+            counts["apps"][instance["app"]] += 1
+            counts["app_slots"][instance["app"]] += instance["slots"]
+            counts["versions"][(instance["app"], instance["slug_uri"])] += 1
+        counts["nodes"][node] = len(instances)
+        counts["node_slots"][node] = sum(instance["slots"] for instance in instances)
+        return counts
+
+    def update_node(self, node, instances):
+        """
+        Replaces what is counted for node with its instances from a scan.
+        """
+        counts = self.__count(node, instances)
+        servers = sorted((instance["app"], instance["port"]) for instance in instances)
+        with self._lock:
+            if self._servers.get(node) != servers:
+                self._servers[node] = servers
+                self._routes = None
+            previous = self._nodes.get(node)
+            for name, total in self._totals.items():
+                if previous is not None:
+                    total.subtract(previous[name])
+                    for key in previous[name]:
+                        if total[key] <= 0:
+                            del total[key]
+                total.update(counts[name])
+            self._nodes[node] = counts
+            self._updated_at[node] = time.time()
+            self._unreachable.discard(node)
+
+    def node_unreachable(self, node):
+        """
+        Records that a scan of node failed. It counts no instances until it can be scanned again, but is as
+        fresh as if it had been scanned, so that a node being down does not make every summary rescan.
+        """
+        self.update_node(node, [])
+        with self._lock:
+            self._unreachable.add(node)
+
+    def fresh(self, nodes, max_age):
+        """
+        Whether every one of nodes has been counted within the last max_age seconds.
+        """
+        oldest = time.time() - max_age
+        return all(self._updated_at.get(node, 0) >= oldest for node in nodes)
+
+    def routes(self):
+        """
+        Where each app can be reached, as routes.routing_table() has it.
+        """
+        with self._lock:
+            table = self._routes
+            if table is None:
+                table = self._routes = routing_table(dict(app=app, node=node, port=port)
+                                                     for node, servers in self._servers.items()
+                                                     for app, port in servers)
+        return table
+
+    def render(self):
+        with self._lock:
+            totals = dict((name, dict(total)) for name, total in self._totals.items())
+            unreachable = sorted(self._unreachable)
+        versions = {}
+        for (app, slug_uri), count in totals["versions"].items():
+            versions.setdefault(app, {})[slug_uri] = count
+        return {"total_instances": sum(totals["apps"].values()),
+                "apps": totals["apps"],
+                "nodes": totals["nodes"],
+                "slots": {"apps": totals["app_slots"], "nodes": totals["node_slots"]},
+                "versions": versions,
+                "unreachable": unreachable}
@@ -0,0 +1,80 @@
+import time
+import unittest
+import threading
+from captain import admission
+from captain.admission import NodeAdmission, DEPLOY, READ
+
+
+class TestNodeAdmission(unittest.TestCase):
+
+    def test_limits_concurrent_calls(self):
+        # given
+        node_admission = NodeAdmission(2)
+        peak = [0]
+        lock = threading.Lock()
+
+        def call():
+            with node_admission.admit():
+                with lock:
+                    peak[0] = max(peak[0], node_admission.stats()["active"])
+                time.sleep(0.01)
+
+        # when
+        threads = [threading.Thread(target=call) for _ in xrange(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # then
+        self.assertEqual(2, peak[0])
+        self.assertEqual(dict(active=0, waiting=0, max_concurrent=2, rate=0), node_admission.stats())
+
+    def test_admits_deploys_ahead_of_waiting_reads(self):
+        # given
+        node_admission = NodeAdmission(1)
+        node_admission.acquire()
+        admitted = []
+
+        def call(name, priority):
+            with node_admission.admit(priority):
+                admitted.append(name)
+
+        threads = []
+        for name, priority in [("read-1", READ), ("read-2", READ), ("deploy", DEPLOY)]:
+            threads.append(threading.Thread(target=call, args=(name, priority)))
+            threads[-1].start()
+        while node_admission.stats()["waiting"] < 3:
+            time.sleep(0.001)
+
+        # when
+        node_admission.release()
+        for thread in threads:
+            thread.join()
+
+        # then
+        self.assertEqual(["deploy", "read-1", "read-2"], admitted)
+
+    def test_rate_limits_calls_after_a_burst(self):
+        # given
+        node_admission = NodeAdmission(0, rate=50, burst=5)
+
+        # when
+        start = time.time()
+        for _ in xrange(10):
+            with node_admission.admit():
+                pass
+        elapsed = time.time() - start
+
+        # then
+        self.assertGreater(elapsed, 0.08)
+        self.assertLess(elapsed, 1)
+
+    def test_fan_out_workers_inherit_the_priority(self):
+        # given
+        with admission.priority(DEPLOY):
+            bound = admission.bind(admission.current_priority)
+
+        # then
+        self.assertEqual(READ, admission.current_priority())
+        self.assertEqual(DEPLOY, bound())
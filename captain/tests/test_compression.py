@@ -0,0 +1,74 @@
+import zlib
+import unittest
+from captain.compression import GzipMiddleware, FLUSH_EACH_CHUNK, accepts_gzip
+
+
+def gunzip(data):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+class TestGzipMiddleware(unittest.TestCase):
+
+    def setUp(self):
+        self.body = ['{"line": %d, "padding": "%s"}\n' % (i, "x" * 100) for i in xrange(20)]
+        self.content_type = 'application/jsonstream'
+        self.flush = False
+
+        def app(environ, start_response):
+            if self.flush:
+                environ[FLUSH_EACH_CHUNK] = True
+            start_response('200 OK', [('Content-Type', self.content_type)])
+            return iter(self.body)
+        self.app = app
+
+    def call(self, accept_encoding, level=6):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response.update(status=status, headers=dict(headers))
+        environ = {'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': accept_encoding}
+        return list(GzipMiddleware(self.app, level)(environ, start_response)), response["headers"]
+
+    def test_gzips_responses_for_clients_that_accept_it(self):
+        # when
+        chunks, headers = self.call('gzip, deflate')
+
+        # then
+        self.assertEqual('gzip', headers['Content-Encoding'])
+        self.assertEqual("".join(self.body), gunzip("".join(chunks)))
+        self.assertLess(len("".join(chunks)), len("".join(self.body)) / 4)
+
+    def test_reads_q_values_of_accepted_encodings(self):
+        self.assertTrue(accepts_gzip('deflate, gzip;q=0.5'))
+        self.assertTrue(accepts_gzip('*'))
+        self.assertFalse(accepts_gzip('gzip;q=0, *'))
+        self.assertFalse(accepts_gzip('identity, *;q=0'))
+        self.assertFalse(accepts_gzip('x-gzipped'))
+        self.assertFalse(accepts_gzip(''))
+
+    def test_leaves_other_responses_alone(self):
+        # when
+        plain, plain_headers = self.call('identity')
+        refused, refused_headers = self.call('gzip;q=0')
+        disabled, _ = self.call('gzip', level=0)
+        self.content_type = 'application/gzip'
+        archive, archive_headers = self.call('gzip')
+
+        # then
+        self.assertNotIn('Content-Encoding', plain_headers)
+        self.assertNotIn('Content-Encoding', refused_headers)
+        self.assertNotIn('Content-Encoding', archive_headers)
+        self.assertEqual(self.body, plain)
+        self.assertEqual(self.body, disabled)
+        self.assertEqual(self.body, archive)
+
+    def test_flushes_each_chunk_of_a_followed_stream(self):
+        # given
+        self.flush = True
+
+        # when
+        chunks, _ = self.call('gzip')
+
+        # then
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.assertEqual(self.body, [decompressor.decompress(chunk) for chunk in chunks[:len(self.body)]])
@@ -67,6 +67,48 @@ class TestConfig(unittest.TestCase):
         self.assertEqual(config.slot_memory_mb, int(self.SLOT_MEMORY_MB))
         self.assertEqual(config.default_slots_per_instance, int(self.DEFAULT_SLOTS_PER_INSTANCE))
 
+        self.assertEqual(config.docker_pool_size, 10)
+        self.assertFalse(config.docker_pool_block)
+        self.assertEqual(config.docker_backend, "threads")
+        self.assertEqual(config.docker_concurrency, 8)
+        self.assertEqual(config.docker_stop_timeout, 10)
+        self.assertEqual(config.log_follow_buffer, 1000)
+        self.assertEqual(config.log_follow_backlog, 100)
+        self.assertEqual(config.gzip_level, 6)
+        self.assertEqual(config.docker_node_concurrency, 10)
+        self.assertEqual(config.docker_node_rate, 0)
+        self.assertEqual(config.docker_node_burst, 20)
+        self.assertEqual(config.docker_read_retries, 1)
+        self.assertEqual(config.docker_retry_backoff_ms, 100)
+        self.assertFalse(config.docker_hedge_reads)
+        self.assertEqual(config.slow_request_ms, 5000)
+        self.assertEqual(config.log_sample_rate, 1.0)
+        self.assertEqual(config.debug_token, None)
+
+        self.assertEqual(config.shared_inventory_path, None)
+        self.assertEqual(config.shared_inventory_interval, 10)
+        self.assertEqual(config.shared_inventory_max_age, 60)
+
+        self.assertEqual(config.summary_max_age, 5)
+
+        self.assertEqual(config.jobs_path, None)
+        self.assertEqual(config.job_retention, 1000)
+        self.assertEqual(config.readiness_timeout, 300)
+        self.assertEqual(config.readiness_interval, 1)
+        self.assertEqual(config.readiness_path, None)
+        self.assertEqual(config.health_interval, 15)
+        self.assertEqual(config.health_concurrency, 20)
+        self.assertEqual(config.health_timeout, 2)
+        self.assertEqual(config.health_path, None)
+        self.assertEqual(config.desired_state_path, None)
+        self.assertEqual(config.reconcile_interval, 30)
+        self.assertEqual(config.reconcile_max_starts, 10)
+        self.assertEqual(config.reconcile_max_stops, 10)
+
+        self.assertEqual(config.state_cache_path, None)
+        self.assertEqual(config.state_cache_interval, 60)
+        self.assertEqual(config.state_cache_max_age, 3600)
+
     @mock.patch("os.getenv")
     @raises(Exception)
     def test_fails_when_no_slug_runner_command_specified(self, mock_getenv):
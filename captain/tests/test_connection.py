@@ -1,10 +1,18 @@
+import time
+import threading
 import unittest
 from mock import patch, MagicMock, call
 from captain.connection import Connection
 from captain import exceptions
 from captain.tests.util_mock import ClientMock
+from captain.tests.util_cluster import SyntheticCluster
+from captain.tests.util_fake_docker import FakeDockerCluster
 from requests.exceptions import ConnectionError
 import itertools
+import tempfile
+import os
+from captain.shared_inventory import SharedInventory
+from captain.state_cache import StateCache
 
 
 class TestConnection(unittest.TestCase):
@@ -15,9 +23,37 @@ class TestConnection(unittest.TestCase):
         self.config.slug_runner_command = "runner command"
         self.config.slug_runner_image = "runner/image"
         self.config.docker_gc_grace_period = 86400
+        self.config.docker_timeout = 15
         self.config.slots_per_node = 10
         self.config.slot_memory_mb = 128
         self.config.default_slots_per_instance = 2
+        self.config.shared_inventory_path = None
+        self.config.shared_inventory_max_age = 60
+        self.config.state_cache_path = None
+        self.config.state_cache_max_age = 3600
+        self.config.docker_pool_size = 10
+        self.config.docker_pool_block = False
+        self.config.docker_backend = "threads"
+        self.config.docker_concurrency = 8
+        self.config.docker_node_concurrency = 10
+        self.config.docker_node_rate = 0
+        self.config.docker_node_burst = 20
+        self.config.docker_read_retries = 0
+        self.config.docker_retry_backoff_ms = 100
+        self.config.docker_hedge_reads = False
+        self.config.jobs_path = None
+        self.config.job_retention = 1000
+        self.config.docker_stop_timeout = 10
+        self.config.log_follow_buffer = 1000
+        self.config.log_follow_backlog = 100
+        self.config.summary_max_age = 5
+        self.config.readiness_timeout = 5
+        self.config.readiness_interval = 0.01
+        self.config.readiness_path = None
+        self.config.desired_state_path = None
+        self.config.reconcile_max_starts = 10
+        self.config.reconcile_max_stops = 10
+        self.config.log_sample_rate = 1.0
 
     @patch('docker.Client')
     def test_returns_summary_of_instances(self, docker_client):
@@ -168,7 +204,7 @@ class TestConnection(unittest.TestCase):
         self.assertFalse(mock_client_node1.stop.called)
         mock_client_node1.remove_container.assert_not_called_with("80be2a9e62ba00")
 
-        mock_client_node2.stop.assert_called_with('80be2a9e62ba00')
+        mock_client_node2.stop.assert_called_with('80be2a9e62ba00', timeout=10)
         mock_client_node2.remove_container.assert_called_with('80be2a9e62ba00', force=True)
 
     @patch('docker.Client')
@@ -186,7 +222,7 @@ class TestConnection(unittest.TestCase):
         self.assertFalse(mock_client_node1.stop.called)
         mock_client_node1.remove_container.assert_not_called_with('80be2a9e62ba00')
 
-        mock_client_node2.stop.assert_called_with('80be2a9e62ba00')
+        mock_client_node2.stop.assert_called_with('80be2a9e62ba00', timeout=10)
         mock_client_node2.remove_container.assert_called_with('80be2a9e62ba00', force=True)
 
     @patch('docker.Client')
@@ -234,7 +270,7 @@ class TestConnection(unittest.TestCase):
         node_details = connection.get_node("node-1")
         self.assertDictEqual(
             {"id": "node-1",
-             "slots": {"free": 6, "used": 4, "total": 10}, "state": "healthy"},
+             "slots": {"free": 6, "used": 4, "total": 10}, "state": "healthy", "schedulable": True},
             node_details
         )
 
@@ -252,7 +288,7 @@ class TestConnection(unittest.TestCase):
 
         instance_logs = connection.get_logs("eba8bea2600029", follow=True)
         self.assertEqual(
-            ({"msg": "this is line 1"}, {"msg": "this is line 2"}, {"msg": "this is line 3"}),
+            ({"msg": "this is line 1\n"}, {"msg": "this is line 2\n"}, {"msg": "this is line 3\n"}),
             tuple(itertools.islice(instance_logs, 3)))
 
     @patch('docker.Client')
@@ -264,7 +300,7 @@ class TestConnection(unittest.TestCase):
         self.assertTrue(len(nodes) == 3)
         self.assertIn(
             {"id": "node-1",
-             "slots": {"free": 6, "used": 4, "total": 10}, "state": "healthy"},
+             "slots": {"free": 6, "used": 4, "total": 10}, "state": "healthy", "schedulable": True},
             nodes
         )
 
@@ -284,3 +320,399 @@ class TestConnection(unittest.TestCase):
 
         # 61c2695fd82b is an old container with epoch start and exit times and should be gc'd
         docker_conn2.remove_container.assert_has_calls([call("61c2695fd82b")])
+
+    @patch('docker.Client')
+    def test_serves_instances_from_shared_inventory(self, docker_client):
+        # given
+        (docker_conn1, docker_conn2, docker_conn3) = ClientMock().mock_two_docker_nodes(docker_client)
+        self.config.shared_inventory_path = os.path.join(tempfile.mkdtemp(), "inventory")
+        SharedInventory(self.config.shared_inventory_path).write([
+            {"id": "656ca7c307d178", "app": "ers-checking-frontend-27", "node": "node-1", "slots": 2},
+            {"id": "80be2a9e62ba00", "app": "paye", "node": "node-2", "slots": 2}],
+            health={"80be2a9e62ba00": dict(healthy=False, checked_at=100, since=100)})
+
+        # when
+        connection = Connection(self.config)
+        instances = connection.get_instances()
+        node_2_instances = connection.get_instances(node_filter="node-2")
+
+        # then
+        self.assertEqual(["656ca7c307d178", "80be2a9e62ba00"], sorted(i["id"] for i in instances))
+        self.assertEqual(["80be2a9e62ba00"], [i["id"] for i in node_2_instances])
+        self.assertFalse(connection.current_health().get("80be2a9e62ba00")["healthy"])
+        self.assertEqual(None, connection.health.get("80be2a9e62ba00"))
+        self.assertFalse(docker_conn1.containers.called)
+        self.assertFalse(docker_conn2.containers.called)
+
+    @patch('docker.Client')
+    def test_scans_docker_when_shared_inventory_is_missing(self, docker_client):
+        # given
+        (docker_conn1, docker_conn2, docker_conn3) = ClientMock().mock_two_docker_nodes(docker_client)
+        self.config.shared_inventory_path = os.path.join(tempfile.mkdtemp(), "inventory")
+
+        # when
+        connection = Connection(self.config)
+        instances = connection.get_instances()
+
+        # then
+        self.assertEqual(3, len(instances))
+        self.assertTrue(docker_conn1.containers.called)
+
+    @patch('docker.Client')
+    def test_warm_starts_from_checkpoint_until_rescanned(self, docker_client):
+        # given
+        (docker_conn1, docker_conn2, docker_conn3) = ClientMock().mock_two_docker_nodes(docker_client)
+        self.config.state_cache_path = os.path.join(tempfile.mkdtemp(), "state.db")
+        scanning_connection = Connection(self.config)
+        scanning_connection.get_instances()
+        instances, inspections = scanning_connection.get_scanned_state()
+        StateCache(self.config.state_cache_path).save(instances, inspections)
+        docker_conn1.reset_mock()
+        docker_conn1.inspect_container.reset_mock()
+
+        # when
+        connection = Connection(self.config)
+
+        # then
+        self.assertTrue(connection.serving_stale_state)
+        self.assertEqual(3, len(connection.get_instances()))
+        self.assertFalse(docker_conn1.containers.called)
+
+        # when
+        connection._get_lru_instance_details.cache_clear()
+        rescanned = connection.scan_instances()
+
+        # then
+        self.assertFalse(connection.serving_stale_state)
+        self.assertEqual(3, len(rescanned))
+        self.assertTrue(docker_conn1.containers.called)
+        # running containers were served from the checkpointed inspections
+        inspected = [c[0][0] for c in docker_conn1.inspect_container.call_args_list]
+        self.assertNotIn("656ca7c307d178", inspected)
+        self.assertNotIn("eba8bea2600029", inspected)
+
+    @patch('docker.Client')
+    def test_creates_docker_clients_on_first_use(self, docker_client):
+        # given
+        ClientMock().mock_two_docker_nodes(docker_client)
+
+        # when
+        connection = Connection(self.config)
+
+        # then
+        self.assertFalse(docker_client.called)
+        self.assertIn("node-1", connection.node_connections)
+        self.assertFalse(docker_client.called)
+
+        # when
+        connection.get_node("node-1")
+
+        # then
+        self.assertEqual(["http://node-1"], [c[1]["base_url"] for c in docker_client.call_args_list])
+
+    @patch('os.getpid')
+    @patch('docker.Client')
+    def test_recreates_docker_clients_after_fork(self, docker_client, getpid):
+        # given
+        ClientMock().mock_two_docker_nodes(docker_client)
+        getpid.return_value = 100
+        connection = Connection(self.config)
+        connection.node_connections["node-1"]
+
+        # when
+        getpid.return_value = 101
+        connection.node_connections["node-1"]
+        connection.node_connections["node-1"]
+
+        # then
+        self.assertEqual(2, docker_client.call_count)
+
+    @patch('docker.Client')
+    def test_mounts_pooled_adapter_per_node(self, docker_client):
+        # given
+        (docker_conn1, docker_conn2, docker_conn3) = ClientMock().mock_two_docker_nodes(docker_client)
+        self.config.docker_pool_size = 32
+
+        # when
+        connection = Connection(self.config)
+        connection.get_node("node-1")
+
+        # then
+        adapter = docker_conn1.mount.call_args[0][1]
+        self.assertEqual(32, adapter.pool_size)
+        self.assertEqual(["node-1"], connection.get_pool_stats().keys())
+
+    @patch('docker.Client')
+    def test_measures_docker_calls_per_node_and_operation(self, docker_client):
+        # given
+        (docker_conn1, docker_conn2, docker_conn3) = ClientMock().mock_two_docker_nodes(docker_client)
+        docker_conn3.containers.side_effect = ConnectionError()
+
+        # when
+        connection = Connection(self.config)
+        connection.get_instances()
+
+        # then
+        calls = connection.docker_call_seconds.values()
+        self.assertEqual(1, calls[("node-1", "containers")][0])
+        self.assertEqual(1, calls[("node-3", "containers")][0])
+        self.assertIn(("node-1", "inspect_container"), calls)
+        self.assertEqual({("node-3", "containers", "ConnectionError"): 1}, connection.docker_call_errors.values())
+        self.assertEqual({("scan",): 1}, connection.instances_served.values())
+        self.assertIn('captain_fan_out_calls{state="queued"} 0', connection.metrics.render())
+
+    @patch('docker.Client')
+    def test_admits_deploy_calls_at_deploy_priority(self, docker_client):
+        # given
+        (docker_conn1, docker_conn2, docker_conn3) = ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config)
+        connection.get_instances()
+
+        # when
+        connection.start_instance("paye", "https://host/paye_216.tgz", "node-1", None, {"A": "b"})
+
+        # then
+        waits = connection.docker_admission_seconds.values()
+        self.assertIn(("node-2", "read"), waits)
+        self.assertNotIn(("node-2", "deploy"), waits)
+        self.assertIn(("node-1", "deploy"), waits)
+        self.assertEqual({"active": 0, "waiting": 0, "max_concurrent": 10, "rate": 0},
+                         connection.node_connections["node-1"].admission.stats())
+
+    @patch('docker.Client')
+    def test_returns_all_instances_with_gevent_backend(self, docker_client):
+        # given
+        (docker_conn1, docker_conn2, docker_conn3) = ClientMock().mock_two_docker_nodes(docker_client)
+        self.config.docker_backend = "gevent"
+
+        # when
+        connection = Connection(self.config)
+        instances = connection.get_instances()
+        nodes = connection.get_nodes()
+
+        # then
+        self.assertEqual(["656ca7c307d178", "80be2a9e62ba00", "eba8bea2600029"], sorted(i["id"] for i in instances))
+        self.assertEqual(3, len(nodes))
+
+    def test_scans_a_large_cluster_inspecting_each_container_once(self):
+        # given
+        cluster = SyntheticCluster(nodes=20, containers_per_node=50, exited_ratio=0.1)
+        self.config.docker_nodes = cluster.docker_nodes()
+
+        with patch('docker.Client', side_effect=cluster.client):
+            connection = Connection(self.config)
+            connection._get_lru_instance_details.cache_clear()
+
+            # when
+            cold = connection.get_instances()
+            cold_calls = cluster.calls()
+            cluster.reset_calls()
+            warm = connection.get_instances()
+
+        # then
+        running = sum(len(node.containers_by_id) for node in cluster.nodes.values())
+        self.assertEqual(running, len(cold))
+        self.assertEqual(running, len(warm))
+        self.assertEqual(1000, cold_calls["inspect_container"])
+        self.assertEqual(1000 - running, cold_calls["remove_container"])
+        self.assertEqual({"containers": 20}, cluster.calls())
+
+    def test_stops_instances_of_an_app_from_one_listing(self):
+        # given
+        cluster = SyntheticCluster(nodes=3, containers_per_node=4, exited_ratio=0, apps=2)
+        self.config.docker_nodes = cluster.docker_nodes()
+
+        with patch('docker.Client', side_effect=cluster.client):
+            connection = Connection(self.config)
+            app0 = [i for i in connection.get_instances() if i["app"] == "app0"]
+            cluster.reset_calls()
+
+            # when
+            outcomes = connection.stop_instances(app="app0", ids=[i["id"] for i in app0[1:]] + ["unknown"], timeout=3)
+            calls = cluster.calls()
+            remaining = connection.get_instances()
+
+        # then
+        self.assertEqual(sorted([(i["id"], True) for i in app0[1:]] + [("unknown", False)]),
+                         sorted((o["id"], o["stopped"]) for o in outcomes))
+        self.assertEqual(dict(containers=3, stop=len(app0) - 1, remove_container=len(app0) - 1), calls)
+        self.assertEqual([app0[0]["id"]], [i["id"] for i in remaining if i["app"] == "app0"])
+
+    def test_does_not_stop_the_instance_it_runs_in(self):
+        # given
+        cluster = SyntheticCluster(nodes=2, containers_per_node=2, exited_ratio=0)
+        self.config.docker_nodes = cluster.docker_nodes()
+
+        with patch('docker.Client', side_effect=cluster.client):
+            connection = Connection(self.config)
+            instances = connection.get_instances()
+            itself = instances[0]
+
+            # when
+            with patch('socket.gethostname', return_value=itself["id"][:12]):
+                outcomes = connection.stop_instances(node=itself["node"])
+            remaining = connection.get_instances()
+
+        # then
+        self.assertEqual(sorted((i["id"], i["id"] != itself["id"]) for i in instances if i["node"] == itself["node"]),
+                         sorted((o["id"], o["stopped"]) for o in outcomes))
+        self.assertEqual([itself["id"]], [i["id"] for i in remaining if i["node"] == itself["node"]])
+
+    def test_acts_on_instances_started_since_the_shared_inventory_snapshot(self):
+        # given
+        cluster = SyntheticCluster(nodes=2, containers_per_node=2, exited_ratio=0)
+        self.config.docker_nodes = cluster.docker_nodes()
+        self.config.shared_inventory_path = os.path.join(tempfile.mkdtemp(), "inventory")
+
+        with patch('docker.Client', side_effect=cluster.client):
+            connection = Connection(self.config)
+            SharedInventory(self.config.shared_inventory_path).write(connection.scan_instances())
+            started = connection.start_instance("paye", "http://host/paye.tgz", "node-1", slots=1)
+            known = connection.get_instances()[0]
+            cluster.reset_calls()
+
+            # when
+            logs = list(connection.get_logs(started["id"]))
+            stopped = connection.stop_instance(started["id"])
+            stopped_known = connection.stop_instance(known["id"])
+            calls = cluster.calls()
+
+        # then
+        self.assertEqual({"msg": "{} log line 0\n".format(started["id"][:12])}, logs[0])
+        self.assertTrue(stopped)
+        self.assertTrue(stopped_known)
+        self.assertNotIn(started["id"], cluster.nodes["node-1"].containers_by_id)
+        # instances the snapshot knows of are looked up on their node only
+        self.assertEqual(2 + 2 + 1, calls["containers"])
+
+    def test_acts_on_live_instances_while_serving_a_checkpoint(self):
+        # given
+        cluster = SyntheticCluster(nodes=2, containers_per_node=2, exited_ratio=0)
+        self.config.docker_nodes = cluster.docker_nodes()
+        self.config.state_cache_path = os.path.join(tempfile.mkdtemp(), "state.db")
+
+        with patch('docker.Client', side_effect=cluster.client):
+            scanning_connection = Connection(self.config)
+            removed = scanning_connection.scan_instances()[0]
+            StateCache(self.config.state_cache_path).save(*scanning_connection.get_scanned_state())
+            scanning_connection.remove_instance(removed)
+            started = scanning_connection.start_instance("paye", "http://host/paye.tgz", "node-1", slots=1)
+
+            # when
+            connection = Connection(self.config)
+            listed = [i["id"] for i in connection.get_instances()]
+            stopped_removed = connection.stop_instance(removed["id"])
+            stopped_started = connection.stop_instance(started["id"])
+
+        # then
+        self.assertIn(removed["id"], listed)
+        self.assertNotIn(started["id"], listed)
+        self.assertFalse(stopped_removed)
+        self.assertTrue(stopped_started)
+        self.assertNotIn(started["id"], cluster.nodes["node-1"].containers_by_id)
+
+    def test_knows_instances_from_earlier_scans_without_calling_docker(self):
+        # given
+        cluster = SyntheticCluster(nodes=2, containers_per_node=2, exited_ratio=0)
+        self.config.docker_nodes = cluster.docker_nodes()
+
+        with patch('docker.Client', side_effect=cluster.client):
+            connection = Connection(self.config)
+
+            # when
+            before = connection.known_instances()
+            scanned = connection.scan_instances()
+            cluster.reset_calls()
+            after = connection.known_instances()
+
+        # then
+        self.assertEqual([], before)
+        self.assertEqual(sorted(i["id"] for i in scanned), sorted(i["id"] for i in after))
+        self.assertEqual({}, cluster.calls())
+
+    def test_starts_an_instance_once_per_request_key(self):
+        # given
+        cluster = SyntheticCluster(nodes=2, containers_per_node=2, exited_ratio=0)
+        self.config.docker_nodes = cluster.docker_nodes()
+        self.config.slots_per_node = 20
+
+        with patch('docker.Client', side_effect=cluster.client):
+            connection = Connection(self.config)
+
+            def start():
+                return connection.start_instance("paye", "http://host/paye.tgz", "node-0", environment={"A": "1"},
+                                                 slots=2, request_key="retry-me")
+
+            # when
+            threads = [threading.Thread(target=start) for _ in xrange(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            retried = start()
+
+        # then
+        self.assertEqual(1, cluster.calls()["create_container"])
+        self.assertEqual("retry-me", retried["request_key"])
+        self.assertEqual({"A": "1"}, retried["environment"])
+        self.assertEqual([retried["id"]], [i["id"] for i in connection.scan_instances() if i["app"] == "paye"])
+
+    def test_starts_the_container_a_cut_short_start_created(self):
+        # given
+        cluster = SyntheticCluster(nodes=2, containers_per_node=2, exited_ratio=0)
+        self.config.docker_nodes = cluster.docker_nodes()
+        self.config.slots_per_node = 20
+        created = cluster.nodes["node-0"].create_container("slug-runner", environment={
+            "A": "1", "SLUG_URL": "http://host/paye.tgz", "CAPTAIN_REQUEST_KEY": "retry-me"}, name="paye_1", cpu_shares=2)
+        cluster.reset_calls()
+
+        with patch('docker.Client', side_effect=cluster.client):
+            connection = Connection(self.config)
+
+            # when
+            retried = connection.start_instance("paye", "http://host/paye.tgz", "node-0", environment={"A": "1"},
+                                                slots=2, request_key="retry-me")
+
+        # then
+        self.assertEqual(created["Id"], retried["id"])
+        self.assertNotIn("create_container", cluster.calls())
+        self.assertEqual(1, cluster.calls()["start"])
+
+    def test_hangs_up_on_quiet_log_streams_nobody_follows(self):
+        # given
+        cluster = FakeDockerCluster(nodes=1, containers_per_node=1, exited_ratio=0, follow_interval=30).start()
+        self.addCleanup(cluster.stop)
+        self.config.docker_nodes = cluster.docker_nodes()
+        connection = Connection(self.config)
+        instance = connection.get_instances()[0]
+        followed = connection.get_logs(instance["id"], follow=True)
+        next(followed)
+
+        # when
+        followed.close()
+
+        # then
+        deadline = time.time() + 5
+        while [t for t in threading.enumerate() if t.name.startswith("logs-")] and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual([], [t.name for t in threading.enumerate() if t.name.startswith("logs-")])
+
+    def test_talks_to_docker_over_http(self):
+        # given
+        cluster = FakeDockerCluster(nodes=2, containers_per_node=3, exited_ratio=0, follow_interval=0.001).start()
+        self.addCleanup(cluster.stop)
+        self.config.docker_nodes = cluster.docker_nodes()
+        connection = Connection(self.config)
+
+        # when
+        started = connection.start_instance("paye", "http://host/paye_216.tgz", "127.0.0.2", environment={"A": "b"}, slots=1)
+        logs = list(connection.get_logs(started["id"]))
+        followed = list(itertools.islice(connection.get_logs(started["id"], follow=True), 3))
+        stopped = connection.stop_instance(started["id"])
+
+        # then
+        self.assertEqual({"A": "b"}, started["environment"])
+        self.assertEqual({"msg": "{} log line 0\n".format(started["id"][:12])}, logs[0])
+        self.assertEqual([{"msg": "{} log line {}\n".format(started["id"][:12], i)} for i in xrange(3)], followed)
+        self.assertTrue(stopped)
+        self.assertEqual(6, len(connection.get_instances()))
@@ -0,0 +1,191 @@
+import os
+import unittest
+from mock import patch, MagicMock
+from captain import deploy
+from captain import exceptions
+from captain.connection import Connection
+from captain.jobs import Job, MemoryJobStore
+from captain.config import Config
+from captain.tests.util_cluster import SyntheticCluster
+
+os.environ["SLUG_RUNNER_COMMAND"] = ''
+os.environ["SLUG_RUNNER_IMAGE"] = ''
+
+
+class TestDeploy(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = MagicMock()
+        self.connection.config.readiness_timeout = 5
+        self.instance = {"id": "abc", "node": "node-1", "port": 49153}
+
+        def start_instance(progress=None, **instance_request):
+            progress("created", container_id="abc")
+            progress("started", container_id="abc")
+            return self.instance
+        self.connection.start_instance.side_effect = start_instance
+        self.job = Job("start_instance", MemoryJobStore(10))
+
+    @patch('captain.readiness.instance_ready')
+    def test_start_instance_job_waits_for_readiness(self, instance_ready):
+        # given
+        instance_ready.return_value = True
+
+        # when
+        result = deploy.start_instance_job(self.connection, {"app": "paye"})(self.job)
+
+        # then
+        self.assertEqual(self.instance, result)
+        self.assertEqual(["created", "started", "waiting_for_readiness", "ready"], [s["name"] for s in self.job.steps])
+        self.connection.start_instance.assert_called_once_with(progress=self.job.step, app="paye")
+
+    @patch('captain.readiness.instance_ready')
+    def test_start_instance_job_fails_when_never_ready(self, instance_ready):
+        # given
+        instance_ready.return_value = False
+
+        # then
+        self.assertRaises(deploy.InstanceNotReadyException,
+                          deploy.start_instance_job(self.connection, {"app": "paye"}), self.job)
+        self.assertEqual(self.instance, self.job.result)
+
+
+class TestRollout(unittest.TestCase):
+
+    def setUp(self):
+        self.cluster = SyntheticCluster(nodes=3, containers_per_node=4, exited_ratio=0, apps=2)
+        config = Config()
+        config.docker_nodes = self.cluster.docker_nodes()
+        config.slots_per_node = 20
+        patcher = patch('docker.Client', side_effect=self.cluster.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.connection = Connection(config)
+        self.job = Job("rollout", MemoryJobStore(10))
+
+    def app_instances(self, app):
+        return [i for i in self.connection.scan_instances() if i["app"] == app]
+
+    @patch('captain.readiness.instance_ready')
+    def test_replaces_every_instance_in_batches_from_one_scan(self, instance_ready):
+        # given
+        instance_ready.return_value = True
+        old = self.app_instances("app0")
+        self.cluster.reset_calls()
+
+        # when
+        result = deploy.rollout_job(self.connection, "app0", "http://slugs/app0-2.tgz", batch_size=2)(self.job)
+
+        # then
+        self.assertEqual({"containers": 3, "create_container": len(old), "start": len(old),
+                          "inspect_container": len(old), "stop": len(old), "remove_container": len(old)},
+                         self.cluster.calls())
+        self.assertEqual(sorted(i["id"] for i in old), sorted(result["stopped"]))
+        new = self.app_instances("app0")
+        self.assertEqual(len(old), len(new))
+        self.assertEqual(set(["http://slugs/app0-2.tgz"]), set(i["slug_uri"] for i in new))
+        self.assertEqual(sorted(i["node"] for i in old), sorted(i["node"] for i in new))
+        self.assertEqual(dict(total=len(old), replaced=len(old), batches=(len(old) + 1) // 2, batch=(len(old) + 1) // 2),
+                         self.job.progress)
+
+    @patch('captain.readiness.instance_ready')
+    def test_rolls_back_a_batch_that_never_gets_ready(self, instance_ready):
+        # given
+        instance_ready.return_value = False
+        old = self.app_instances("app0")
+
+        # then
+        self.assertRaises(deploy.BatchFailedException,
+                          deploy.rollout_job(self.connection, "app0", "http://slugs/app0-2.tgz"), self.job)
+        self.assertEqual(sorted(i["id"] for i in old), sorted(i["id"] for i in self.app_instances("app0")))
+
+    @patch('captain.readiness.instance_ready')
+    def test_moves_replacements_off_a_cordoned_node(self, instance_ready):
+        # given
+        instance_ready.return_value = True
+        old = self.app_instances("app0")
+        self.connection.desired_state.set_schedulable("node-0", False)
+
+        # when
+        result = deploy.rollout_job(self.connection, "app0", "http://slugs/app0-2.tgz")(self.job)
+
+        # then
+        self.assertIn("node-0", set(i["node"] for i in old))
+        self.assertEqual(sorted(i["id"] for i in old), sorted(result["stopped"]))
+        new = self.app_instances("app0")
+        self.assertEqual(len(old), len(new))
+        self.assertNotIn("node-0", set(i["node"] for i in new))
+
+    def test_places_replacements_on_the_emptiest_node_when_theirs_is_full(self):
+        # given
+        free = {"node-0": 1, "node-1": 4, "node-2": 6}
+
+        # when
+        nodes = [deploy.place(free, 2, preferred="node-0") for _ in xrange(3)]
+
+        # then
+        self.assertEqual(["node-2", "node-2", "node-1"], nodes)
+        self.assertRaises(exceptions.NodeOutOfCapacityException, deploy.place, free, 3, "node-0")
+
+
+class TestDrain(unittest.TestCase):
+
+    def setUp(self):
+        self.cluster = SyntheticCluster(nodes=3, containers_per_node=4, exited_ratio=0, apps=2)
+        config = Config()
+        config.docker_nodes = self.cluster.docker_nodes()
+        config.slots_per_node = 20
+        patcher = patch('docker.Client', side_effect=self.cluster.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.connection = Connection(config)
+        self.job = Job("drain", MemoryJobStore(10))
+
+    def node_instances(self, node):
+        return self.connection.scan_instances(node_filter=node)
+
+    @patch('captain.readiness.instance_ready')
+    def test_moves_every_instance_to_the_other_nodes(self, instance_ready):
+        # given
+        instance_ready.return_value = True
+        old = self.node_instances("node-0")
+        self.connection.desired_state.set_schedulable("node-0", False)
+
+        # when
+        result = deploy.drain_job(self.connection, "node-0")(self.job)
+
+        # then
+        self.assertEqual([], self.node_instances("node-0"))
+        self.assertEqual(sorted(i["id"] for i in old), sorted(move["original"] for move in result["moved"]))
+        self.assertEqual(sorted((i["app"], i["slug_uri"]) for i in old),
+                         sorted((m["replacement"]["app"], m["replacement"]["slug_uri"]) for m in result["moved"]))
+        self.assertNotIn("node-0", set(m["replacement"]["node"] for m in result["moved"]))
+        self.assertEqual(dict(total=len(old), moved=len(old), failed=0), self.job.progress)
+        self.assertRaises(exceptions.NodeUnschedulableException, self.connection.start_instance,
+                          "app0", "http://slugs/app0-1.tgz", "node-0")
+
+    @patch('captain.readiness.instance_ready')
+    def test_starts_nothing_when_the_other_nodes_are_too_full(self, instance_ready):
+        # given
+        instance_ready.return_value = True
+        self.connection.config.slots_per_node = 10
+        old = self.node_instances("node-0")
+        self.connection.desired_state.set_schedulable("node-0", False)
+        self.cluster.reset_calls()
+
+        # then
+        self.assertRaises(exceptions.NodeOutOfCapacityException, deploy.drain_job(self.connection, "node-0"), self.job)
+        self.assertNotIn("create_container", self.cluster.calls())
+        self.assertEqual(sorted(i["id"] for i in old), sorted(i["id"] for i in self.node_instances("node-0")))
+
+    @patch('captain.readiness.instance_ready')
+    def test_keeps_originals_whose_replacement_never_gets_ready(self, instance_ready):
+        # given
+        instance_ready.return_value = False
+        old = self.node_instances("node-0")
+        self.connection.desired_state.set_schedulable("node-0", False)
+
+        # then
+        self.assertRaises(deploy.BatchFailedException, deploy.drain_job(self.connection, "node-0"), self.job)
+        self.assertEqual(sorted(i["id"] for i in old), sorted(i["id"] for i in self.node_instances("node-0")))
+        self.assertEqual(dict(total=len(old), moved=0, failed=len(old)), self.job.progress)
@@ -0,0 +1,72 @@
+import unittest
+import time
+import gevent
+from captain.fanout import ThreadFanOut, GeventFanOut, get_fan_out
+
+
+def double_or_fail(item):
+    if item == "fail":
+        raise ValueError("failed")
+    return item * 2
+
+
+class TestFanOut(unittest.TestCase):
+
+    def test_thread_fan_out_returns_results_and_exceptions(self):
+        # when
+        results = dict((item, (result, exception)) for item, result, exception
+                       in ThreadFanOut(4).map(double_or_fail, [1, 2, "fail"]))
+
+        # then
+        self.assertEqual((2, None), results[1])
+        self.assertEqual((4, None), results[2])
+        self.assertIsNone(results["fail"][0])
+        self.assertIsInstance(results["fail"][1], ValueError)
+
+    def test_gevent_fan_out_returns_results_and_exceptions(self):
+        # when
+        results = dict((item, (result, exception)) for item, result, exception
+                       in GeventFanOut(4).map(double_or_fail, [1, 2, "fail"]))
+
+        # then
+        self.assertEqual((2, None), results[1])
+        self.assertEqual((4, None), results[2])
+        self.assertIsNone(results["fail"][0])
+        self.assertIsInstance(results["fail"][1], ValueError)
+
+    def test_gevent_fan_out_runs_hundreds_of_calls_concurrently(self):
+        # given
+        def slow_call(item):
+            gevent.sleep(0.1)
+            return item
+
+        # when
+        start = time.time()
+        results = [result for item, result, exception in GeventFanOut(500).map(slow_call, range(500))]
+
+        # then
+        self.assertEqual(range(500), sorted(results))
+        self.assertLess(time.time() - start, 1)
+
+    def test_counts_queued_and_active_calls(self):
+        # given
+        fan_out = ThreadFanOut(1)
+        depths = []
+
+        def record_depth(item):
+            # the second call is only submitted once the first has started
+            deadline = time.time() + 5
+            while item == 1 and fan_out.depth()["queued"] == 0 and time.time() < deadline:
+                time.sleep(0.001)
+            depths.append(fan_out.depth())
+            return item
+
+        # when
+        list(fan_out.map(record_depth, [1, 2]))
+
+        # then
+        self.assertEqual([dict(queued=1, active=1), dict(queued=0, active=1)], depths)
+        self.assertEqual(dict(queued=0, active=0), fan_out.depth())
+
+    def test_unknown_backend(self):
+        self.assertRaises(ValueError, get_fan_out, "asyncio", 8)
@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch, MagicMock
+from captain.health import HealthCache, HealthProber
+from captain.shared_inventory import SharedInventory
+
+
+class TestHealth(unittest.TestCase):
+
+    def setUp(self):
+        self.instances = [{"id": "a", "app": "paye", "node": "node-1", "port": 49153},
+                          {"id": "b", "app": "paye", "node": "node-2", "port": 49154},
+                          {"id": "c", "app": "ers", "node": "node-1", "port": 49155}]
+        self.connection = MagicMock()
+        self.connection.config.docker_backend = "threads"
+        self.connection.known_instances.return_value = self.instances
+        self.connection.health = HealthCache()
+        self.connection.shared_inventory = None
+
+    def test_remembers_since_when_an_instance_has_been_healthy(self):
+        # given
+        cache = HealthCache()
+
+        # when
+        cache.record("a", True, 100)
+        cache.record("a", True, 115)
+        changed = cache.record("a", False, 130)
+
+        # then
+        self.assertTrue(changed)
+        self.assertEqual(dict(healthy=False, checked_at=130, since=130), cache.get("a"))
+        self.assertEqual(dict(healthy=0, unhealthy=1, unknown=2), cache.counts(len(self.instances)))
+        self.assertEqual([None, None], [i["health"] for i in cache.annotate(self.instances[1:])])
+        self.assertNotIn("health", self.instances[0])
+
+    @patch('captain.readiness.probe')
+    def test_probes_every_instance_and_forgets_removed_ones(self, probe):
+        # given
+        probe.side_effect = lambda host, port, path=None, timeout=2: port != 49154
+        prober = HealthProber(self.connection, interval=15, concurrency=2, timeout=1, path="/ping")
+
+        # when
+        prober.probe_all()
+        self.connection.known_instances.return_value = self.instances[1:]
+        prober.probe_all()
+
+        # then
+        self.assertEqual(5, probe.call_count)
+        probe.assert_any_call("node-1", 49153, path="/ping", timeout=1)
+        self.assertEqual(None, self.connection.health.get("a"))
+        self.assertFalse(self.connection.health.get("b")["healthy"])
+        self.assertTrue(self.connection.health.get("c")["healthy"])
+
+    @patch('captain.readiness.probe')
+    def test_only_the_shared_inventory_writer_probes(self, probe):
+        # given
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "inventory")
+        writer = SharedInventory(path)
+        writer.acquire_writer()
+        self.connection.shared_inventory = SharedInventory(path)
+        prober = HealthProber(self.connection, interval=15, concurrency=2, timeout=1)
+
+        # when
+        probed_while_another_writes = prober.probe_all()
+        writer.release_writer()
+        probed_as_writer = prober.probe_all()
+        self.connection.shared_inventory.release_writer()
+
+        # then
+        self.assertFalse(probed_while_another_writes)
+        self.assertTrue(probed_as_writer)
+        self.assertEqual(len(self.instances), probe.call_count)
+
+    def test_rebuilds_published_results(self):
+        # given
+        cache = HealthCache()
+        cache.record("a", True, 100)
+        cache.record("b", False, 115)
+
+        # when
+        published = HealthCache.of(cache.snapshot())
+
+        # then
+        self.assertEqual(cache.snapshot(), published.snapshot())
+        self.assertEqual(dict(healthy=1, unhealthy=1, unknown=1), published.counts(3))
@@ -0,0 +1,103 @@
+import time
+import threading
+import unittest
+from captain.hedging import LatencyTracker, HedgeExecutor, hedged
+
+
+class TestLatencyTracker(unittest.TestCase):
+
+    def test_has_no_threshold_until_enough_calls_are_known(self):
+        # given
+        tracker = LatencyTracker(min_samples=20)
+
+        # when
+        for i in xrange(19):
+            tracker.observe("containers", 0.01)
+
+        # then
+        self.assertIsNone(tracker.threshold("containers"))
+
+    def test_tracks_the_percentile_of_recent_calls_per_operation(self):
+        # given
+        tracker = LatencyTracker(percentile=95, window=100, min_samples=20)
+
+        # when
+        for i in xrange(100):
+            tracker.observe("containers", i / 1000.0)
+            tracker.observe("ping", 0.001)
+
+        # then
+        self.assertEqual(0.095, tracker.threshold("containers"))
+        self.assertEqual(0.001, tracker.threshold("ping"))
+
+
+class TestHedged(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = HedgeExecutor(4)
+        self.addCleanup(self.executor.shutdown)
+
+    def test_does_not_hedge_fast_calls(self):
+        # given
+        calls = []
+        hedges = []
+
+        def fast():
+            calls.append(1)
+            return "fast"
+
+        # when
+        result = hedged(fast, 1, self.executor, on_hedge=lambda: hedges.append(1))
+
+        # then
+        self.assertEqual("fast", result)
+        self.assertEqual(1, len(calls))
+        self.assertEqual([], hedges)
+
+    def test_returns_the_hedge_when_the_first_call_is_slow(self):
+        # given
+        calls = []
+
+        def first_slow():
+            calls.append(1)
+            if len(calls) == 1:
+                time.sleep(0.5)
+                return "first"
+            return "hedge"
+
+        # when
+        start = time.time()
+        result = hedged(first_slow, 0.01, self.executor)
+
+        # then
+        self.assertEqual("hedge", result)
+        self.assertLess(time.time() - start, 0.4)
+
+    def test_raises_when_both_calls_fail(self):
+        # given
+        def fail():
+            time.sleep(0.02)
+            raise ValueError()
+
+        # then
+        self.assertRaises(ValueError, hedged, fail, 0.01, self.executor)
+
+    def test_neither_queues_nor_hedges_without_idle_workers(self):
+        # given
+        executor = HedgeExecutor(1)
+        self.addCleanup(executor.shutdown)
+        threads = []
+        hedges = []
+
+        def slow():
+            threads.append(threading.current_thread())
+            time.sleep(0.05)
+            return "slow"
+
+        # when
+        inline = hedged(lambda: hedged(slow, 0.001, executor, on_hedge=lambda: hedges.append(1)), 1, executor)
+
+        # then
+        self.assertEqual("slow", inline)
+        self.assertEqual([], hedges)
+        self.assertEqual(1, len(threads))
@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import tempfile
+import unittest
+import threading
+from mock import patch, MagicMock
+from captain.jobs import JobRegistry, MemoryJobStore, SqliteJobStore
+from captain import exceptions
+
+os.environ["SLUG_RUNNER_COMMAND"] = ''
+os.environ["SLUG_RUNNER_IMAGE"] = ''
+
+
+def wait_for(registry, job_id, state):
+    deadline = time.time() + 5
+    while registry.get(job_id)["state"] != state and time.time() < deadline:
+        time.sleep(0.005)
+    return registry.get(job_id)
+
+
+class TestJobRegistry(unittest.TestCase):
+
+    def test_runs_jobs_in_the_background_recording_steps(self):
+        # given
+        registry = JobRegistry(MemoryJobStore(10))
+
+        def run(job):
+            job.step("created", container_id="abc")
+            return {"id": "abc"}
+
+        # when
+        job = registry.submit("start_instance", run, request={"app": "paye"})
+        finished = wait_for(registry, job.id, "succeeded")
+
+        # then
+        self.assertEqual({"id": "abc"}, finished["result"])
+        self.assertEqual({"app": "paye"}, finished["request"])
+        self.assertEqual(["created"], [step["name"] for step in finished["steps"]])
+        self.assertEqual("abc", finished["steps"][0]["container_id"])
+
+    def test_fails_jobs_that_raise(self):
+        # given
+        registry = JobRegistry(MemoryJobStore(10))
+
+        def run(job):
+            raise ValueError("no slots")
+
+        # when
+        job = registry.submit("start_instance", run)
+
+        # then
+        self.assertEqual("ValueError: no slots", wait_for(registry, job.id, "failed")["error"])
+
+    def test_keeps_the_most_recent_jobs(self):
+        # given
+        store = MemoryJobStore(2)
+
+        # when
+        for job_id in ("a", "b", "c"):
+            store.save(dict(id=job_id, kind="start_instance"))
+
+        # then
+        self.assertEqual(["c", "b"], [job["id"] for job in store.recent()])
+        self.assertIsNone(store.load("a"))
+
+    def test_shares_jobs_through_sqlite(self):
+        # given
+        path = tempfile.mktemp(suffix=".db")
+        self.addCleanup(os.remove, path)
+        registry = JobRegistry(SqliteJobStore(path, 10))
+
+        # when
+        job = registry.submit("start_instance", lambda job: "done")
+        wait_for(registry, job.id, "succeeded")
+
+        # then
+        other_worker = SqliteJobStore(path, 10)
+        self.assertEqual("done", other_worker.load(job.id)["result"])
+        self.assertEqual([job.id], [j["id"] for j in other_worker.recent(kind="start_instance")])
+        self.assertEqual([], other_worker.recent(kind="rollout"))
+
+    def test_does_not_start_exclusive_jobs_already_in_progress(self):
+        path = tempfile.mktemp(suffix=".db")
+        self.addCleanup(os.remove, path)
+        for store, other_worker in [(MemoryJobStore(10), None), (SqliteJobStore(path, 10), SqliteJobStore(path, 10))]:
+            # given
+            registry = JobRegistry(store)
+            release = threading.Event()
+            first = registry.submit("drain", lambda job: release.wait(5), request={"node": "node-1"}, exclusive=True)
+            other = registry.submit("drain", lambda job: "done", request={"node": "node-2"}, exclusive=True)
+
+            # when
+            with self.assertRaises(exceptions.JobInProgressException) as raised:
+                JobRegistry(other_worker or store).submit("drain", lambda job: "again", request={"node": "node-1"},
+                                                          exclusive=True)
+            release.set()
+            wait_for(registry, first.id, "succeeded")
+            again = registry.submit("drain", lambda job: "again", request={"node": "node-1"}, exclusive=True)
+
+            # then
+            self.assertEqual(first.id, raised.exception.job["id"])
+            self.assertEqual("done", wait_for(registry, other.id, "succeeded")["result"])
+            self.assertEqual("again", wait_for(registry, again.id, "succeeded")["result"])
+
+    def test_fails_jobs_whose_worker_stopped_saving_them(self):
+        path = tempfile.mktemp(suffix=".db")
+        self.addCleanup(os.remove, path)
+        for store in [MemoryJobStore(10), SqliteJobStore(path, 10)]:
+            # given
+            abandoned = dict(id="abandoned", kind="drain", request={"node": "node-1"}, state="running",
+                             updated_at=time.time() - 61)
+            store.save(abandoned)
+
+            # when
+            again = JobRegistry(store).submit("drain", lambda job: "again", request={"node": "node-1"}, exclusive=True)
+
+            # then
+            self.assertEqual("failed", store.load("abandoned")["state"])
+            self.assertEqual("again", wait_for(JobRegistry(store), again.id, "succeeded")["result"])
+
+
+class TestJobEndpoints(unittest.TestCase):
+
+    def setUp(self):
+        import captain_web
+        self.test_app = captain_web.app.test_client()
+
+    def test_starts_instances_asynchronously(self):
+        # given
+        def start_instance_job(connection, instance_request):
+            return lambda job: dict(instance_request, id="abc")
+
+        # when
+        with patch('captain.deploy.start_instance_job', side_effect=start_instance_job):
+            response = self.test_app.post('/instances/?async=1', data=json.dumps({"app": "paye", "node": "node-1"}),
+                                          content_type='application/json')
+
+        # then
+        self.assertEqual(202, response.status_code)
+        job = json.loads(response.data)
+        self.assertTrue(response.headers['Location'].endswith('/jobs/{}'.format(job["id"])))
+        deadline = time.time() + 5
+        while json.loads(self.test_app.get('/jobs/{}'.format(job["id"])).data)["state"] != "succeeded":
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.005)
+        self.assertEqual("abc", json.loads(self.test_app.get('/jobs/{}'.format(job["id"])).data)["result"]["id"])
+
+    def test_refuses_rollouts_it_could_not_run(self):
+        for rollout_request in [{"slug_uri": "http://slugs/paye.tgz", "batch_size": "two"},
+                                {"slug_uri": "http://slugs/paye.tgz", "batch_size": None},
+                                {"slug_uri": "http://slugs/paye.tgz", "environment": ["JAVA_OPTS=-Xmx256m"]},
+                                {"slug_uri": "http://slugs/paye.tgz", "slots": "2"},
+                                {"slug_uri": "http://slugs/paye.tgz", "slots": 0},
+                                {"slug_uri": "http://slugs/paye.tgz", "slots": True}]:
+            # when
+            with patch('captain.deploy.rollout_job') as rollout_job:
+                response = self.test_app.post('/apps/paye/rollout', data=json.dumps(rollout_request),
+                                              content_type='application/json')
+
+            # then
+            self.assertEqual(400, response.status_code)
+            self.assertFalse(rollout_job.called)
+
+    def test_refuses_a_reconcile_pass_while_another_runs(self):
+        # given
+        connection = MagicMock()
+        connection.reconciler.claim_pass.return_value = None
+
+        # when
+        with patch('captain_web.get_captain_conn', return_value=connection):
+            response = self.test_app.post('/reconcile')
+
+        # then
+        self.assertEqual(409, response.status_code)
+        self.assertFalse(connection.jobs.submit.called)
+
+    def test_unknown_job(self):
+        self.assertEqual(404, self.test_app.get('/jobs/unknown').status_code)
@@ -0,0 +1,36 @@
+import os
+import tarfile
+import unittest
+from cStringIO import StringIO
+from mock import patch
+from captain.connection import Connection
+from captain.config import Config
+from captain.log_archive import log_archive
+from captain.tests.util_cluster import SyntheticCluster
+
+os.environ["SLUG_RUNNER_COMMAND"] = ''
+os.environ["SLUG_RUNNER_IMAGE"] = ''
+
+
+class TestLogArchive(unittest.TestCase):
+
+    def test_archives_the_logs_of_every_instance(self):
+        # given
+        cluster = SyntheticCluster(nodes=3, containers_per_node=4, exited_ratio=0, apps=2)
+        config = Config()
+        config.docker_nodes = cluster.docker_nodes()
+
+        with patch('docker.Client', side_effect=cluster.client):
+            connection = Connection(config)
+            instances = connection.find_instances(app="app0")
+            missing = dict(instances[0], id="gone")
+
+            # when
+            archive = tarfile.open(fileobj=StringIO("".join(log_archive(connection, instances + [missing]))), mode="r:gz")
+
+        # then
+        expected = ["app0/{}_{}.log".format(i["node"], i["id"]) for i in instances]
+        self.assertEqual(sorted(expected + ["app0/{}_gone.error".format(missing["node"])]), sorted(archive.getnames()))
+        first = archive.extractfile("app0/{}_{}.log".format(instances[0]["node"], instances[0]["id"])).read()
+        self.assertEqual("{} log line 0".format(instances[0]["id"][:12]), first.split("\n")[0])
+        self.assertEqual(100, len(first.split("\n")))
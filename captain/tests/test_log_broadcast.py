@@ -0,0 +1,128 @@
+import time
+import Queue
+import threading
+import unittest
+from mock import MagicMock
+from captain.log_broadcast import LogBroadcaster, open_log_stream
+
+
+class FakeUpstream(object):
+    def __init__(self):
+        self.lines = Queue.Queue()
+        self.closed = False
+
+    def __iter__(self):
+        while True:
+            line = self.lines.get()
+            if line is None:
+                return
+            yield line
+
+    def close(self):
+        # Like a Docker stream shut down under its reader, wakes it up
+        self.closed = True
+        self.lines.put(None)
+
+
+def wait_until(condition):
+    deadline = time.time() + 5
+    while not condition() and time.time() < deadline:
+        time.sleep(0.001)
+    return condition()
+
+
+class TestLogBroadcaster(unittest.TestCase):
+
+    def setUp(self):
+        self.upstream = FakeUpstream()
+        self.opened = []
+
+        self.history = []
+
+        def open_upstream():
+            self.opened.append(self.upstream)
+            return self.history, self.upstream
+        self.open_upstream = open_upstream
+
+    def test_followers_of_an_instance_share_one_upstream(self):
+        # given
+        broadcaster = LogBroadcaster(10)
+        first = broadcaster.follow("abc", self.open_upstream)
+        second = broadcaster.follow("abc", self.open_upstream)
+
+        # when
+        for line in ["one", "two", None]:
+            self.upstream.lines.put(line)
+
+        # then
+        self.assertEqual(["one", "two"], list(first))
+        self.assertEqual(["one", "two"], list(second))
+        self.assertEqual(1, len(self.opened))
+        self.assertTrue(wait_until(lambda: broadcaster.stats() == dict(streams=0, followers=0)))
+
+    def test_disconnects_followers_that_fall_behind(self):
+        # given
+        dropped = []
+        broadcaster = LogBroadcaster(2, on_drop=lambda: dropped.append(True))
+        slow = broadcaster.follow("abc", self.open_upstream)
+        fast = broadcaster.follow("abc", self.open_upstream)
+
+        # when
+        received = []
+        for number in xrange(5):
+            self.upstream.lines.put(str(number))
+            received.append(next(fast))
+
+        # then
+        self.assertEqual(["0", "1", "2", "3", "4"], received)
+        self.assertEqual(["0", "1"], list(slow))
+        self.assertEqual([True], dropped)
+        self.assertEqual(dict(streams=1, followers=1), broadcaster.stats())
+
+    def test_closes_the_upstream_after_the_last_follower_leaves(self):
+        # given
+        broadcaster = LogBroadcaster(10)
+        follower = broadcaster.follow("abc", self.open_upstream)
+        self.upstream.lines.put("one")
+        self.assertEqual("one", next(follower))
+
+        # when
+        follower.close()
+
+        # then
+        self.assertTrue(self.upstream.closed)
+        self.assertTrue(wait_until(lambda: not [t for t in threading.enumerate() if t.name == "logs-abc"]))
+        self.assertEqual(dict(streams=0, followers=0), broadcaster.stats())
+        self.upstream = FakeUpstream()
+        broadcaster.follow("abc", self.open_upstream)
+        self.assertEqual(2, len(self.opened))
+
+    def test_every_follower_starts_with_the_same_backlog(self):
+        # given
+        broadcaster = LogBroadcaster(10, backlog=2)
+        self.history = ["one", "two", "three"]
+        first = broadcaster.follow("abc", self.open_upstream)
+
+        # when
+        self.upstream.lines.put("four")
+        self.assertEqual(["two", "three", "four"], [next(first) for _ in xrange(3)])
+        second = broadcaster.follow("abc", self.open_upstream)
+        self.upstream.lines.put("five")
+        self.upstream.lines.put(None)
+
+        # then
+        self.assertEqual(["five"], list(first))
+        self.assertEqual(["three", "four", "five"], list(second))
+
+    def test_opens_docker_streams_after_what_was_already_logged(self):
+        # given
+        node_connection = MagicMock()
+        node_connection.logs.side_effect = lambda instance_id, stream=False: \
+            iter(["one\n", "two\nthr", "ee\n", "four\n"]) if stream else "one\ntwo\n"
+
+        # when
+        history, lines = open_log_stream(node_connection, "abc")
+
+        # then
+        self.assertEqual(["one\n", "two\n"], history)
+        self.assertEqual(["thr", "ee\n", "four\n"], list(lines))
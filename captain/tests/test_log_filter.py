@@ -0,0 +1,67 @@
+import os
+import unittest
+from mock import patch
+from captain.log_filter import LogFilter
+from captain.connection import Connection
+from captain.config import Config
+from captain.tests.util_cluster import SyntheticCluster
+
+os.environ["SLUG_RUNNER_COMMAND"] = ''
+os.environ["SLUG_RUNNER_IMAGE"] = ''
+
+
+class TestLogFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.lines = ['{"level": "ERROR", "msg": "payment failed", "http": {"status": 500}}',
+                      '{"level": "INFO", "msg": "payment taken", "http": {"status": 200}}',
+                      '{"level": "INFO", "msg": "health check ERROR ignored"}',
+                      'plain ERROR line']
+
+    def test_selects_lines_by_pattern(self):
+        # when
+        selected = list(LogFilter(grep="payment", invert="taken").apply(self.lines))
+
+        # then
+        self.assertEqual([self.lines[0]], selected)
+
+    def test_selects_json_lines_by_field(self):
+        # when
+        errors = list(LogFilter(fields={"level": "ERROR"}).apply(self.lines))
+        server_errors = list(LogFilter(fields=LogFilter.parse_fields(["http.status:500"])).apply(self.lines))
+
+        # then
+        self.assertEqual([self.lines[0]], errors)
+        self.assertEqual([self.lines[0]], server_errors)
+
+    def test_matches_values_json_escapes(self):
+        # given
+        line = '{"msg": "caf\\u00e9 \\"closed\\""}'
+
+        # then
+        self.assertTrue(LogFilter(fields={"msg": u'caf\xe9 "closed"'}).matches(line))
+
+    def test_passes_everything_without_predicates(self):
+        # given
+        line_filter = LogFilter()
+
+        # then
+        self.assertFalse(line_filter)
+        self.assertIs(self.lines, line_filter.apply(self.lines))
+        self.assertRaises(ValueError, LogFilter.parse_fields, ["level"])
+
+    def test_filters_instance_logs_before_wrapping_them(self):
+        # given
+        cluster = SyntheticCluster(nodes=1, containers_per_node=1, exited_ratio=0)
+        config = Config()
+        config.docker_nodes = cluster.docker_nodes()
+
+        with patch('docker.Client', side_effect=cluster.client):
+            connection = Connection(config)
+            instance = connection.get_instances()[0]
+
+            # when
+            logs = list(connection.get_logs(instance["id"], line_filter=LogFilter(grep="line 1", invert="line 1.")))
+
+        # then
+        self.assertEqual([{"msg": "{} log line 1\n".format(instance["id"][:12])}], logs)
@@ -0,0 +1,47 @@
+import logging
+import unittest
+from mock import MagicMock, patch
+from captain.logs import StructuredLogger
+
+
+class Unformattable(object):
+    def __format__(self, spec):
+        raise AssertionError("formatted a message that was never emitted")
+
+
+class TestStructuredLogger(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = MagicMock()
+        self.logger.isEnabledFor.side_effect = lambda level: level >= logging.INFO
+
+    def test_logs_formatted_dict_messages(self):
+        # when
+        StructuredLogger(self.logger).info("Stopped container {} on {}", "abc", "node-1", node="node-1")
+
+        # then
+        self.logger.log.assert_called_once_with(
+            logging.INFO, {"message": "Stopped container abc on node-1", "node": "node-1"}, exc_info=None)
+
+    def test_does_not_format_disabled_messages(self):
+        # when
+        StructuredLogger(self.logger).debug("Cache miss on {}", Unformattable())
+
+        # then
+        self.assertFalse(self.logger.log.called)
+
+    @patch('random.random')
+    def test_keeps_a_sample_of_sampled_messages(self, random):
+        # given
+        logger = StructuredLogger(self.logger, sample_rate=0.1)
+
+        # when
+        random.return_value = 0.5
+        logger.info("Skipping {} from environment", "HOME", sampled=True)
+        logger.info("Not sampled")
+        random.return_value = 0.05
+        logger.info("Skipping {} from environment", "PATH", sampled=True)
+
+        # then
+        self.assertEqual(["Not sampled", "Skipping PATH from environment"],
+                         [c[0][1]["message"] for c in self.logger.log.call_args_list])
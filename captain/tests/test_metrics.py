@@ -0,0 +1,94 @@
+import os
+import unittest
+import threading
+from mock import patch
+from captain.metrics import Registry
+
+os.environ["SLUG_RUNNER_COMMAND"] = ''
+os.environ["SLUG_RUNNER_IMAGE"] = ''
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_renders_counters_in_prometheus_text_format(self):
+        # given
+        registry = Registry()
+        counter = registry.counter("calls_total", "Calls", ("node",))
+
+        # when
+        counter.inc(("node-1",))
+        counter.inc(("node-1",))
+        counter.inc(("node-2\"",), 3)
+
+        # then
+        self.assertEqual(u'# HELP calls_total Calls\n'
+                         u'# TYPE calls_total counter\n'
+                         u'calls_total{node="node-1"} 2\n'
+                         u'calls_total{node="node-2\\""} 3\n', registry.render())
+
+    def test_renders_cumulative_histogram_buckets(self):
+        # given
+        registry = Registry()
+        histogram = registry.histogram("call_seconds", "Calls", ("op",), buckets=(0.1, 1.0))
+
+        # when
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(("ping",), value)
+
+        # then
+        self.assertEqual([u'call_seconds_bucket{op="ping",le="0.1"} 2',
+                          u'call_seconds_bucket{op="ping",le="1.0"} 3',
+                          u'call_seconds_bucket{op="ping",le="+Inf"} 4',
+                          u'call_seconds_sum{op="ping"} 2.65',
+                          u'call_seconds_count{op="ping"} 4'], registry.render().splitlines()[2:])
+
+    def test_renders_gauges_when_collected(self):
+        # given
+        registry = Registry()
+        values = {("a",): 1}
+        registry.gauge("depth", "Depth", ("state",), lambda: values)
+
+        # when
+        values = {("a",): 5}
+
+        # then
+        self.assertIn(u'depth{state="a"} 5', registry.render())
+
+    @patch('captain.metrics.FOLD_THRESHOLD', 100)
+    def test_counts_every_observation_from_concurrent_threads(self):
+        # given
+        counter = Registry().counter("calls_total", "Calls")
+
+        def record():
+            for _ in xrange(5000):
+                counter.inc()
+
+        # when
+        threads = [threading.Thread(target=record) for _ in xrange(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # then
+        self.assertEqual({(): 40000}, counter.values())
+
+
+class TestMetricsEndpoint(unittest.TestCase):
+
+    def test_exposes_request_and_connection_metrics(self):
+        # given
+        import captain_web
+        test_app = captain_web.app.test_client()
+        test_app.get('/ping/ping')
+
+        # when
+        response = test_app.get('/metrics')
+
+        # then
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        self.assertIn('captain_http_request_duration_seconds_count{resource="restping",method="GET",status="204"}',
+                      response.data)
+        self.assertIn('# TYPE captain_docker_call_duration_seconds histogram', response.data)
+        self.assertIn('python_gc_count{generation="0"}', response.data)
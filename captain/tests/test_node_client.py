@@ -0,0 +1,82 @@
+import time
+import unittest
+from mock import MagicMock, patch
+from requests.exceptions import ConnectionError, Timeout
+from captain.node_client import NodeClient
+from captain.hedging import HedgeExecutor
+from captain.admission import NodeAdmission
+
+
+class TestNodeClient(unittest.TestCase):
+
+    def setUp(self):
+        self.client = MagicMock()
+        self.metrics = MagicMock()
+
+    def node_client(self, **kwargs):
+        return NodeClient("node-1", self.client, NodeAdmission(10), self.metrics, **kwargs)
+
+    @patch('time.sleep')
+    def test_retries_reads_with_backoff(self, sleep):
+        # given
+        self.client.containers.side_effect = [ConnectionError(), ConnectionError(), ["container"]]
+
+        # when
+        result = self.node_client(retries=2, backoff=0.1).containers(all=True)
+
+        # then
+        self.assertEqual(["container"], result)
+        self.assertEqual(3, self.client.containers.call_count)
+        self.assertEqual(2, self.metrics.docker_retries.inc.call_count)
+        first, second = [c[0][0] for c in sleep.call_args_list]
+        self.assertTrue(0.05 <= first <= 0.15)
+        self.assertTrue(0.1 <= second <= 0.3)
+
+    @patch('time.sleep')
+    def test_gives_up_after_retries(self, sleep):
+        # given
+        self.client.ping.side_effect = ConnectionError()
+
+        # then
+        self.assertRaises(ConnectionError, self.node_client(retries=1).ping)
+        self.assertEqual(2, self.client.ping.call_count)
+
+    def test_does_not_retry_reads_that_time_out(self):
+        # given
+        self.client.containers.side_effect = Timeout()
+
+        # then
+        self.assertRaises(Timeout, self.node_client(retries=3).containers)
+        self.assertEqual(1, self.client.containers.call_count)
+
+    def test_does_not_retry_writes(self):
+        # given
+        self.client.stop.side_effect = ConnectionError()
+
+        # then
+        self.assertRaises(ConnectionError, self.node_client(retries=3).stop, "abc")
+        self.assertEqual(1, self.client.stop.call_count)
+
+    def test_hedges_reads_slower_than_the_node_p95(self):
+        # given
+        executor = HedgeExecutor(4)
+        self.addCleanup(executor.shutdown)
+        node_client = self.node_client(hedge_executor=executor)
+        for i in xrange(20):
+            node_client.latencies.observe("inspect_container", 0.001)
+        calls = []
+
+        def inspect_container(container_id):
+            calls.append(container_id)
+            if len(calls) == 1:
+                time.sleep(0.5)
+                return "slow"
+            return "hedge"
+        self.client.inspect_container.side_effect = inspect_container
+
+        # when
+        result = node_client.inspect_container("abc")
+
+        # then
+        self.assertEqual("hedge", result)
+        self.metrics.docker_hedges.inc.assert_called_once_with(("node-1", "inspect_container"))
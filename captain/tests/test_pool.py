@@ -0,0 +1,47 @@
+import unittest
+import threading
+import time
+from mock import patch
+from captain.pool import PooledAdapter
+
+
+class TestPooledAdapter(unittest.TestCase):
+
+    def test_counts_requests_beyond_pool_size_as_saturated(self):
+        # given
+        adapter = PooledAdapter(1)
+        release = threading.Event()
+
+        def slow_send(request, **kwargs):
+            release.wait(5)
+            return "response"
+
+        # when
+        with patch('requests.adapters.HTTPAdapter.send', side_effect=slow_send):
+            threads = [threading.Thread(target=adapter.send, args=("request",)) for _ in xrange(2)]
+            for thread in threads:
+                thread.start()
+            while adapter.stats()["in_flight"] < 2:
+                time.sleep(0.001)
+            release.set()
+            for thread in threads:
+                thread.join()
+
+        # then
+        stats = adapter.stats()
+        self.assertEqual(1, stats["pool_size"])
+        self.assertEqual(0, stats["in_flight"])
+        self.assertEqual(2, stats["peak_in_flight"])
+        self.assertEqual(2, stats["requests"])
+        self.assertEqual(1, stats["saturated_requests"])
+
+    def test_uses_configured_pool_size(self):
+        # given
+        adapter = PooledAdapter(25)
+
+        # when
+        pool = adapter.poolmanager.connection_from_url("http://node-1:5000/")
+
+        # then
+        self.assertEqual(25, pool.pool.maxsize)
+        self.assertEqual(0, adapter.stats()["connections_opened"])
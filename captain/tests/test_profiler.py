@@ -0,0 +1,100 @@
+import os
+import time
+import unittest
+import threading
+from collections import Counter
+from mock import patch
+from captain.profiler import SamplingProfiler, ProfilerBusyException, folded
+
+os.environ["SLUG_RUNNER_COMMAND"] = ''
+os.environ["SLUG_RUNNER_IMAGE"] = ''
+
+
+def busy_work(stop):
+    while not stop.is_set():
+        sum(i * i for i in xrange(1000))
+
+
+class TestSamplingProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.stop = threading.Event()
+        self.worker = threading.Thread(target=busy_work, args=(self.stop,))
+        self.worker.start()
+        self.addCleanup(self.worker.join)
+        self.addCleanup(self.stop.set)
+
+    def test_samples_other_threads_from_a_timer_on_the_main_thread(self):
+        # when
+        samples = SamplingProfiler(interval=0.001).profile(0.2)
+
+        # then
+        self.assertTrue(any("busy_work (test_profiler.py" in stack for stack in samples))
+        self.assertFalse(any("profile (profiler.py" in stack for stack in samples))
+
+    def test_samples_from_a_thread_off_the_main_thread(self):
+        # given
+        results = []
+
+        # when
+        profiler = threading.Thread(target=lambda: results.append(SamplingProfiler(interval=0.001).profile(0.2)))
+        profiler.start()
+        profiler.join()
+
+        # then
+        self.assertTrue(any("busy_work (test_profiler.py" in stack for stack in results[0]))
+
+    @patch('captain.profiler.time')
+    def test_never_sleeps_past_the_deadline(self, profiler_time):
+        # given
+        profiler_time.time.side_effect = [100.0, 100.0, 100.3, 100.3]
+
+        # when
+        SamplingProfiler().profile(0.2)
+
+        # then
+        profiler_time.sleep.assert_called_once_with(0)
+
+    def test_takes_one_profile_at_a_time(self):
+        # given
+        started = threading.Event()
+        profiler = threading.Thread(target=lambda: started.set() or SamplingProfiler().profile(0.3))
+        profiler.start()
+        started.wait()
+        time.sleep(0.05)
+
+        # then
+        self.assertRaises(ProfilerBusyException, SamplingProfiler().profile, 0.1)
+        profiler.join()
+
+    def test_folds_stacks_most_frequent_first(self):
+        self.assertEqual("a;b 3\na 1\n", folded(Counter({"a": 1, "a;b": 3})))
+
+
+class TestProfileEndpoint(unittest.TestCase):
+
+    def setUp(self):
+        import captain_web
+        self.test_app = captain_web.app.test_client()
+        with captain_web.app.app_context():
+            self.config = captain_web.get_captain_conn().config
+
+    def test_is_disabled_without_a_debug_token(self):
+        with patch.object(self.config, 'debug_token', None):
+            self.assertEqual(404, self.test_app.get('/debug/profile?seconds=0.01').status_code)
+
+    def test_requires_the_debug_token(self):
+        with patch.object(self.config, 'debug_token', 'secret'):
+            response = self.test_app.get('/debug/profile?seconds=0.01', headers={'Authorization': 'Bearer wrong'})
+        self.assertEqual(401, response.status_code)
+
+    def test_returns_collapsed_stacks(self):
+        stop = threading.Event()
+        worker = threading.Thread(target=busy_work, args=(stop,))
+        worker.start()
+        self.addCleanup(worker.join)
+        self.addCleanup(stop.set)
+        with patch.object(self.config, 'debug_token', 'secret'):
+            response = self.test_app.get('/debug/profile?seconds=0.1', headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(200, response.status_code)
+        self.assertIn("busy_work (test_profiler.py", response.data)
@@ -0,0 +1,26 @@
+import socket
+import unittest
+from captain.readiness import probe, wait_until_ready
+
+
+class TestReadiness(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+
+    def tearDown(self):
+        self.listener.close()
+
+    def test_is_not_ready_until_the_port_accepts_connections(self):
+        self.assertFalse(probe("127.0.0.1", self.port, timeout=0.5))
+
+        # when
+        self.listener.listen(1)
+
+        # then
+        self.assertTrue(probe("127.0.0.1", self.port, timeout=0.5))
+
+    def test_gives_up_after_the_timeout(self):
+        self.assertFalse(wait_until_ready("127.0.0.1", self.port, 0.05, interval=0.01))
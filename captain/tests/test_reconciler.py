@@ -0,0 +1,170 @@
+import os
+import tempfile
+import unittest
+from mock import patch
+from captain.connection import Connection
+from captain.config import Config
+from captain.reconciler import Reconciler, ReconcileLoop, MemoryDesiredState, SqliteDesiredState, make_spec, matches
+from captain.tests.util_cluster import SyntheticCluster
+
+os.environ["SLUG_RUNNER_COMMAND"] = ''
+os.environ["SLUG_RUNNER_IMAGE"] = ''
+
+
+class TestReconciler(unittest.TestCase):
+
+    def setUp(self):
+        self.cluster = SyntheticCluster(nodes=3, containers_per_node=4, exited_ratio=0, apps=2)
+        config = Config()
+        config.docker_nodes = self.cluster.docker_nodes()
+        config.slots_per_node = 20
+        patcher = patch('docker.Client', side_effect=self.cluster.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        ready = patch('captain.readiness.instance_ready', return_value=True)
+        ready.start()
+        self.addCleanup(ready.stop)
+        self.connection = Connection(config)
+        self.desired = MemoryDesiredState()
+        self.reconciler = Reconciler(self.connection, self.desired, max_starts=10, max_stops=10)
+
+    def app_instances(self, app):
+        return [i for i in self.connection.scan_instances() if i["app"] == app]
+
+    def spec_of(self, app, **changes):
+        instance = self.app_instances(app)[0]
+        spec = dict(slug_uri=instance["slug_uri"], environment=instance["environment"], slots=instance["slots"],
+                    count=len(self.app_instances(app)))
+        spec.update(changes)
+        return spec
+
+    def test_starts_missing_instances_from_one_scan(self):
+        # given
+        spec = self.spec_of("app0")
+        spec["count"] += 3
+        self.desired.set("app0", spec)
+        self.cluster.reset_calls()
+
+        # when
+        result = self.reconciler.reconcile()
+
+        # then
+        self.assertEqual(3, len(result["started"]))
+        self.assertEqual([], result["stopped"])
+        self.assertEqual({"containers": 3, "create_container": 3, "start": 3, "inspect_container": 3},
+                         self.cluster.calls())
+        self.assertTrue(self.reconciler.status()["apps"]["app0"]["drift"]["converged"])
+
+    def test_stops_stale_instances_once_replaced(self):
+        # given
+        old = self.app_instances("app0")
+        self.desired.set("app0", self.spec_of("app0", slug_uri="http://slugs/app0-2.tgz"))
+        self.assertEqual(dict(desired=len(old), running=0, stale=len(old), missing=len(old), surplus=0, converged=False),
+                         self.reconciler.status()["apps"]["app0"]["drift"])
+
+        # when
+        result = self.reconciler.reconcile()
+
+        # then
+        self.assertEqual(sorted(i["id"] for i in old), sorted(result["stopped"]))
+        self.assertEqual(set(["http://slugs/app0-2.tgz"]), set(i["slug_uri"] for i in self.app_instances("app0")))
+        self.assertEqual(len(old), len(self.app_instances("app0")))
+
+    @patch('captain.readiness.instance_ready', return_value=False)
+    def test_keeps_stale_instances_when_replacements_fail(self, instance_ready):
+        # given
+        old = self.app_instances("app0")
+        self.desired.set("app0", self.spec_of("app0", slug_uri="http://slugs/app0-2.tgz"))
+
+        # when
+        result = self.reconciler.reconcile()
+
+        # then
+        self.assertEqual(len(old), len(result["failed"]))
+        self.assertEqual([], result["stopped"])
+        self.assertEqual(sorted(i["id"] for i in old), sorted(i["id"] for i in self.app_instances("app0")))
+
+    def test_stops_surplus_instances_from_the_busiest_nodes(self):
+        # given
+        old = self.app_instances("app0")
+        self.desired.set("app0", self.spec_of("app0", count=1))
+
+        # when
+        result = self.reconciler.reconcile()
+
+        # then
+        self.assertEqual(len(old) - 1, len(result["stopped"]))
+        self.assertEqual(1, len(self.app_instances("app0")))
+
+    def test_limits_starts_per_pass_and_leaves_other_apps_alone(self):
+        # given
+        others = self.app_instances("app1")
+        self.reconciler.max_starts = 2
+        spec = self.spec_of("app0")
+        spec["count"] += 5
+        self.desired.set("app0", spec)
+
+        # when
+        first = self.reconciler.reconcile()
+        second = self.reconciler.reconcile()
+
+        # then
+        self.assertEqual([2, 2], [len(first["started"]), len(second["started"])])
+        self.assertEqual(1, self.reconciler.status()["apps"]["app0"]["drift"]["missing"])
+        self.assertEqual(sorted(i["id"] for i in others), sorted(i["id"] for i in self.app_instances("app1")))
+
+    def test_makes_one_pass_at_a_time_across_workers(self):
+        # given
+        path = tempfile.mktemp()
+        other_worker = Reconciler(self.connection, self.desired, max_starts=10, max_stops=10, pass_lock_path=path)
+        self.reconciler.pass_lock_path = path
+        self.addCleanup(os.remove, path)
+        self.desired.set("app0", self.spec_of("app0", count=len(self.app_instances("app0")) + 1))
+
+        # when
+        release = self.reconciler.claim_pass()
+        skipped = ReconcileLoop(other_worker, interval=30).tick()
+        refused = other_worker.claim_pass()
+        release()
+        ticked = ReconcileLoop(other_worker, interval=30).tick()
+
+        # then
+        self.assertFalse(skipped)
+        self.assertIsNone(refused)
+        self.assertTrue(ticked)
+        self.assertEqual(1, other_worker.last_pass["started"])
+
+
+class TestDesiredState(unittest.TestCase):
+
+    def test_keeps_specs_in_sqlite(self):
+        # given
+        path = tempfile.mktemp()
+        self.addCleanup(os.remove, path)
+        spec = make_spec({"slug_uri": "http://slugs/app0-1.tgz", "count": 2, "environment": {"A": 1}}, 2)
+
+        # when
+        SqliteDesiredState(path).set("app0", spec)
+        desired = SqliteDesiredState(path)
+
+        # then
+        self.assertEqual({"app0": dict(slug_uri="http://slugs/app0-1.tgz", environment={"A": "1"}, slots=2, count=2)},
+                         desired.all())
+        self.assertTrue(desired.remove("app0"))
+        self.assertEqual(None, desired.get("app0"))
+
+    def test_compares_only_the_environment_the_spec_sets(self):
+        # given
+        spec = make_spec({"slug_uri": "http://slugs/app0-1.tgz", "count": 1, "environment": {"A": u"caf\xe9"}}, 2)
+        instance = dict(slug_uri="http://slugs/app0-1.tgz", slots=2, environment={u"A": u"caf\xe9", u"HOSTNAME": u"x"})
+
+        # then
+        self.assertTrue(matches(instance, spec))
+        self.assertFalse(matches(dict(instance, environment={u"HOSTNAME": u"x"}), spec))
+        self.assertFalse(matches(dict(instance, environment={u"A": u"cafe"}), spec))
+
+    def test_rejects_invalid_specs(self):
+        for spec in [None, {"count": 1}, {"slug_uri": "x", "count": -1}, {"slug_uri": "x", "count": "2"},
+                     {"slug_uri": "x", "count": 1, "slots": 0},
+                     {"slug_uri": "x", "count": 1, "environment": {"A": "caf\xe9"}}]:
+            self.assertRaises(ValueError, make_spec, spec, 2)
@@ -0,0 +1,67 @@
+import os
+import json
+import unittest
+from mock import patch, MagicMock
+from captain import routes
+
+os.environ["SLUG_RUNNER_COMMAND"] = ''
+os.environ["SLUG_RUNNER_IMAGE"] = ''
+
+
+class TestRoutes(unittest.TestCase):
+
+    def setUp(self):
+        self.instances = [
+            {"id": "a", "app": "paye", "node": "node-2", "port": 49154, "environment": {"JAVA_OPTS": "-Xmx256m"}},
+            {"id": "b", "app": "paye", "node": "node-1", "port": 49153, "environment": {}},
+            {"id": "c", "app": "ers", "node": "node-1", "port": 49160, "environment": {}}]
+
+    def test_keeps_only_where_apps_are_served(self):
+        # when
+        table = routes.routing_table(self.instances)
+
+        # then
+        self.assertEqual({"paye": [{"node": "node-1", "port": 49153}, {"node": "node-2", "port": 49154}],
+                          "ers": [{"node": "node-1", "port": 49160}]}, table)
+
+    def test_renders_upstream_config(self):
+        # given
+        table = routes.routing_table(self.instances)
+
+        # then
+        self.assertEqual("upstream ers {\n"
+                         "    server node-1:49160;\n"
+                         "}\n"
+                         "upstream paye {\n"
+                         "    server node-1:49153;\n"
+                         "    server node-2:49154;\n"
+                         "}\n", routes.render_nginx(table))
+        self.assertEqual("backend ers\n"
+                         "    server node-1_49160 node-1:49160 check\n"
+                         "backend paye\n"
+                         "    server node-1_49153 node-1:49153 check\n"
+                         "    server node-2_49154 node-2:49154 check\n", routes.render_haproxy(table))
+
+    def test_answers_not_modified_until_the_routes_change(self):
+        # given
+        import captain_web
+        test_app = captain_web.app.test_client()
+        connection = MagicMock()
+        connection.serving_stale_state = False
+        connection.get_routes.return_value = routes.routing_table(self.instances)
+
+        with patch('captain_web.get_captain_conn', return_value=connection):
+            # when
+            first = test_app.get('/routes')
+            unchanged = test_app.get('/routes', headers={'If-None-Match': first.headers['ETag']})
+            connection.get_routes.return_value = routes.routing_table(self.instances[1:])
+            changed = test_app.get('/routes', headers={'If-None-Match': first.headers['ETag']})
+            nginx = test_app.get('/routes?format=nginx')
+
+        # then
+        self.assertEqual(200, first.status_code)
+        self.assertEqual(routes.routing_table(self.instances), json.loads(first.data))
+        self.assertTrue(first.headers['ETag'].startswith('W/'))
+        self.assertEqual(304, unchanged.status_code)
+        self.assertEqual(200, changed.status_code)
+        self.assertTrue(nginx.data.startswith("upstream ers {"))
@@ -0,0 +1,128 @@
+import unittest
+import tempfile
+import shutil
+import time
+import os
+from mock import MagicMock
+from captain.shared_inventory import SharedInventory, InventoryPoller
+from captain.health import HealthCache
+
+
+class TestSharedInventory(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "inventory")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_reads_what_was_written(self):
+        # given
+        writer = SharedInventory(self.path)
+        reader = SharedInventory(self.path)
+
+        # when
+        writer.write([{"id": "656ca7c307d178", "app": "paye", "node": "node-1"}])
+        snapshot = reader.read()
+
+        # then
+        self.assertEqual(1, snapshot.version)
+        self.assertEqual([{"id": "656ca7c307d178", "app": "paye", "node": "node-1"}], snapshot.instances)
+
+    def test_versions_increase_and_readers_see_new_snapshots(self):
+        # given
+        writer = SharedInventory(self.path)
+        reader = SharedInventory(self.path)
+        writer.write([{"id": "1"}])
+        first = reader.read()
+
+        # when
+        writer.write([{"id": "1"}, {"id": "2"}])
+        second = reader.read()
+
+        # then
+        self.assertEqual(1, first.version)
+        self.assertEqual(2, second.version)
+        self.assertEqual(2, len(second.instances))
+        # unchanged snapshots are not decoded again
+        self.assertIs(second, reader.read())
+
+    def test_returns_none_when_missing_or_too_old(self):
+        # given
+        inventory = SharedInventory(self.path)
+
+        # then
+        self.assertIsNone(inventory.read())
+
+        # when
+        inventory.write([])
+        time.sleep(0.01)
+
+        # then
+        self.assertIsNone(inventory.read(max_age=0))
+        self.assertIsNotNone(inventory.read(max_age=60))
+
+    def test_ignores_corrupt_files(self):
+        # given
+        with open(self.path, "w") as f:
+            f.write("not an inventory")
+
+        # then
+        self.assertIsNone(SharedInventory(self.path).read())
+
+    def test_ignores_truncated_snapshots_and_writes_over_them(self):
+        # given
+        inventory = SharedInventory(self.path)
+        inventory.write([{"id": "1"}, {"id": "2"}])
+        with open(self.path, "rb") as f:
+            written = f.read()
+        with open(self.path + ".tmp", "wb") as f:
+            f.write(written[:-5])
+        os.rename(self.path + ".tmp", self.path)
+        reader = SharedInventory(self.path)
+
+        # then
+        self.assertIsNone(reader.read())
+
+        # when
+        version = SharedInventory(self.path).write([{"id": "3"}])
+
+        # then
+        self.assertEqual(2, version)
+        self.assertEqual([{"id": "3"}], reader.read().instances)
+
+    def test_only_one_writer_at_a_time(self):
+        # given
+        first = SharedInventory(self.path)
+        second = SharedInventory(self.path)
+
+        # then
+        self.assertTrue(first.acquire_writer())
+        self.assertFalse(second.acquire_writer())
+        first.release_writer()
+        self.assertTrue(second.acquire_writer())
+        second.release_writer()
+
+    def test_poller_publishes_scans_only_when_writer(self):
+        # given
+        connection = MagicMock()
+        connection.scan_instances.return_value = [{"id": "1"}]
+        connection.health = HealthCache()
+        connection.health.record("1", True, 100)
+        writer = SharedInventory(self.path)
+        writer.acquire_writer()
+        poller = InventoryPoller(connection, SharedInventory(self.path), 10)
+
+        # then
+        self.assertFalse(poller.poll())
+        self.assertFalse(connection.scan_instances.called)
+
+        # when
+        writer.release_writer()
+
+        # then
+        self.assertTrue(poller.poll())
+        self.assertEqual([{"id": "1"}], writer.read().instances)
+        self.assertEqual({"1": dict(healthy=True, checked_at=100, since=100)}, writer.read().health)
+        poller.inventory.release_writer()
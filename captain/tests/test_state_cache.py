@@ -0,0 +1,77 @@
+import unittest
+import tempfile
+import shutil
+import time
+import os
+from mock import MagicMock
+from captain.state_cache import StateCache, StateCheckpointer
+
+
+class TestStateCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "state.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_loads_what_was_saved(self):
+        # given
+        instances = [{"id": "656ca7c307d178", "app": "paye", "node": "node-1", "port": 9225}]
+        inspections = {("node-1", "656ca7c307d178", "Up", 9225): {"Id": "656ca7c307d178", "Name": "/paye_216"}}
+
+        # when
+        StateCache(self.path).save(instances, inspections)
+        saved_at, loaded_instances, loaded_inspections = StateCache(self.path).load()
+
+        # then
+        self.assertEqual(instances, loaded_instances)
+        self.assertEqual(inspections, loaded_inspections)
+
+    def test_replaces_previous_checkpoint(self):
+        # given
+        cache = StateCache(self.path)
+        cache.save([{"id": "1"}], {("node-1", "1", "Up", 1): {}})
+
+        # when
+        cache.save([{"id": "2"}], {})
+
+        # then
+        saved_at, instances, inspections = cache.load()
+        self.assertEqual([{"id": "2"}], instances)
+        self.assertEqual({}, inspections)
+
+    def test_ignores_missing_or_old_checkpoints(self):
+        # given
+        cache = StateCache(self.path)
+
+        # then
+        self.assertIsNone(cache.load())
+
+        # when
+        cache.save([], {})
+        time.sleep(0.01)
+
+        # then
+        self.assertIsNone(cache.load(max_age=0))
+        self.assertIsNotNone(cache.load(max_age=60))
+
+    def test_checkpointer_skips_until_something_was_scanned(self):
+        # given
+        connection = MagicMock()
+        connection.get_scanned_state.return_value = ([], {})
+        cache = MagicMock()
+
+        # when
+        StateCheckpointer(connection, cache, 60).checkpoint()
+
+        # then
+        self.assertFalse(cache.save.called)
+
+        # when
+        connection.get_scanned_state.return_value = ([{"id": "1"}], {})
+        StateCheckpointer(connection, cache, 60).checkpoint()
+
+        # then
+        cache.save.assert_called_with([{"id": "1"}], {})
@@ -0,0 +1,107 @@
+import os
+import unittest
+from mock import patch
+from requests.exceptions import ConnectionError
+from captain.summary import InventorySummary
+from captain import routes
+from captain.connection import Connection
+from captain.config import Config
+from captain.tests.util_cluster import SyntheticCluster
+
+os.environ["SLUG_RUNNER_COMMAND"] = ''
+os.environ["SLUG_RUNNER_IMAGE"] = ''
+
+
+def instance(app, node, slug_uri, slots=2, port=49153):
+    return dict(app=app, node=node, slug_uri=slug_uri, slots=slots, port=port)
+
+
+class TestInventorySummary(unittest.TestCase):
+
+    def test_recounts_only_the_node_scanned(self):
+        # given
+        summary = InventorySummary.of([instance("paye", "node-1", "paye-1"), instance("paye", "node-2", "paye-1"),
+                                       instance("ers", "node-2", "ers-3", slots=4)])
+
+        # when
+        summary.update_node("node-2", [instance("paye", "node-2", "paye-2")])
+
+        # then
+        self.assertEqual({"total_instances": 2,
+                          "apps": {"paye": 2},
+                          "nodes": {"node-1": 1, "node-2": 1},
+                          "slots": {"apps": {"paye": 4}, "nodes": {"node-1": 2, "node-2": 2}},
+                          "versions": {"paye": {"paye-1": 1, "paye-2": 1}},
+                          "unreachable": []}, summary.render())
+
+    def test_is_fresh_once_every_node_has_been_counted_recently(self):
+        # given
+        summary = InventorySummary()
+        summary.update_node("node-1", [])
+
+        # then
+        self.assertTrue(summary.fresh(["node-1"], 5))
+        self.assertFalse(summary.fresh(["node-1", "node-2"], 5))
+        self.assertFalse(summary.fresh(["node-1"], -1))
+
+    def test_keeps_the_routing_table_from_node_scans(self):
+        # given
+        summary = InventorySummary.of([instance("paye", "node-1", "paye-1", port=49153),
+                                       instance("ers", "node-2", "ers-3", port=49160)])
+        before = summary.routes()
+
+        # when
+        summary.update_node("node-1", [instance("paye", "node-1", "paye-2", port=49153)])
+        unchanged = summary.routes()
+        summary.update_node("node-2", [])
+
+        # then
+        self.assertEqual({"paye": [{"node": "node-1", "port": 49153}], "ers": [{"node": "node-2", "port": 49160}]},
+                         before)
+        self.assertIs(before, unchanged)
+        self.assertEqual({"paye": [{"node": "node-1", "port": 49153}]}, summary.routes())
+
+    def test_serves_the_summary_from_recent_scans(self):
+        # given
+        cluster = SyntheticCluster(nodes=3, containers_per_node=10, exited_ratio=0, apps=4)
+        config = Config()
+        config.docker_nodes = cluster.docker_nodes()
+
+        with patch('docker.Client', side_effect=cluster.client):
+            connection = Connection(config)
+            instances = connection.get_instances()
+            cluster.reset_calls()
+
+            # when
+            summary = connection.get_instance_summary()
+            routing_table = connection.get_routes()
+
+        # then
+        self.assertEqual({}, cluster.calls())
+        self.assertEqual(routes.routing_table(instances), routing_table)
+        self.assertEqual(len(instances), summary["total_instances"])
+        self.assertEqual(dict(healthy=0, unhealthy=0, unknown=len(instances)), summary["health"])
+        self.assertEqual(sum(i["slots"] for i in instances), sum(summary["slots"]["nodes"].values()))
+
+    def test_does_not_rescan_for_every_summary_while_a_node_is_down(self):
+        # given
+        cluster = SyntheticCluster(nodes=2, containers_per_node=5, exited_ratio=0)
+        config = Config()
+        config.docker_nodes = cluster.docker_nodes()
+
+        def down(**kwargs):
+            raise ConnectionError("node-1 is down")
+
+        with patch('docker.Client', side_effect=cluster.client):
+            connection = Connection(config)
+            cluster.nodes["node-1"].containers = down
+            connection.scan_instances()
+            cluster.reset_calls()
+
+            # when
+            summaries = [connection.get_instance_summary() for _ in xrange(5)]
+
+        # then
+        self.assertEqual({}, cluster.calls())
+        self.assertEqual(["node-1"], summaries[-1]["unreachable"])
+        self.assertEqual(5, summaries[-1]["total_instances"])
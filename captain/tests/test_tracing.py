@@ -0,0 +1,113 @@
+import os
+import json
+import logging
+import unittest
+from mock import patch, MagicMock
+from captain import tracing
+from captain.connection import Connection
+from captain.tests.util_mock import ClientMock
+
+os.environ["SLUG_RUNNER_COMMAND"] = ''
+os.environ["SLUG_RUNNER_IMAGE"] = ''
+
+
+class TestTracing(unittest.TestCase):
+
+    def test_records_nothing_without_a_trace(self):
+        # when
+        with tracing.span("docker", node="node-1", operation="ping"):
+            pass
+
+        # then
+        self.assertIsNone(tracing.current())
+
+    def test_breaks_down_docker_calls_by_node_and_operation(self):
+        # given
+        trace = tracing.Trace("abc")
+
+        # when
+        with tracing.activate(trace):
+            for operation in ("containers", "inspect_container", "inspect_container"):
+                with tracing.span("docker", node="node-1", operation=operation):
+                    pass
+            try:
+                with tracing.span("docker", node="node-2", operation="ping"):
+                    raise ValueError()
+            except ValueError:
+                pass
+
+        # then
+        breakdown = trace.breakdown()
+        self.assertEqual("abc", breakdown["request_id"])
+        self.assertEqual(2, breakdown["nodes"]["node-1"]["inspect_container"]["calls"])
+        self.assertEqual(1, breakdown["nodes"]["node-2"]["ping"]["calls"])
+        self.assertEqual("ValueError", trace.spans[-1]["error"])
+        self.assertIsNone(tracing.current())
+
+    def test_adds_request_id_to_log_records(self):
+        # given
+        record = logging.LogRecord("connection", logging.INFO, __file__, 1, "message", None, None)
+
+        # when
+        with tracing.activate(tracing.Trace("abc")):
+            tracing.RequestIdFilter().filter(record)
+
+        # then
+        self.assertEqual("abc", record.request_id)
+
+    @patch('docker.Client')
+    def test_traces_docker_calls_made_by_fan_out_workers(self, docker_client):
+        # given
+        ClientMock().mock_two_docker_nodes(docker_client)
+        config = MagicMock()
+        config.docker_nodes = ["http://node-1/", "http://node-2/", "http://node-3/"]
+        config.docker_gc_grace_period = 86400
+        config.docker_backend = "threads"
+        config.docker_concurrency = 8
+        config.docker_node_concurrency = 10
+        config.docker_node_rate = 0
+        config.docker_node_burst = 20
+        config.docker_read_retries = 0
+        config.docker_retry_backoff_ms = 100
+        config.docker_hedge_reads = False
+        config.jobs_path = None
+        config.job_retention = 1000
+        config.docker_stop_timeout = 10
+        config.log_follow_buffer = 1000
+        config.log_follow_backlog = 100
+        config.summary_max_age = 5
+        config.desired_state_path = None
+        config.reconcile_max_starts = 10
+        config.reconcile_max_stops = 10
+        config.log_sample_rate = 1.0
+        config.shared_inventory_path = None
+        config.state_cache_path = None
+        connection = Connection(config)
+        trace = tracing.Trace()
+
+        # when
+        with tracing.activate(trace):
+            connection.get_instances()
+
+        # then
+        breakdown = trace.breakdown()
+        self.assertEqual(["node-1", "node-2", "node-3"], sorted(breakdown["nodes"].keys()))
+        self.assertEqual(1, breakdown["nodes"]["node-1"]["containers"]["calls"])
+
+
+class TestTracingHeaders(unittest.TestCase):
+
+    def test_returns_request_id_and_breakdown_when_asked(self):
+        # given
+        import captain_web
+        test_app = captain_web.app.test_client()
+
+        # when
+        plain = test_app.get('/ping/ping', headers={'X-Request-Id': 'abc'})
+        traced = test_app.get('/ping/ping?trace=1')
+
+        # then
+        self.assertEqual('abc', plain.headers['X-Request-Id'])
+        self.assertNotIn('X-Captain-Trace', plain.headers)
+        self.assertEqual({}, json.loads(traced.headers['X-Captain-Trace'])["nodes"])
+        self.assertEqual(traced.headers['X-Request-Id'], json.loads(traced.headers['X-Captain-Trace'])["request_id"])
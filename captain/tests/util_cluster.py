@@ -0,0 +1,172 @@
+import time
+import uuid
+import random
+import threading
+import datetime
+import docker.errors
+from requests.exceptions import ConnectionError
+
+
+class _NotFoundResponse(object):
+    status_code = 404
+    reason = "Not Found"
+    content = ""
+
+
+class SyntheticNode(object):
+    """
+    Stands in for a docker.Client talking to one node of a generated cluster. Counts every call and can add
+    latency and random connection failures to each one.
+    """
+    def __init__(self, cluster, name):
+        self.cluster = cluster
+        self.name = name
+        self.containers_by_id = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+        self._next_port = 49000
+
+    def __call(self, operation):
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        latency = self.cluster.latency
+        if latency:
+            time.sleep(latency * (0.5 + self.cluster.random.random()))
+        if self.cluster.failure_rate and self.cluster.random.random() < self.cluster.failure_rate:
+            raise ConnectionError("Injected failure calling {} on {}".format(operation, self.name))
+
+    def __get(self, container_id):
+        try:
+            return self.containers_by_id[container_id]
+        except KeyError:
+            raise docker.errors.APIError("404 Client Error: Not Found", _NotFoundResponse(),
+                                         explanation="No such container: {}".format(container_id))
+
+    def add_container(self, app, environment, slots, running, created, finished=None):
+        container_id = uuid.uuid4().hex
+        with self._lock:
+            self._next_port += 1
+            port = self._next_port
+        self.containers_by_id[container_id] = {
+            "Id": container_id,
+            "Name": "/{}_{}".format(app, uuid.uuid4()),
+            "Created": created.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+            "State": {"Running": running,
+                      "FinishedAt": finished.strftime('%Y-%m-%dT%H:%M:%S.%fZ') if finished else "0001-01-01T00:00:00Z"},
+            "Config": {"Env": ["{}={}".format(k, v) for k, v in environment.items()],
+                       "CpuShares": slots,
+                       "Hostname": container_id[:12]},
+            "NetworkSettings": {"Ports": {"8080/tcp": [{"HostIp": "0.0.0.0", "HostPort": str(port)}]} if running else None},
+        }
+        return container_id
+
+    # docker.Client interface
+
+    def mount(self, prefix, adapter):
+        pass
+
+    def close(self):
+        pass
+
+    def ping(self):
+        self.__call("ping")
+        return "OK"
+
+    def containers(self, **kwargs):
+        self.__call("containers")
+        summaries = []
+        for container in self.containers_by_id.values():
+            running = container["State"]["Running"]
+            ports = container["NetworkSettings"]["Ports"] if running else None
+            summaries.append({
+                "Id": container["Id"],
+                "Names": [container["Name"]],
+                "Status": "Up 5 minutes" if running else "Exited (0) 2 days ago",
+                "Ports": [{"IP": "0.0.0.0", "PrivatePort": 8080, "PublicPort": int(ports["8080/tcp"][0]["HostPort"]), "Type": "tcp"}] if ports else []})
+        return summaries
+
+    def inspect_container(self, container_id):
+        self.__call("inspect_container")
+        return self.__get(container_id)
+
+    def create_container(self, image, command=None, ports=None, environment=None, detach=False, hostname=None,
+                         name=None, cpu_shares=None, mem_limit=0):
+        self.__call("create_container")
+        container_id = self.add_container((name or "container").split("_")[0], environment or {}, cpu_shares, False,
+                                          datetime.datetime.now())
+        return {"Id": container_id}
+
+    def start(self, container_id, port_bindings=None):
+        self.__call("start")
+        container = self.__get(container_id)
+        with self._lock:
+            self._next_port += 1
+            port = self._next_port
+        container["State"]["Running"] = True
+        container["NetworkSettings"]["Ports"] = {"8080/tcp": [{"HostIp": "0.0.0.0", "HostPort": str(port)}]}
+
+    def stop(self, container_id, timeout=10):
+        self.__call("stop")
+        container = self.__get(container_id)
+        container["State"]["Running"] = False
+        container["State"]["FinishedAt"] = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+    def remove_container(self, container_id, force=False):
+        self.__call("remove_container")
+        self.__get(container_id)
+        del self.containers_by_id[container_id]
+
+    def logs(self, container_id, stream=False):
+        self.__call("logs")
+        self.__get(container_id)
+        lines = ["{} log line {}".format(container_id[:12], i) for i in xrange(100)]
+        if stream:
+            return iter(lines)
+        return "\n".join(lines)
+
+
+class SyntheticCluster(object):
+    """
+    A generated cluster of nodes for scale tests and benchmarks, served through patched docker.Client:
+
+        cluster = SyntheticCluster(nodes=100, containers_per_node=200)
+        config.docker_nodes = cluster.docker_nodes()
+        with patch('docker.Client', side_effect=cluster.client):
+            connection = Connection(config)
+    """
+    def __init__(self, nodes=3, containers_per_node=10, exited_ratio=0.1, env_size=5, apps=20,
+                 latency=0.0, failure_rate=0.0, seed=0):
+        self.random = random.Random(seed)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.nodes = dict(("node-{}".format(i), SyntheticNode(self, "node-{}".format(i))) for i in xrange(nodes))
+        long_ago = datetime.datetime.now() - datetime.timedelta(days=30)
+        for node in self.nodes.values():
+            for i in xrange(containers_per_node):
+                app = "app{}".format(self.random.randrange(apps))
+                environment = dict(("{}_SETTING_{}".format(app.upper(), e), "x" * 64) for e in xrange(env_size))
+                environment.update({"PORT": "8080", "SLUG_URL": "http://slugs/{}-1.tgz".format(app)})
+                if self.random.random() < exited_ratio:
+                    node.add_container(app, environment, 2, False, long_ago, long_ago)
+                else:
+                    node.add_container(app, environment, 2, True, long_ago)
+
+    def client(self, base_url, version=None, timeout=None):
+        for name, node in self.nodes.items():
+            if "//{}:".format(name) in base_url or base_url.endswith("//{}".format(name)):
+                return node
+        raise Exception("{} not in the synthetic cluster".format(base_url))
+
+    def docker_nodes(self):
+        return ["http://{}:5000".format(name) for name in sorted(self.nodes.keys())]
+
+    def calls(self):
+        totals = {}
+        for node in self.nodes.values():
+            for operation, count in node.calls.items():
+                totals[operation] = totals.get(operation, 0) + count
+        return totals
+
+    def reset_calls(self):
+        for node in self.nodes.values():
+            node.calls = {}
@@ -0,0 +1,263 @@
+"""
+A fake Docker Remote API (v1.12) daemon, serving the nodes of a synthetic cluster over real HTTP.
+
+    $ python -m captain.tests.util_fake_docker --nodes 10 --containers 50 --latency 0.005 --failure-rate 0.01
+
+Each node listens on its own loopback address (127.0.0.2, 127.0.0.3, ...) so captain can tell them apart by
+hostname. Container state, latency and failure injection come from captain.tests.util_cluster.
+"""
+import re
+import sys
+import socket
+import json
+import time
+import struct
+import argparse
+import threading
+import urlparse
+import docker.errors
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from requests.exceptions import ConnectionError
+from captain.tests.util_cluster import SyntheticCluster
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, *args, **kwargs):
+        HTTPServer.__init__(self, *args, **kwargs)
+        self.open_requests = set()
+        self._threads = []
+
+    def process_request(self, request, client_address):
+        self.open_requests.add(request)
+        thread = threading.Thread(target=self.process_request_thread, args=(request, client_address))
+        thread.daemon = True
+        self._threads.append(thread)
+        thread.start()
+
+    def shutdown_request(self, request):
+        self.open_requests.discard(request)
+        HTTPServer.shutdown_request(self, request)
+
+    def handle_error(self, request, client_address):
+        # Clients hang up on followed log streams whenever they have read enough
+        if not isinstance(sys.exc_info()[1], socket.error):
+            HTTPServer.handle_error(self, request, client_address)
+
+    def close_requests(self, timeout=5):
+        """
+        Hang up on kept-alive and streaming connections and wait for their threads, so none is left running
+        while the interpreter exits.
+        """
+        for request in list(self.open_requests):
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        for thread in self._threads:
+            thread.join(timeout)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Write each response in one go, otherwise Nagle and delayed ACKs dominate the timings
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    routes = [
+        ("GET", re.compile(r"^/v[\d.]+/_ping$"), "ping"),
+        ("GET", re.compile(r"^/v[\d.]+/containers/json$"), "containers"),
+        ("GET", re.compile(r"^/v[\d.]+/containers/([^/]+)/json$"), "inspect_container"),
+        ("POST", re.compile(r"^/v[\d.]+/containers/create$"), "create_container"),
+        ("POST", re.compile(r"^/v[\d.]+/containers/([^/]+)/start$"), "start"),
+        ("POST", re.compile(r"^/v[\d.]+/containers/([^/]+)/stop$"), "stop"),
+        ("DELETE", re.compile(r"^/v[\d.]+/containers/([^/]+)$"), "remove_container"),
+        ("GET", re.compile(r"^/v[\d.]+/containers/([^/]+)/logs$"), "logs"),
+        ("GET", re.compile(r"^/v[\d.]+/events$"), "events"),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.__dispatch("GET")
+
+    def do_POST(self):
+        self.__dispatch("POST")
+
+    def do_DELETE(self):
+        self.__dispatch("DELETE")
+
+    def __dispatch(self, method):
+        url = urlparse.urlparse(self.path)
+        query = dict((k, v[0]) for k, v in urlparse.parse_qs(url.query).items())
+        length = int(self.headers.getheader("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else {}
+        for route_method, pattern, operation in self.routes:
+            match = pattern.match(url.path)
+            if route_method == method and match:
+                try:
+                    getattr(self.server.fake_node, "handle_" + operation)(self, query, body, *match.groups())
+                except docker.errors.APIError as e:
+                    self.respond(404, e.explanation)
+                except ConnectionError as e:
+                    self.respond(500, str(e))
+                return
+        self.respond(404, "page not found")
+
+    def respond(self, status, body=""):
+        if not isinstance(body, basestring):
+            body = json.dumps(body)
+            content_type = "application/json"
+        else:
+            content_type = "text/plain"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream(self, content_type, chunks, chunked=False):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Connection", "close")
+            self.close_connection = 1
+        self.end_headers()
+        self.wfile.flush()
+        for chunk in chunks:
+            self.wfile.write("{:x}\r\n{}\r\n".format(len(chunk), chunk) if chunked else chunk)
+            self.wfile.flush()
+        if chunked:
+            self.wfile.write("0\r\n\r\n")
+
+
+class FakeDockerNode(object):
+    """
+    Serves one SyntheticNode over HTTP. Calls that the synthetic node fails with a connection error are
+    answered with a 500, unknown containers with a 404.
+    """
+    def __init__(self, node, host="127.0.0.1", port=0, follow_interval=0.1):
+        self.node = node
+        self.follow_interval = follow_interval
+        self.events = []
+        self.stopped = threading.Event()
+        self._server = _Server((host, port), _Handler)
+        self._server.fake_node = self
+        self.host, self.port = self._server.server_address
+        self.url = "http://{}:{}".format(self.host, self.port)
+
+    def start(self):
+        thread = threading.Thread(target=self._server.serve_forever, name="fake-docker-{}".format(self.port))
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self._server.shutdown()
+        self._server.server_close()
+        self._server.close_requests()
+
+    def __event(self, status, container_id):
+        self.events.append(dict(status=status, id=container_id, time=int(time.time())))
+
+    def handle_ping(self, request, query, body):
+        request.respond(200, self.node.ping())
+
+    def handle_containers(self, request, query, body):
+        request.respond(200, self.node.containers())
+
+    def handle_inspect_container(self, request, query, body, container_id):
+        request.respond(200, self.node.inspect_container(container_id))
+
+    def handle_create_container(self, request, query, body):
+        environment = dict(item.split("=", 1) for item in body.get("Env") or [])
+        container = self.node.create_container(body.get("Image"), name=query.get("name"), environment=environment,
+                                               hostname=body.get("Hostname"), cpu_shares=body.get("CpuShares"))
+        self.__event("create", container["Id"])
+        request.respond(201, container)
+
+    def handle_start(self, request, query, body, container_id):
+        self.node.start(container_id)
+        self.__event("start", container_id)
+        request.respond(204)
+
+    def handle_stop(self, request, query, body, container_id):
+        self.node.stop(container_id)
+        self.__event("die", container_id)
+        request.respond(204)
+
+    def handle_remove_container(self, request, query, body, container_id):
+        self.node.remove_container(container_id)
+        self.__event("destroy", container_id)
+        request.respond(204)
+
+    def handle_logs(self, request, query, body, container_id):
+        follow = query.get("follow") == "1"
+        lines = self.node.logs(container_id, stream=True)
+
+        def frames():
+            for line in lines:
+                line = line + "\n"
+                yield struct.pack(">BxxxL", 1, len(line)) + line
+                if follow and self.stopped.wait(self.follow_interval):
+                    return
+        request.stream("application/vnd.docker.raw-stream", frames())
+
+    def handle_events(self, request, query, body):
+        def live_events():
+            # Like Docker, send events after the headers rather than with them, clients read them off the socket
+            for event in list(self.events):
+                if self.stopped.wait(self.follow_interval):
+                    return
+                yield json.dumps(event)
+        request.stream("application/json", live_events(), chunked=True)
+
+
+class FakeDockerCluster(object):
+    def __init__(self, follow_interval=0.1, **cluster_options):
+        self.cluster = SyntheticCluster(**cluster_options)
+        self.nodes = [FakeDockerNode(node, host="127.0.0.{}".format(i + 2), follow_interval=follow_interval)
+                      for i, node in enumerate(sorted(self.cluster.nodes.values(), key=lambda n: n.name))]
+
+    def start(self):
+        for node in self.nodes:
+            node.start()
+        return self
+
+    def stop(self):
+        for node in self.nodes:
+            node.stop()
+
+    def docker_nodes(self):
+        return [node.url for node in self.nodes]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--containers", type=int, default=20, help="containers per node")
+    parser.add_argument("--exited-ratio", type=float, default=0.1)
+    parser.add_argument("--latency", type=float, default=0.0, help="mean seconds added to every call")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of calls answered with a 500")
+    args = parser.parse_args()
+
+    cluster = FakeDockerCluster(nodes=args.nodes, containers_per_node=args.containers, exited_ratio=args.exited_ratio,
+                                latency=args.latency, failure_rate=args.failure_rate).start()
+    print "DOCKER_NODES={}".format(",".join(cluster.docker_nodes()))
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        cluster.stop()
+
+
+if __name__ == '__main__':
+    main()
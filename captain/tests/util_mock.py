@@ -8,10 +8,11 @@ class ClientMock():
 
     def __init__(self):
         def __logs(i, stream=False):
+            # Like Docker, a stream replays what has been logged so far, after which lines 3 onwards are logged
             if stream:
-                return ("this is line {}".format(l) for l in xrange(1, 100))
+                return ("this is line {}\n".format(l) for l in xrange(1, 100))
             else:
-                return "\n".join(["this is line {}".format(l) for l in xrange(1, 3)])
+                return "".join(["this is line {}\n".format(l) for l in xrange(1, 3)])
 
         self.client_node1 = MagicMock()
         self.client_node1.containers = MagicMock(return_value=self.__containers_cmd_return_node1)
@@ -0,0 +1,112 @@
+import time
+import uuid
+import logging
+import threading
+from contextlib import contextmanager
+
+# Per thread, or per greenlet once gevent has patched threading
+_local = threading.local()
+
+
+class Trace(object):
+    """
+    The spans recorded while serving one API request, from the request thread and every fan out worker it
+    hands calls to.
+    """
+    def __init__(self, request_id=None):
+        self.request_id = request_id or uuid.uuid4().hex
+        self.start = time.time()
+        self.spans = []
+
+    def record(self, name, started, elapsed, tags):
+        # list.append is atomic, workers record without a lock
+        self.spans.append(dict(tags, name=name, start_ms=round((started - self.start) * 1000, 3),
+                               duration_ms=round(elapsed * 1000, 3)))
+
+    def elapsed_ms(self):
+        return round((time.time() - self.start) * 1000, 3)
+
+    def slowest(self, count):
+        return sorted(self.spans, key=lambda span: span["duration_ms"], reverse=True)[:count]
+
+    def breakdown(self):
+        """
+        Milliseconds spent per node and per Docker operation, with call counts, plus the total so far.
+        """
+        nodes = {}
+        for span in list(self.spans):
+            if span["name"] != "docker":
+                continue
+            operations = nodes.setdefault(span["node"], {})
+            calls, duration_ms = operations.get(span["operation"], (0, 0.0))
+            operations[span["operation"]] = (calls + 1, round(duration_ms + span["duration_ms"], 3))
+        return dict(request_id=self.request_id, total_ms=self.elapsed_ms(),
+                    nodes=dict((node, dict((operation, dict(calls=calls, ms=ms))
+                                           for operation, (calls, ms) in operations.items()))
+                               for node, operations in nodes.items()))
+
+
+def current():
+    return getattr(_local, "trace", None)
+
+
+def set_current(trace):
+    _local.trace = trace
+
+
+@contextmanager
+def activate(trace):
+    """
+    Makes trace the current trace of this thread for the duration of the block.
+    """
+    previous = current()
+    set_current(trace)
+    try:
+        yield trace
+    finally:
+        set_current(previous)
+
+
+def bind(fn):
+    """
+    Wraps fn so that it runs under the trace current at the time of wrapping, for calls handed to other
+    threads or greenlets.
+    """
+    trace = current()
+    if trace is None:
+        return fn
+
+    def traced(*args, **kwargs):
+        with activate(trace):
+            return fn(*args, **kwargs)
+    return traced
+
+
+@contextmanager
+def span(name, **tags):
+    """
+    Times the block as a span of the current trace, doing nothing when there is none.
+    """
+    trace = current()
+    if trace is None:
+        yield
+        return
+    started = time.time()
+    try:
+        yield
+    except Exception as e:
+        tags["error"] = type(e).__name__
+        raise
+    finally:
+        trace.record(name, started, time.time() - started, tags)
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    Adds the request id of the current trace to every log record, so logs from fan out workers can be
+    correlated with the request that caused them.
+    """
+    def filter(self, record):
+        trace = current()
+        record.request_id = trace.request_id if trace is not None else None
+        return True
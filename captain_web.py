@@ -1,33 +1,107 @@
-from flask import Flask, request, redirect, Response, current_app
+from flask import Flask, request, redirect, Response, current_app, g
 from flask.ext import restful
 from flask.ext.restful import reqparse
-from captain.config import Config
+from captain.config import Config, gzip_level
 from captain.connection import Connection
+from captain.shared_inventory import InventoryPoller
+from captain.state_cache import StateCheckpointer
+from captain.reconciler import ReconcileLoop, make_spec
+from captain.health import HealthProber
 from captain import exceptions
+from captain import deploy
+from captain.logs import setup_logging
+from captain.metrics import Registry
+from captain import tracing
+from captain.profiler import SamplingProfiler, ProfilerBusyException, folded
+from captain.log_filter import LogFilter
+from captain.log_archive import log_archive
+from captain.compression import GzipMiddleware, FLUSH_EACH_CHUNK
+from captain import routes
 import socket
 import json
+import re
+import time
+import hmac
 import logging
-import logging.config
 
 
 # Logging
-logging.config.fileConfig("logging.conf")
+setup_logging()
 logger = logging.getLogger('captain_web')
 
 app = Flask(__name__)
 app.debug = True
+app.wsgi_app = GzipMiddleware(app.wsgi_app, level=gzip_level())
 api = restful.Api(app, catch_all_404s=True)
 
+web_metrics = Registry()
+request_seconds = web_metrics.histogram("captain_http_request_duration_seconds", "API requests by resource, method and status",
+                                        ("resource", "method", "status"))
+
+
+@app.before_request
+def start_timer():
+    g.request_start = time.time()
+    g.trace = tracing.Trace(request.headers.get('X-Request-Id'))
+    tracing.set_current(g.trace)
+
+
+@app.after_request
+def record_request(response):
+    # Streamed log responses are only timed until their headers are ready
+    if hasattr(g, 'request_start'):
+        request_seconds.observe((request.endpoint or "unmatched", request.method, str(response.status_code)),
+                                time.time() - g.request_start)
+    trace = getattr(g, 'trace', None)
+    if trace is not None:
+        response.headers['X-Request-Id'] = trace.request_id
+        if request.args.get('trace') == '1' or request.headers.get('X-Captain-Trace') == '1':
+            response.headers['X-Captain-Trace'] = json.dumps(trace.breakdown(), sort_keys=True)
+        captain_conn = getattr(current_app, '_persistent_captain_conn', None)
+        if captain_conn is not None and trace.elapsed_ms() > captain_conn.config.slow_request_ms:
+            logger.warn(dict(message='Slow request {} {} took {} ms'.format(request.method, request.path, trace.elapsed_ms()),
+                             breakdown=trace.breakdown(), slowest_spans=trace.slowest(10)))
+    return response
+
+
+@app.teardown_request
+def end_trace(exception):
+    tracing.set_current(None)
+
 
 def get_captain_conn():
     logger.debug(dict(message='Getting captain connection'))
     persistent_captain_conn = getattr(current_app, '_persistent_captain_conn', None)
     if persistent_captain_conn is None:
         logger.debug(dict(message='No persistent captain connection, creating one'))
-        persistent_captain_conn = current_app._persistent_captain_conn = Connection(Config())
+        config = Config()
+        persistent_captain_conn = current_app._persistent_captain_conn = Connection(config)
+        if persistent_captain_conn.shared_inventory is not None:
+            logger.debug(dict(message='Starting shared inventory poller'))
+            InventoryPoller(persistent_captain_conn, persistent_captain_conn.shared_inventory,
+                            config.shared_inventory_interval).start()
+        if persistent_captain_conn.state_cache is not None:
+            logger.debug(dict(message='Starting state checkpointer'))
+            StateCheckpointer(persistent_captain_conn, persistent_captain_conn.state_cache,
+                              config.state_cache_interval).start()
+        if config.health_interval > 0:
+            logger.debug(dict(message='Starting health prober'))
+            HealthProber(persistent_captain_conn, config.health_interval, config.health_concurrency,
+                         config.health_timeout, path=config.health_path).start()
+        if config.reconcile_interval > 0:
+            logger.debug(dict(message='Starting reconciler'))
+            lock_path = config.desired_state_path + '.lock' if config.desired_state_path else None
+            ReconcileLoop(persistent_captain_conn.reconciler, config.reconcile_interval, lock_path=lock_path).start()
     return persistent_captain_conn
 
 
+def stale_headers(captain_conn):
+    # Checked before reading so that a response is never labelled fresh when it was served from a checkpoint
+    if captain_conn.serving_stale_state:
+        return {'X-Captain-Stale': 'true'}
+    return {}
+
+
 class RestCache(restful.Resource):
     def get(self):
         logger.debug(dict(message='Getting cached instance data'))
@@ -40,11 +114,49 @@ class RestCache(restful.Resource):
         return captain_conn._get_lru_instance_details.cache_clear()
 
 
+class RestPools(restful.Resource):
+    def get(self):
+        logger.debug(dict(message='Getting docker connection pool stats'))
+        captain_conn = get_captain_conn()
+        return captain_conn.get_pool_stats()
+
+
+class RestMetrics(restful.Resource):
+    def get(self):
+        captain_conn = get_captain_conn()
+        return Response(web_metrics.render() + captain_conn.metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def require_debug_token(captain_conn):
+    token = captain_conn.config.debug_token
+    if not token:
+        restful.abort(404)
+    presented = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(str(presented), str('Bearer ' + token)):
+        restful.abort(401)
+
+
+class RestProfile(restful.Resource):
+    def get(self):
+        captain_conn = get_captain_conn()
+        require_debug_token(captain_conn)
+        parser = reqparse.RequestParser()
+        parser.add_argument('seconds', type=float, location='args', default=10)
+        args = parser.parse_args()
+        logger.info(dict(message='Profiling for {} seconds'.format(args.seconds)))
+        try:
+            samples = SamplingProfiler().profile(args.seconds)
+        except ProfilerBusyException:
+            restful.abort(409, message="A profile is already being taken")
+        return Response(folded(samples), mimetype='text/plain')
+
+
 class RestInstances(restful.Resource):
     def get(self):
         logger.debug(dict(message='Getting instances'))
         captain_conn = get_captain_conn()
-        return captain_conn.get_instances()
+        headers = stale_headers(captain_conn)
+        return captain_conn.current_health().annotate(captain_conn.get_instances()), 200, headers
 
     def post(self):
         logger.debug(dict(message='Starting instance'))
@@ -52,6 +164,14 @@ class RestInstances(restful.Resource):
             restful.abort(400)
 
         instance_request = request.json
+        if request.headers.get('Idempotency-Key'):
+            instance_request["request_key"] = request.headers['Idempotency-Key']
+        if request.args.get('async') == '1':
+            captain_conn = get_captain_conn()
+            job = captain_conn.jobs.submit("start_instance", deploy.start_instance_job(captain_conn, instance_request),
+                                           request=instance_request)
+            logger.debug(dict(message='Starting instance in job {}'.format(job.id)))
+            return job.to_dict(), 202, {'Location': api.url_for(RestJob, job_id=job.id)}
         try:
             captain_conn = get_captain_conn()
             instance_response = captain_conn.start_instance(**instance_request)
@@ -59,16 +179,33 @@ class RestInstances(restful.Resource):
         except exceptions.NodeOutOfCapacityException:
             restful.abort(503,
                           message="There aren't enough free slots on {} to service your request".format(instance_request["node"]))
+        except exceptions.NodeUnschedulableException:
+            restful.abort(503, message="{} is being drained and takes no new instances".format(instance_request["node"]))
 
         return instance_response, 201
 
+    def delete(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('app', type=str, location='args')
+        parser.add_argument('node', type=str, location='args')
+        parser.add_argument('id', type=str, location='args', action='append', dest='ids')
+        parser.add_argument('timeout', type=int, location='args')
+        args = parser.parse_args()
+        if args.app is None and args.node is None and args.ids is None:
+            restful.abort(400, message="Give an app, a node or instance ids to stop")
+        logger.info(dict(message='Stopping instances of app {} on node {} with ids {}'.format(args.app, args.node, args.ids)))
+        captain_conn = get_captain_conn()
+        return captain_conn.stop_instances(app=args.app, node=args.node, ids=args.ids, timeout=args.timeout)
+
 
 class RestInstance(restful.Resource):
     def get(self, instance_id):
         try:
             logger.debug(dict(message='Getting instance data for {}'.format(instance_id)))
             captain_conn = get_captain_conn()
-            return filter(lambda instance: instance["id"] == instance_id, captain_conn.get_instances())[0]
+            headers = stale_headers(captain_conn)
+            return captain_conn.current_health().annotate(
+                filter(lambda instance: instance["id"] == instance_id, captain_conn.get_instances()))[0], 200, headers
         except IndexError:
             restful.abort(404)
 
@@ -100,16 +237,159 @@ class RestInstanceLogs(restful.Resource):
     def get(self, instance_id):
         parser = reqparse.RequestParser()
         parser.add_argument('follow', type=int, location='args', default=0)
+        parser.add_argument('grep', type=str, location='args')
+        parser.add_argument('invert', type=str, location='args')
+        parser.add_argument('field', type=unicode, location='args', action='append', dest='fields')
         args = parser.parse_args()
+        try:
+            line_filter = LogFilter(grep=args.grep, invert=args.invert, fields=LogFilter.parse_fields(args.fields))
+        except (re.error, ValueError) as e:
+            restful.abort(400, message=str(e))
 
+        if args.follow == 1:
+            request.environ[FLUSH_EACH_CHUNK] = True
         try:
             captain_conn = get_captain_conn()
-            r = Response(("{}\n".format(json.dumps(l)) for l in captain_conn.get_logs(instance_id, follow=args.follow == 1)), mimetype='application/jsonstream')
+            r = Response(("{}\n".format(json.dumps(l)) for l in captain_conn.get_logs(instance_id, follow=args.follow == 1, line_filter=line_filter)), mimetype='application/jsonstream')
             return r
         except exceptions.NoSuchInstanceException:
             restful.abort(404)
 
 
+class RestLogArchive(restful.Resource):
+    def get(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('app', type=str, location='args')
+        parser.add_argument('node', type=str, location='args')
+        parser.add_argument('id', type=str, location='args', action='append', dest='ids')
+        args = parser.parse_args()
+        if args.app is None and args.node is None and args.ids is None:
+            restful.abort(400, message="Give an app, a node or instance ids to archive the logs of")
+        captain_conn = get_captain_conn()
+        instances = captain_conn.find_instances(app=args.app, node=args.node, ids=args.ids)
+        if not instances:
+            restful.abort(404)
+        logger.info(dict(message='Archiving logs of {} instances'.format(len(instances))))
+        name = "logs-{}.tar.gz".format(args.app or args.node or "instances")
+        return Response(log_archive(captain_conn, instances), mimetype='application/gzip',
+                        headers={'Content-Disposition': 'attachment; filename="{}"'.format(name)})
+
+
+class RestAppRollout(restful.Resource):
+    def post(self, app_name):
+        logger.debug(dict(message='Rolling out {}'.format(app_name)))
+        rollout_request = request.json
+        if not rollout_request or not rollout_request.get("slug_uri"):
+            restful.abort(400, message="slug_uri is required")
+        try:
+            batch_size = int(rollout_request.get("batch_size", 1))
+        except (TypeError, ValueError):
+            batch_size = 0
+        if batch_size < 1:
+            restful.abort(400, message="batch_size should be at least 1")
+        if not isinstance(rollout_request.get("environment") or {}, dict):
+            restful.abort(400, message="environment should be an object")
+        slots = rollout_request.get("slots")
+        if slots is not None and (not isinstance(slots, int) or isinstance(slots, bool) or slots < 1):
+            restful.abort(400, message="slots should be at least 1")
+        captain_conn = get_captain_conn()
+        if captain_conn.desired_state.get(app_name) is not None:
+            restful.abort(409, message="{} is reconciled to its desired state, PUT a new one to /desired/{} to roll it out".format(
+                app_name, app_name))
+        job = captain_conn.jobs.submit(
+            "rollout",
+            deploy.rollout_job(captain_conn, app_name, rollout_request["slug_uri"],
+                               environment=rollout_request.get("environment"), slots=rollout_request.get("slots"),
+                               batch_size=batch_size),
+            request=dict(rollout_request, app=app_name))
+        return job.to_dict(), 202, {'Location': api.url_for(RestJob, job_id=job.id)}
+
+
+class RestDesiredState(restful.Resource):
+    def get(self):
+        captain_conn = get_captain_conn()
+        return captain_conn.reconciler.status(), 200, stale_headers(captain_conn)
+
+
+class RestDesiredApp(restful.Resource):
+    def get(self, app_name):
+        captain_conn = get_captain_conn()
+        spec = captain_conn.desired_state.get(app_name)
+        if spec is None:
+            restful.abort(404)
+        return spec
+
+    def put(self, app_name):
+        logger.debug(dict(message='Setting desired state of {}'.format(app_name)))
+        captain_conn = get_captain_conn()
+        try:
+            spec = make_spec(request.json, captain_conn.config.default_slots_per_instance)
+        except ValueError as e:
+            restful.abort(400, message=str(e))
+        captain_conn.desired_state.set(app_name, spec)
+        return spec
+
+    def delete(self, app_name):
+        logger.debug(dict(message='No longer reconciling {}'.format(app_name)))
+        captain_conn = get_captain_conn()
+        if not captain_conn.desired_state.remove(app_name):
+            restful.abort(404)
+        return ({}, 204)
+
+
+class RestReconcile(restful.Resource):
+    def post(self):
+        captain_conn = get_captain_conn()
+        release = captain_conn.reconciler.claim_pass()
+        if release is None:
+            restful.abort(409, message="A reconcile pass is already running")
+
+        def reconcile(job):
+            try:
+                return captain_conn.reconciler.reconcile()
+            finally:
+                release()
+        try:
+            job = captain_conn.jobs.submit("reconcile", reconcile)
+        except:
+            release()
+            raise
+        return job.to_dict(), 202, {'Location': api.url_for(RestJob, job_id=job.id)}
+
+
+class RestJobs(restful.Resource):
+    def get(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('kind', type=str, location='args')
+        args = parser.parse_args()
+        captain_conn = get_captain_conn()
+        return captain_conn.jobs.recent(kind=args.kind)
+
+
+class RestJob(restful.Resource):
+    def get(self, job_id):
+        captain_conn = get_captain_conn()
+        job = captain_conn.jobs.get(job_id)
+        if job is None:
+            restful.abort(404)
+        return job
+
+
+class RestRoutes(restful.Resource):
+    def get(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('format', type=str, location='args', default='json', choices=sorted(routes.FORMATS))
+        args = parser.parse_args()
+        captain_conn = get_captain_conn()
+        headers = stale_headers(captain_conn)
+        render, mimetype = routes.FORMATS[args.format]
+        body = render(captain_conn.get_routes())
+        response = Response(body, mimetype=mimetype, headers=headers)
+        # Weak, as the body may reach the client gzipped or not. Set by hand, werkzeug writes a lowercase w/
+        response.headers['ETag'] = 'W/"{}"'.format(routes.etag(body))
+        return response.make_conditional(request)
+
+
 class RestPing(restful.Resource):
     def get(self):
         return ({}, 204)
@@ -119,16 +399,25 @@ class RestInstancesSummary(restful.Resource):
     def get(self):
         logger.debug(dict(message='getting summary of running instances on all nodes'))
         captain_conn = get_captain_conn()
+        headers = stale_headers(captain_conn)
         summary = captain_conn.get_instance_summary()
         logger.debug(dict(message='instance summary {}'.format(summary)))
-        return summary
+        return summary, 200, headers
 
 
 api.add_resource(RestInstances, '/instances/')
 api.add_resource(RestInstance, '/instances/<string:instance_id>')
 api.add_resource(RestInstanceLogs, '/instances/<string:instance_id>/logs')
+api.add_resource(RestLogArchive, '/logs/archive')
 api.add_resource(RestPing, '/ping/ping')
+api.add_resource(RestJobs, '/jobs/')
+api.add_resource(RestAppRollout, '/apps/<string:app_name>/rollout')
+api.add_resource(RestJob, '/jobs/<string:job_id>')
+api.add_resource(RestDesiredState, '/desired/')
+api.add_resource(RestDesiredApp, '/desired/<string:app_name>')
+api.add_resource(RestReconcile, '/reconcile')
 api.add_resource(RestInstancesSummary, '/instances_summary/')
+api.add_resource(RestRoutes, '/routes')
 
 
 class RestNodes(restful.Resource):
@@ -149,9 +438,42 @@ class RestNode(restful.Resource):
         except exceptions.NoSuchNodeException:
             restful.abort(404)
 
+
+
+class RestNodeDrain(restful.Resource):
+    def post(self, node_id):
+        captain_conn = get_captain_conn()
+        if node_id not in captain_conn.node_connections:
+            restful.abort(404)
+        if not captain_conn.config.desired_state_path:
+            restful.abort(503, message="Draining needs DESIRED_STATE_PATH, so that every worker stops placing "
+                                       "instances on the node and a restart does not forget it")
+        if not captain_conn.config.jobs_path:
+            restful.abort(503, message="Draining needs JOBS_PATH, so that two workers never drain the same node at once")
+        logger.info(dict(message='Draining {}'.format(node_id)))
+        captain_conn.desired_state.set_schedulable(node_id, False)
+        try:
+            job = captain_conn.jobs.submit("drain", deploy.drain_job(captain_conn, node_id), request=dict(node=node_id),
+                                           exclusive=True)
+        except exceptions.JobInProgressException as e:
+            restful.abort(409, message="{} is already being drained by job {}".format(node_id, e.job["id"]))
+        return job.to_dict(), 202, {'Location': api.url_for(RestJob, job_id=job.id)}
+
+    def delete(self, node_id):
+        captain_conn = get_captain_conn()
+        if node_id not in captain_conn.node_connections:
+            restful.abort(404)
+        logger.info(dict(message='{} takes new instances again'.format(node_id)))
+        captain_conn.desired_state.set_schedulable(node_id, True)
+        return ({}, 204)
+
 api.add_resource(RestNodes, '/nodes/')
 api.add_resource(RestNode, '/nodes/<string:node_id>')
+api.add_resource(RestNodeDrain, '/nodes/<string:node_id>/drain')
 api.add_resource(RestCache, '/cache')
+api.add_resource(RestPools, '/pools')
+api.add_resource(RestMetrics, '/metrics')
+api.add_resource(RestProfile, '/debug/profile')
 
 if __name__ == '__main__':
     app.run(debug=True, port=1234)